@@ -1,28 +1,39 @@
 import cv2
 import os
 
+import page_store
+import page_triage
+import pdf_pages
+
 print("=" * 60)
 print("ANALYZING SCAN CONTENT - FIXED")
 print("=" * 60)
 
 scans_folder = "scans"
-files = os.listdir(scans_folder)
+files = sorted(os.listdir(scans_folder))
+triage = page_triage.Triage()
+# With ART_STORE set, later runs map the pages and their maps from page_store/
+store = page_store.PageStore()
+skipped = 0
+triaged = 0
 
-print("Analysis of first 4 files:\n")
+print(f"Analysis of all {len(files)} files:\n")
 
-for i, file_name in enumerate(files[:4], 1):
+for i, file_name in enumerate(files, 1):
     file_path = os.path.join(scans_folder, file_name)
-    img = cv2.imread(file_path)
+    stored = store.page(file_path) if file_name.lower().endswith(pdf_pages.IMAGE_EXTS) else None
     
-    if img is not None:
+    if stored is not None:
+        img = stored.image()
+        full = stored.level()
         print(f"{i}. {file_name}")
         print(f"   Size: {img.shape[1]}x{img.shape[0]} pixels")
         
         # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = full.gray()
         
         # Check edge density
-        edges = cv2.Canny(gray, 50, 150)
+        edges = full.canny(50, 150, "gray")
         edge_density = cv2.countNonZero(edges) / (img.shape[0] * img.shape[1])
         
         if edge_density > 0.1:
@@ -42,8 +53,21 @@ for i, file_name in enumerate(files[:4], 1):
         
         print(f"   Large distinct regions: {large_regions}")
         
+        # Same decision scan_pipeline.py and ml_art_detector.py make before detecting
+        # when their TRIAGE flag is on
+        thumb = stored.level(page_triage.THUMB_SIDE)
+        has_art, score, features = triage.check(thumb.image(), thumb)
+        skipped += not has_art
+        triaged += 1
+        verdict = "artwork, would be searched" if has_art else "text only, would be skipped"
+        print(f"   Triage: {verdict} (score {score:.2f}, picture cells {features['picture_cells']:.3f})")
+        
         # Quick visual check
         if "painting" in file_name.lower() or "studies" in file_name.lower():
             print("   NOTE: Name suggests artwork content")
         
-        print()
\ No newline at end of file
+        print()
+
+store.prune()
+store.close()
+print(f"Triage skips {skipped} of {triaged} pages")
\ No newline at end of file
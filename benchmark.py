@@ -0,0 +1,297 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import instrumentation as metrics
+import page_triage
+from synthetic_pages import make_page
+import tiled_page
+
+IOU_MATCH = 0.5
+# Artwork boxes of the bundled scans, in threshold_sweep.py's format
+LABELS_PATH = "box_labels.csv"
+
+
+# Every detector takes a BGR page and returns (x, y, w, h) boxes
+
+def detect_scan_pipeline(img):
+    import scan_pipeline
+    return scan_pipeline.detect_boxes(img)
+
+
+def detect_ml_art_detector(img):
+    import ml_art_detector
+    return ml_art_detector.detect_artworks(img)[1]
+
+
+def detect_simple_pipeline(img):
+    import simple_pipeline
+    return simple_pipeline.find_regions(img)
+
+
+def _contour_boxes(contours, min_area=10000):
+    return [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > min_area]
+
+
+def detect_edges(img):
+    import test_artwork_file
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    return _contour_boxes(test_artwork_file.method_edges(blur))
+
+
+def detect_saturation(img):
+    import test_artwork_file
+    return _contour_boxes(test_artwork_file.method_saturation(img))
+
+
+def detect_nonwhite(img):
+    import test_artwork_file
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    found = test_artwork_file.largest_region(test_artwork_file.method_nonwhite(gray))
+    return [found[0]] if found else []
+
+
+def detect_fused(img):
+    import fused_detector
+    return fused_detector.detect_boxes(img)
+
+
+DETECTORS = {
+    "scan_pipeline": detect_scan_pipeline,
+    "ml_art_detector": detect_ml_art_detector,
+    "simple_pipeline": detect_simple_pipeline,
+    "edges": detect_edges,
+    "saturation": detect_saturation,
+    "nonwhite": detect_nonwhite,
+    "fused": detect_fused,
+}
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def match_boxes(predicted, truth, threshold=IOU_MATCH):
+    """Greedy one-to-one matching by IoU. Returns (true positives, false positives, false negatives)."""
+    pairs = sorted(((iou(p, t), i, j) for i, p in enumerate(predicted) for j, t in enumerate(truth)),
+                   reverse=True)
+    used_p, used_t = set(), set()
+    for score, i, j in pairs:
+        if score < threshold:
+            break
+        if i not in used_p and j not in used_t:
+            used_p.add(i)
+            used_t.add(j)
+    tp = len(used_p)
+    return tp, len(predicted) - tp, len(truth) - tp
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it can't be read."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except (ImportError, AttributeError):
+            return None
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+
+def bench_detector(name, pages):
+    """Run one detector over (path, truth_or_None) pages. Runs in its own process,
+    so peak RSS belongs to this detector alone. Besides decode, detect and the
+    crop writes, every stage the detector times through instrumentation.py
+    (resize, pyramid, canny, components, filter, fuse...) is reported."""
+    detect = DETECTORS[name]
+    # Recording is switched on in this worker process only
+    metrics.ENABLED = True
+    timings = []
+    tp = fp = fn = 0
+    labelled = False
+    start = time.perf_counter()
+    crops = tempfile.TemporaryDirectory()
+
+    for path, truth in pages:
+        record = metrics.new_page(path, name)
+        with metrics.recording(record):
+            with metrics.stage("decode"):
+                img = cv2.imread(path)
+            with metrics.stage("detect"):
+                boxes = detect(img)
+            # Same JPEG crops the pipelines write
+            with metrics.stage("write"):
+                for i, (x, y, w, h) in enumerate(boxes):
+                    tiled_page.write_image(os.path.join(crops.name, f"crop_{i}.jpg"), img[y:y+h, x:x+w])
+        timings.append(record["timings"])
+        if truth is not None:
+            labelled = True
+            a, b, c = match_boxes(boxes, truth)
+            tp, fp, fn = tp + a, fp + b, fn + c
+        del img
+
+    wall = time.perf_counter() - start
+    crops.cleanup()
+    # Stages in the order they first ran; a page that skipped a stage counts 0
+    names = list(dict.fromkeys(s for t in timings for s in t))
+    result = {
+        "detector": name,
+        "pages": len(pages),
+        "pages_per_sec": len(pages) / wall if wall > 0 else 0.0,
+        "decode_sec": percentiles([t["decode"] for t in timings]),
+        "detect_sec": percentiles([t["detect"] for t in timings]),
+        "stages_sec": {s: percentiles([t.get(s, 0.0) for t in timings]) for s in names},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if labelled:
+        result["precision"] = tp / (tp + fp) if tp + fp else 0.0
+        result["recall"] = tp / (tp + fn) if tp + fn else 0.0
+    return result
+
+
+def synthetic_set(folder, sizes, per_size, seed=0):
+    """Write synthetic pages to folder. Returns [(path, truth boxes)]."""
+    pages = []
+    for size in sizes:
+        for i in range(per_size):
+            img, truth = make_page(size, seed=seed + size * 1000 + i)
+            path = os.path.join(folder, f"synthetic_{size}_{i}.png")
+            cv2.imwrite(path, img)
+            pages.append((path, truth))
+    return pages
+
+
+def scans_set(folder, labels=LABELS_PATH):
+    """The bundled scans as a smoke benchmark. Scans with rows in labels
+    (page,x,y,w,h as for threshold_sweep.py) are scored; the rest are timed only."""
+    truth = {}
+    if labels and os.path.exists(labels):
+        with open(labels, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                boxes = truth.setdefault(row["page"], [])
+                if row.get("x"):
+                    boxes.append(tuple(int(row[k]) for k in ("x", "y", "w", "h")))
+    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    return [(os.path.join(folder, f), truth.get(f)) for f in files]
+
+
+def triage_check(title, pages):
+    """Recall of page triage on (path, has_artwork_or_None) pages: the share of
+    artwork pages it lets through. Every page it would skip is listed."""
+    triage = page_triage.load()
+    skipped, art, kept_art = [], 0, 0
+    for path, has_art in pages:
+        result = triage.check_file(path)
+        if result is None:
+            continue
+        passed, score, _ = result
+        if not passed:
+            skipped.append((os.path.basename(path), score, has_art))
+        if has_art:
+            art += 1
+            kept_art += passed
+    recall = kept_art / art if art else None
+
+    model = "triage_model.json" if os.path.exists(page_triage.MODEL_PATH) else "built-in cut"
+    print(f"\n{title}: triage ({model}) skips {len(skipped)} of {len(pages)} pages")
+    for name, score, has_art in skipped:
+        note = "  <- has artwork" if has_art else ""
+        print(f"  skipped {name} (score {score:.2f}){note}")
+    if recall is not None:
+        print(f"  Artwork pages kept (recall): {kept_art}/{art} = {recall:.2f}")
+    return {"pages": len(pages), "skipped": [s[0] for s in skipped], "recall": recall}
+
+
+def print_results(title, results):
+    print(f"\n{title}")
+    print(f"  {'detector':<16} {'pages/s':>8} {'detect p50':>11} {'p90':>8} {'p99':>8} "
+          f"{'decode p50':>11} {'peak MB':>8} {'prec':>6} {'recall':>6}")
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+        prec = f"{r['precision']:.2f}" if "precision" in r else "-"
+        rec = f"{r['recall']:.2f}" if "recall" in r else "-"
+        d = r["detect_sec"]
+        print(f"  {r['detector']:<16} {r['pages_per_sec']:8.2f} {d['p50']:11.3f} {d['p90']:8.3f} "
+              f"{d['p99']:8.3f} {r['decode_sec']['p50']:11.3f} {rss:>8} {prec:>6} {rec:>6}")
+    print("  Stage p50 / p90 in ms (stages inside detect are part of its time):")
+    for r in results:
+        stages = "  ".join(f"{s} {p['p50'] * 1000:.1f}/{p['p90'] * 1000:.1f}"
+                           for s, p in r["stages_sec"].items())
+        print(f"  {r['detector']:<16} {stages}")
+
+
+def run(title, pages, detectors):
+    results = []
+    for name in detectors:
+        # A fresh process per detector keeps peak RSS and warm caches separate
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results.append(pool.submit(bench_detector, name, pages).result())
+    print_results(title, results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speed and quality benchmark for the artwork detectors")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 10000],
+                        help="long side of the synthetic pages, in pixels")
+    parser.add_argument("--pages", type=int, default=5, help="synthetic pages per size")
+    parser.add_argument("--detectors", nargs="+", default=list(DETECTORS), choices=list(DETECTORS))
+    parser.add_argument("--scans", default=None,
+                        help="also run on this folder of real scans (e.g. Scans) as a smoke test")
+    parser.add_argument("--json", default=None, help="write all results to this JSON file")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("DETECTOR BENCHMARK")
+    print("=" * 60)
+
+    report = {}
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"Generating {args.pages} synthetic pages at each size {args.sizes}...")
+        pages = synthetic_set(folder, args.sizes, args.pages)
+        report["synthetic"] = run("Synthetic pages (ground truth)", pages, args.detectors)
+        report["triage"] = {"synthetic": triage_check("Synthetic pages",
+                                                      [(p, bool(t)) for p, t in pages])}
+
+    if args.scans:
+        scans = scans_set(args.scans)
+        report["scans"] = run(f"Smoke test: {args.scans}/", scans, args.detectors)
+        # Which scans have artwork comes from the triage labels, where there are any
+        labels = page_triage.load_labels() if os.path.exists(page_triage.LABELS_PATH) else {}
+        report["triage"]["scans"] = triage_check(
+            f"{args.scans}/", [(p, labels.get(os.path.basename(p), None if t is None else bool(t))) for p, t in scans])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+def _find(parent, i):
+    # Path halving keeps the trees flat
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _union(parent, a, b):
+    ra, rb = _find(parent, a), _find(parent, b)
+    if ra != rb:
+        # Smaller index wins, so the result does not depend on visiting order
+        if rb < ra:
+            ra, rb = rb, ra
+        parent[rb] = ra
+
+
+def close_enough(a, b, gap):
+    """True if boxes a and b overlap or their edges are less than gap apart."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = max(ax, bx) - min(ax + aw, bx + bw)
+    dy = max(ay, by) - min(ay + ah, by + bh)
+    return dx < gap and dy < gap
+
+
+def _fuse_once(boxes, gap):
+    n = len(boxes)
+    if n < 2:
+        return boxes
+
+    # Grid cells about the size of a typical box: each box lands in a few cells
+    sizes = sorted(max(w, h) for (_, _, w, h) in boxes)
+    cell = max(1, sizes[n // 2] + max(gap, 0))
+    grid = defaultdict(list)
+    parent = list(range(n))
+
+    for i, (x, y, w, h) in enumerate(boxes):
+        # Cells this box could touch once grown by gap
+        x0, y0 = (x - gap) // cell, (y - gap) // cell
+        x1, y1 = (x + w + gap) // cell, (y + h + gap) // cell
+        seen = set()
+        for gx in range(x0, x1 + 1):
+            for gy in range(y0, y1 + 1):
+                bucket = grid[(gx, gy)]
+                for j in bucket:
+                    if j not in seen:
+                        seen.add(j)
+                        if close_enough(boxes[i], boxes[j], gap):
+                            _union(parent, i, j)
+                bucket.append(i)
+
+    groups = {}
+    for i in range(n):
+        root = _find(parent, i)
+        x, y, w, h = boxes[i]
+        if root not in groups:
+            groups[root] = [x, y, x + w, y + h]
+        else:
+            g = groups[root]
+            g[0], g[1] = min(g[0], x), min(g[1], y)
+            g[2], g[3] = max(g[2], x + w), max(g[3], y + h)
+
+    return [(x0, y0, x1 - x0, y1 - y0) for (x0, y0, x1, y1) in
+            (groups[r] for r in sorted(groups))]
+
+
+def fuse_boxes(boxes, gap=0):
+    """Merge every group of boxes connected by overlap or proximity (< gap pixels)
+    into its bounding box. Union-find over a uniform grid index, so the cost is
+    near-linear in the number of boxes. Output is ordered by first member."""
+    boxes = [tuple(int(v) for v in b) for b in boxes]
+    gap = int(round(gap))
+    # A merged box can reach boxes none of its members touched; repeat until stable
+    while True:
+        fused = _fuse_once(boxes, gap)
+        if len(fused) == len(boxes):
+            return fused
+        boxes = fused
+
+
+def suppress_boxes(boxes, min_overlap=0.5):
+    """Non-maximum suppression for boxes without scores, for detectors whose
+    boxes overlap by construction (grid cells at a stride shorter than the
+    cell). Larger boxes are kept first; a box is dropped when at least
+    min_overlap of the smaller of it and a kept box is covered by their
+    intersection. Boxes are only compared with kept boxes and never grown, so
+    a row of neighbouring cells cannot chain into one page-sized box. Output
+    keeps the input order."""
+    if not len(boxes):
+        return []
+    b = np.array([tuple(int(v) for v in box) for box in boxes], np.int64)
+    x0, y0 = b[:, 0], b[:, 1]
+    x1, y1 = x0 + b[:, 2], y0 + b[:, 3]
+    area = b[:, 2] * b[:, 3]
+    kept = []
+    for i in np.argsort(-area, kind="stable").tolist():
+        if kept:
+            k = np.array(kept)
+            w = np.minimum(x1[k], x1[i]) - np.maximum(x0[k], x0[i])
+            h = np.minimum(y1[k], y1[i]) - np.maximum(y0[k], y0[i])
+            inter = np.maximum(w, 0) * np.maximum(h, 0)
+            if np.any(inter >= min_overlap * np.minimum(area[k], area[i])):
+                continue
+        kept.append(i)
+    return [tuple(b[i].tolist()) for i in sorted(kept)]
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import random
+
+import cv2
+import numpy as np
+
+IMG_SIZE = 224
+SHARD_SIZE = 1024          # images per shard file (~150 MB of uint8 pixels)
+VALIDATION_SPLIT = 0.2
+# Items are shuffled with this seed before sharding, so every shard mixes the
+# classes and the same folder always gives the same shards
+SHUFFLE_SEED = 1337
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+
+
+def list_classes(data_dir):
+    """Class folders and their image files, sorted the way flow_from_directory does."""
+    classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    files = {}
+    for name in classes:
+        found = []
+        for root, _, names in os.walk(os.path.join(data_dir, name)):
+            found += [os.path.join(root, f) for f in names if f.lower().endswith(IMAGE_EXTS)]
+        files[name] = sorted(found)
+    return classes, files
+
+
+def split_files(classes, files, validation_split=VALIDATION_SPLIT):
+    """Same split as ImageDataGenerator(validation_split=...): the first part of
+    each class's sorted file list is validation, the rest training."""
+    split = {"training": [], "validation": []}
+    for label, name in enumerate(classes):
+        n_val = int(validation_split * len(files[name]))
+        split["validation"] += [(path, label) for path in files[name][:n_val]]
+        split["training"] += [(path, label) for path in files[name][n_val:]]
+    return split
+
+
+def load_image(path, size=IMG_SIZE):
+    """Decode and resize once: RGB uint8, size x size."""
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def write_shards(items, out_dir, subset, shard_size=SHARD_SIZE):
+    """Write (path, label) items as <subset>_NNNNN_x.npy / _y.npy pairs. Returns shard info."""
+    shards = []
+    for start in range(0, len(items), shard_size):
+        images, labels, kept = [], [], []
+        for path, label in items[start:start + shard_size]:
+            img = load_image(path)
+            if img is None:
+                print(f"  [SKIP] Could not read {path}")
+                continue
+            images.append(img)
+            labels.append(label)
+            kept.append(path)
+        if not images:
+            continue
+        name = f"{subset}_{len(shards):05d}"
+        np.save(os.path.join(out_dir, name + "_x.npy"), np.stack(images))
+        np.save(os.path.join(out_dir, name + "_y.npy"), np.array(labels, np.float32))
+        shards.append({"name": name, "count": len(images), "files": kept})
+        print(f"  {name}: {len(images)} images")
+    return shards
+
+
+def build(data_dir, out_dir, validation_split=VALIDATION_SPLIT):
+    """Convert a class-per-folder dataset into pre-resized shards plus split.json."""
+    os.makedirs(out_dir, exist_ok=True)
+    classes, files = list_classes(data_dir)
+    split = split_files(classes, files, validation_split)
+    # split_files lists each class in turn: without this, shards (and the
+    # shard-sized shuffle buffer in make_dataset) would hold one class each
+    for subset in split:
+        random.Random(SHUFFLE_SEED).shuffle(split[subset])
+    info = {"source": data_dir, "image_size": IMG_SIZE, "validation_split": validation_split,
+            "shuffle_seed": SHUFFLE_SEED,
+            "class_indices": {name: i for i, name in enumerate(classes)}, "subsets": {}}
+    for subset, items in split.items():
+        print(f"Writing {subset} shards ({len(items)} images)...")
+        info["subsets"][subset] = write_shards(items, out_dir, subset)
+    with open(os.path.join(out_dir, "split.json"), "w") as f:
+        json.dump(info, f, indent=1)
+    return info
+
+
+def load_split(out_dir):
+    with open(os.path.join(out_dir, "split.json")) as f:
+        return json.load(f)
+
+
+def load_arrays(out_dir, subset):
+    """All shards of a subset as memory-mapped (images, labels) arrays."""
+    info = load_split(out_dir)
+    return [(np.load(os.path.join(out_dir, s["name"] + "_x.npy"), mmap_mode="r"),
+             np.load(os.path.join(out_dir, s["name"] + "_y.npy"), mmap_mode="r"))
+            for s in info["subsets"][subset]]
+
+
+def make_dataset(out_dir, subset, batch_size=32, augment=False, shuffle=False, rescale=True):
+    """Parallel, cached, prefetching tf.data pipeline over the shards.
+
+    Shards are read in parallel, cached in memory after the first epoch,
+    batched, then flipped as whole batches (vectorized) on the fly."""
+    import tensorflow as tf
+
+    info = load_split(out_dir)
+    names = [s["name"] for s in info["subsets"][subset]]
+    total = sum(s["count"] for s in info["subsets"][subset])
+    size = info["image_size"]
+
+    def read_shard(name):
+        name = name.decode() if isinstance(name, bytes) else name
+        x = np.load(os.path.join(out_dir, name + "_x.npy"))
+        y = np.load(os.path.join(out_dir, name + "_y.npy"))
+        return x, y
+
+    def load(name):
+        x, y = tf.numpy_function(read_shard, [name], [tf.uint8, tf.float32])
+        x.set_shape([None, size, size, 3])
+        y.set_shape([None])
+        return tf.data.Dataset.from_tensor_slices((x, y))
+
+    ds = tf.data.Dataset.from_tensor_slices(names)
+    ds = ds.interleave(load, cycle_length=max(1, min(len(names), 4)),
+                       num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    ds = ds.cache()
+    if shuffle:
+        ds = ds.shuffle(min(total, 2 * SHARD_SIZE), reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size, num_parallel_calls=tf.data.AUTOTUNE)
+
+    def prepare(x, y):
+        x = tf.cast(x, tf.float32)
+        if rescale:
+            x = x / 255.0
+        if augment:
+            # One random draw per image, applied to the whole batch at once
+            flip = tf.random.uniform([tf.shape(x)[0], 1, 1, 1]) < 0.5
+            x = tf.where(flip, tf.reverse(x, axis=[2]), x)
+        return x, y
+
+    ds = ds.map(prepare, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-resize a class-per-folder dataset into shards")
+    parser.add_argument("data_dir")
+    parser.add_argument("out_dir", nargs="?", default="dataset_shards")
+    parser.add_argument("--validation-split", type=float, default=VALIDATION_SPLIT)
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("BUILDING SHARDED DATASET")
+    print("=" * 50)
+    info = build(args.data_dir, args.out_dir, args.validation_split)
+    print(f"\nClasses: {info['class_indices']}")
+    for subset, shards in info["subsets"].items():
+        print(f"{subset}: {sum(s['count'] for s in shards)} images in {len(shards)} shards")
+    print(f"Split recorded in {os.path.join(args.out_dir, 'split.json')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+
+from detection_cache import DetectionCache, params_key
+import pdf_pages
+
+CATALOGUE_PATH = "catalogue.sqlite"
+METADATA_PATH = "metadata.csv"
+
+# metadata.csv rows describe a file: a scan, or a whole PDF. Pages are linked
+# to them by their source file name, so every page of a PDF gets its metadata.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (
+        image_filename TEXT PRIMARY KEY, artist TEXT, collection TEXT, exhibition TEXT
+    );
+    CREATE INDEX IF NOT EXISTS metadata_artist ON metadata (artist);
+    CREATE INDEX IF NOT EXISTS metadata_collection ON metadata (collection);
+    CREATE INDEX IF NOT EXISTS metadata_exhibition ON metadata (exhibition);
+
+    -- One row per page (image file, or page of a PDF) with its content hash
+    CREATE TABLE IF NOT EXISTS pages (
+        name TEXT PRIMARY KEY, file TEXT, source TEXT, page_index INTEGER,
+        hash TEXT, width INTEGER, height INTEGER, seen REAL
+    );
+    CREATE INDEX IF NOT EXISTS pages_file ON pages (file);
+    CREATE INDEX IF NOT EXISTS pages_hash ON pages (hash);
+
+    -- Latest result of each detector on each page, and the page hash it was for
+    CREATE TABLE IF NOT EXISTS processed (
+        page TEXT, detector TEXT, params TEXT, hash TEXT, boxes INTEGER, processed REAL,
+        PRIMARY KEY (page, detector)
+    );
+    CREATE INDEX IF NOT EXISTS processed_detector ON processed (detector);
+
+    -- Every box, with its verifier score and crop file (NULL until written)
+    CREATE TABLE IF NOT EXISTS crops (
+        page TEXT, detector TEXT, box INTEGER,
+        x INTEGER, y INTEGER, w INTEGER, h INTEGER, score REAL, path TEXT,
+        PRIMARY KEY (page, detector, box)
+    );
+    CREATE INDEX IF NOT EXISTS crops_detector_score ON crops (detector, score);
+    CREATE INDEX IF NOT EXISTS crops_path ON crops (path);
+"""
+
+
+def page_record(name, source, index, file_hash, boxes, scores=None, size=None, crops=None):
+    """One page result, as upsert_pages takes it (same fields as a manifest line)."""
+    return {"name": name, "source": source, "page": index, "hash": file_hash,
+            "size": list(size) if size else None, "boxes": [list(map(int, b)) for b in boxes],
+            "scores": list(scores) if scores else None, "crops": list(crops) if crops else None}
+
+
+class Catalogue:
+    """Local index of scans, their metadata and every detection, so questions
+    like "crops from exhibition X with score > 0.8" are one indexed query
+    instead of a walk over the output folders."""
+
+    def __init__(self, path=CATALOGUE_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def ingest_metadata(self, path=METADATA_PATH):
+        """Upsert every row of metadata.csv. Returns the number of rows."""
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = [(r["image_filename"], r["artist"], r["collection"], r["exhibition"])
+                    for r in csv.DictReader(f)]
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def add_pages(self, folder, cache=None):
+        """Register every page of a scans folder with its content hash (hashes
+        are shared with the detection cache, so known files are only stat'ed)."""
+        own = cache is None
+        cache = cache or DetectionCache()
+        rows = []
+        for name, path, index in pdf_pages.list_pages(folder):
+            file_hash = pdf_pages.page_hash(cache.file_hash(path), index)
+            rows.append((name, os.path.basename(path), path, index, file_hash, time.time()))
+        if own:
+            cache.close()
+        with self.db:
+            # Keeps the size recorded by a detector run unless the page changed
+            self.db.executemany(
+                "INSERT INTO pages (name, file, source, page_index, hash, seen) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET file = excluded.file, source = excluded.source, "
+                "page_index = excluded.page_index, seen = excluded.seen, hash = excluded.hash, "
+                "width = CASE WHEN pages.hash = excluded.hash THEN pages.width END, "
+                "height = CASE WHEN pages.hash = excluded.hash THEN pages.height END", rows)
+        return len(rows)
+
+    def upsert_pages(self, detector, params, records):
+        """Bulk upsert of one run's page records (see page_record) in a single
+        transaction. A page's earlier boxes from this detector are replaced."""
+        now = time.time()
+        key = params_key(params)
+        pages, processed, crops = [], [], []
+        for r in records:
+            size = r.get("size") or (None, None)
+            pages.append((r["name"], os.path.basename(r["source"]), r["source"], r["page"],
+                          r["hash"], size[0], size[1], now))
+            processed.append((r["name"], detector, key, r["hash"], len(r["boxes"]), now))
+            scores = r.get("scores") or [None] * len(r["boxes"])
+            paths = r.get("crops") or [None] * len(r["boxes"])
+            crops += [(r["name"], detector, i, *box, score, path)
+                      for i, (box, score, path) in enumerate(zip(r["boxes"], scores, paths))]
+        with self.db:
+            # Size is only known for decoded pages; keep it for the others
+            self.db.executemany(
+                "INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET file = excluded.file, source = excluded.source, "
+                "page_index = excluded.page_index, hash = excluded.hash, seen = excluded.seen, "
+                "width = COALESCE(excluded.width, pages.width), "
+                "height = COALESCE(excluded.height, pages.height)", pages)
+            self.db.executemany("DELETE FROM crops WHERE page = ? AND detector = ?",
+                                [(r["name"], detector) for r in records])
+            self.db.executemany("INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?)", processed)
+            self.db.executemany("INSERT INTO crops VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", crops)
+        return len(records)
+
+    def set_crop_paths(self, page, detector, paths):
+        """Record crop files written later, e.g. by manifest export."""
+        with self.db:
+            self.db.executemany("UPDATE crops SET path = ? WHERE page = ? AND detector = ? AND box = ?",
+                                [(path, page, detector, i) for i, path in enumerate(paths)])
+
+    def crops(self, exhibition=None, artist=None, collection=None, detector=None,
+              min_score=None, written=False):
+        """Boxes with their page and metadata, filtered by any of the arguments.
+        min_score keeps only verified boxes scoring above it; written only
+        boxes whose crop file exists on record."""
+        where, args = [], []
+        for column, value in (("m.exhibition", exhibition), ("m.artist", artist),
+                              ("m.collection", collection), ("c.detector", detector)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if min_score is not None:
+            where.append("c.score > ?")
+            args.append(min_score)
+        if written:
+            where.append("c.path IS NOT NULL")
+        sql = ("SELECT c.page, c.detector, c.box, c.x, c.y, c.w, c.h, c.score, c.path, "
+               "p.source, p.page_index, p.hash, m.artist, m.collection, m.exhibition "
+               "FROM crops c JOIN pages p ON p.name = c.page "
+               "LEFT JOIN metadata m ON m.image_filename = p.file")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return [dict(row) for row in self.db.execute(sql + " ORDER BY c.page, c.box", args)]
+
+    def unprocessed(self, detector, params=None):
+        """Names of known pages the detector has no result for, or whose
+        content changed since, or (with params) that ran with other parameters."""
+        sql = ("SELECT p.name FROM pages p LEFT JOIN processed r "
+               "ON r.page = p.name AND r.detector = ? "
+               "WHERE r.page IS NULL OR r.hash IS NOT p.hash")
+        args = [detector]
+        if params is not None:
+            sql += " OR r.params != ?"
+            args.append(params_key(params))
+        return [row[0] for row in self.db.execute(sql + " ORDER BY p.name", args)]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def ingest_manifest(catalogue, path):
+    """Upsert a detector run from its manifest (see manifest.py)."""
+    with open(path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    header, pages = lines[0], lines[1:]
+    return catalogue.upsert_pages(header["detector"], header["params"], pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalogue of scans, metadata and detections")
+    sub = parser.add_subparsers(dest="command", required=True)
+    meta = sub.add_parser("metadata", help="ingest metadata.csv")
+    meta.add_argument("csv", nargs="?", default=METADATA_PATH)
+    scan = sub.add_parser("scan", help="register the pages of a folder with their hashes")
+    scan.add_argument("folder", nargs="?", default="scans")
+    man = sub.add_parser("manifest", help="ingest detector run manifests")
+    man.add_argument("paths", nargs="+")
+    crops = sub.add_parser("crops", help="list detected crops")
+    crops.add_argument("--exhibition")
+    crops.add_argument("--artist")
+    crops.add_argument("--collection")
+    crops.add_argument("--detector")
+    crops.add_argument("--min-score", type=float)
+    todo = sub.add_parser("unprocessed", help="pages a detector has not processed yet")
+    todo.add_argument("detector")
+    args = parser.parse_args()
+
+    catalogue = Catalogue()
+    if args.command == "metadata":
+        print(f"Ingested {catalogue.ingest_metadata(args.csv)} metadata rows")
+    elif args.command == "scan":
+        print(f"Registered {catalogue.add_pages(args.folder)} pages")
+    elif args.command == "manifest":
+        for path in args.paths:
+            print(f"{path}: {ingest_manifest(catalogue, path)} pages")
+    elif args.command == "crops":
+        rows = catalogue.crops(args.exhibition, args.artist, args.collection,
+                               args.detector, args.min_score)
+        for r in rows:
+            score = "" if r["score"] is None else f"  {r['score']:.2f}"
+            print(f"  {r['page']} #{r['box'] + 1} [{r['detector']}]{score}  {r['path'] or '(not written)'}")
+        print(f"{len(rows)} crops")
+    elif args.command == "unprocessed":
+        names = catalogue.unprocessed(args.detector)
+        for name in names:
+            print(f"  {name}")
+        print(f"{len(names)} pages not processed with {args.detector}")
+    catalogue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import os
 
+import pdf_pages
+
 print("=" * 50)
 print("CHECKING SCANS FOLDER")
 print("=" * 50)
@@ -28,6 +30,14 @@ if os.path.exists(scans_folder):
     print(f"\nSummary:")
     print(f"  Images: {len(images)} files")
     print(f"  PDFs: {len(pdfs)} files")
+    for f in pdfs:
+        try:
+            print(f"    {f}: {pdf_pages.page_count(os.path.join(scans_folder, f))} pages")
+        except ImportError:
+            print("    (install PyMuPDF to count PDF pages: pip install pymupdf)")
+            break
+        except Exception as e:
+            print(f"    {f}: could not open ({e})")
     print(f"  Other: {len(files) - len(images) - len(pdfs)} files")
     
     if len(images) == 0 and len(pdfs) == 0:
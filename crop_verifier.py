@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from detection_cache import content_hash
+import instrumentation as metrics
+
+CLASSIFIER_PATH = "margo_veillon_classifier.keras"
+QUANTIZED_PATH = "margo_veillon_classifier_int8.tflite"
+
+# The class the verifier scores. Which output that is depends on the class
+# indices the model was trained with: they are saved next to the model as
+# <model>.classes.json, or read from the split.json of the training shards.
+TARGET_CLASS = "margo_veillon"
+SHARDS_DIR = "dataset_shards"
+
+# Candidates scoring below this (probability of a Margo Veillon work) are
+# dropped before any crop is written
+THRESHOLD = 0.5
+
+# Crops per classifier call, and pages gathered before scoring them together
+BATCH_SIZE = 64
+PAGES_PER_BATCH = 8
+
+IMG_SIZE = 224
+
+
+def prepare_crops(img, boxes):
+    """Crops of a BGR page as a uint8 RGB batch, resized like the training images."""
+    batch = np.empty((len(boxes), IMG_SIZE, IMG_SIZE, 3), np.uint8)
+    for i, (x, y, w, h) in enumerate(boxes):
+        crop = cv2.resize(img[y:y+h, x:x+w], (IMG_SIZE, IMG_SIZE), interpolation=cv2.INTER_AREA)
+        batch[i] = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+    return batch
+
+
+def classes_path(model_path):
+    return model_path + ".classes.json"
+
+
+def save_class_indices(model_path, class_indices):
+    """Record the class indices a model was trained with next to it."""
+    with open(classes_path(model_path), "w") as f:
+        json.dump(class_indices, f, indent=1)
+
+
+def read_class_indices(model_path, shards_dir=SHARDS_DIR):
+    """Class indices of a model: its .classes.json, or else those of the
+    dataset shards it was trained on."""
+    path = classes_path(model_path)
+    if not os.path.exists(path):
+        path = os.path.join(shards_dir, "split.json")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"no class indices for {model_path}: save them with "
+                                    f"save_class_indices or build the shards in {shards_dir}")
+        with open(path) as f:
+            return json.load(f)["class_indices"]
+    with open(path) as f:
+        return json.load(f)
+
+
+def target_index(class_indices):
+    if len(class_indices) != 2 or TARGET_CLASS not in class_indices:
+        raise ValueError(f"expected a binary model with a '{TARGET_CLASS}' class, got {class_indices}")
+    return class_indices[TARGET_CLASS]
+
+
+class Verifier:
+    """The trained classifier, from a .keras model or a quantized .tflite export."""
+
+    def __init__(self, path=CLASSIFIER_PATH, threads=None):
+        self.path = path
+        # The sigmoid output is the probability of class 1
+        self.target = target_index(read_class_indices(path))
+        self.quantized = path.endswith(".tflite")
+        if self.quantized:
+            import tensorflow as tf
+            self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads or os.cpu_count())
+            self.input = self.interpreter.get_input_details()[0]
+            self.output = self.interpreter.get_output_details()[0]
+            self.batch = None
+        else:
+            import tensorflow as tf
+            self.model = tf.keras.models.load_model(path)
+
+    def _run_tflite(self, x):
+        if self.batch != len(x):
+            self.interpreter.resize_tensor_input(self.input["index"], x.shape)
+            self.interpreter.allocate_tensors()
+            self.batch = len(x)
+        scale, zero = self.input["quantization"]
+        if self.input["dtype"] != np.float32:
+            x = np.clip(np.round(x / scale + zero), *_dtype_range(self.input["dtype"]))
+        self.interpreter.set_tensor(self.input["index"], x.astype(self.input["dtype"]))
+        self.interpreter.invoke()
+        out = self.interpreter.get_tensor(self.output["index"]).astype(np.float32)
+        scale, zero = self.output["quantization"]
+        if self.output["dtype"] != np.float32:
+            out = (out - zero) * scale
+        return out
+
+    def score(self, crops, batch_size=BATCH_SIZE):
+        """Margo Veillon probability for each uint8 RGB crop."""
+        out = []
+        for start in range(0, len(crops), batch_size):
+            # Same preprocessing as training: rescale 1/255
+            x = crops[start:start + batch_size].astype(np.float32) / 255.0
+            if self.quantized:
+                out.append(self._run_tflite(x))
+            else:
+                out.append(self.model.predict(x, verbose=0))
+        if not out:
+            return np.zeros(0, np.float32)
+        out = np.concatenate(out).ravel()
+        return out if self.target == 1 else 1.0 - out
+
+
+def _dtype_range(dtype):
+    info = np.iinfo(dtype)
+    return info.min, info.max
+
+
+_loaded = {}
+
+
+def load(path):
+    """One Verifier per model path and process."""
+    if path not in _loaded:
+        _loaded[path] = Verifier(path)
+    return _loaded[path]
+
+
+def cache_settings(path, threshold=THRESHOLD):
+    """Extra cache-key entries: verified boxes depend on the model, its
+    classes and the threshold."""
+    return {"verifier": content_hash(path)[:16],
+            "verify_class": target_index(read_class_indices(path)), "verify_threshold": threshold}
+
+
+def verify_pages(pages, verifier, threshold=THRESHOLD):
+    """Score the boxes of several pages in one batched pass and drop the ones
+    below threshold. Sets page["boxes"] and page["scores"]."""
+    crops = [prepare_crops(page["img"], page["boxes"]) for page in pages]
+    if not any(len(c) for c in crops):
+        for page in pages:
+            page["scores"] = []
+        return pages
+    scores = verifier.score(np.concatenate(crops))
+
+    start = 0
+    for page, batch in zip(pages, crops):
+        page_scores = scores[start:start + len(batch)]
+        start += len(batch)
+        keep = [i for i, s in enumerate(page_scores) if s >= threshold]
+        page["boxes"] = [page["boxes"][i] for i in keep]
+        page["scores"] = [round(float(page_scores[i]), 4) for i in keep]
+        with metrics.recording(page.get("metrics")):
+            metrics.count("verified", len(keep))
+    return pages
+
+
+def representative_images(shards_dir, count=200):
+    import build_dataset
+    images = []
+    for x, _ in build_dataset.load_arrays(shards_dir, "training"):
+        images.append(np.asarray(x[:count - sum(len(i) for i in images)]))
+        if sum(len(i) for i in images) >= count:
+            break
+    return np.concatenate(images) if images else np.zeros((0, IMG_SIZE, IMG_SIZE, 3), np.uint8)
+
+
+def export_quantized(keras_path=CLASSIFIER_PATH, out_path=QUANTIZED_PATH, mode="int8",
+                     shards_dir="dataset_shards"):
+    """Post-training quantization to TFLite.
+
+    int8 calibrates activations on training images (needs the dataset shards);
+    float16 halves the weights; dynamic quantizes weights only."""
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "int8":
+        samples = representative_images(shards_dir)
+        if len(samples) == 0:
+            raise ValueError(f"int8 export needs calibration images in {shards_dir}")
+
+        def representative_dataset():
+            for img in samples:
+                yield [img[None].astype(np.float32) / 255.0]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode != "dynamic":
+        raise ValueError(f"unknown mode '{mode}'")
+
+    with open(out_path, "wb") as f:
+        f.write(converter.convert())
+    if os.path.exists(classes_path(keras_path)):
+        shutil.copyfile(classes_path(keras_path), classes_path(out_path))
+    return out_path
+
+
+def evaluate(paths, shards_dir="dataset_shards", threshold=THRESHOLD):
+    """Validation accuracy and speed of each model; the first one is the reference."""
+    import build_dataset
+    arrays = build_dataset.load_arrays(shards_dir, "validation")
+    images = np.concatenate([np.asarray(x) for x, _ in arrays])
+    # Shard labels are the class indices of the shards' own split.json
+    target = target_index(build_dataset.load_split(shards_dir)["class_indices"])
+    truth = np.concatenate([np.asarray(y) for _, y in arrays]) == target
+
+    results = []
+    for path in paths:
+        verifier = Verifier(path)
+        verifier.score(images[:1])  # warm up
+        start = time.perf_counter()
+        scores = verifier.score(images)
+        seconds = time.perf_counter() - start
+        predicted = scores >= threshold
+        results.append({"model": path, "accuracy": float(np.mean(predicted == truth)),
+                        "crops_per_min": 60 * len(images) / seconds if seconds > 0 else 0.0,
+                        "size_mb": os.path.getsize(path) / 1e6, "predicted": predicted})
+
+    reference = results[0]
+    print(f"\nValidation crops: {len(images)}")
+    for r in results:
+        delta = r["accuracy"] - reference["accuracy"]
+        agree = np.mean(r["predicted"] == reference["predicted"])
+        print(f"  {r['model']:<45} acc {r['accuracy']:.4f} ({delta:+.4f})  agree {agree:.4f}  "
+              f"{r['crops_per_min']:9.0f} crops/min  {r['size_mb']:6.1f} MB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classifier verifier for detected crops")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="write a quantized TFLite model")
+    export.add_argument("--mode", choices=["int8", "float16", "dynamic"], default="int8")
+    export.add_argument("--out", default=None)
+    export.add_argument("--shards", default="dataset_shards")
+    check = sub.add_parser("evaluate", help="accuracy delta of quantized models vs the float model")
+    check.add_argument("models", nargs="*", default=[QUANTIZED_PATH])
+    check.add_argument("--shards", default="dataset_shards")
+    check.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        out = args.out or CLASSIFIER_PATH.replace(".keras", f"_{args.mode}.tflite")
+        export_quantized(CLASSIFIER_PATH, out, args.mode, args.shards)
+        print(f"Saved {out} ({os.path.getsize(out) / 1e6:.1f} MB, "
+              f"float model {os.path.getsize(CLASSIFIER_PATH) / 1e6:.1f} MB)")
+    elif args.command == "evaluate":
+        evaluate([CLASSIFIER_PATH] + args.models, args.shards, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
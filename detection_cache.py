@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+CACHE_PATH = "detection_cache.sqlite"
+
+# Oldest-used entries are dropped once the cache holds more than this
+MAX_ENTRIES = 200000
+
+
+def content_hash(path):
+    """SHA-256 of the file contents, read in chunks so big scans don't load twice."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_key(params):
+    """Stable text form of a detector's parameter set."""
+    return json.dumps(params, sort_keys=True)
+
+
+class DetectionCache:
+    """Persistent detection results keyed by (scan hash, detector, parameters)."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS detections (
+                file_hash TEXT, detector TEXT, params TEXT,
+                boxes TEXT, last_used REAL, scores TEXT,
+                PRIMARY KEY (file_hash, detector, params)
+            );
+            CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used);
+            CREATE INDEX IF NOT EXISTS detections_detector ON detections (detector);
+            -- Hashes are remembered per (path, size, mtime) so a rerun only stats files
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, file_hash TEXT
+            );
+        """)
+        # Caches written before scores were kept
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(detections)")]
+        if "scores" not in columns:
+            self.db.execute("ALTER TABLE detections ADD COLUMN scores TEXT")
+
+    def file_hash(self, path):
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        row = self.db.execute(
+            "SELECT file_hash FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (key, st.st_size, st.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        digest = content_hash(path)
+        self.db.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                        (key, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def get(self, file_hash, detector, params, with_scores=False, touch=True):
+        """Cached boxes as a list of (x, y, w, h), or None on a miss. With
+        with_scores, (boxes, scores) where scores is None if none were stored.
+        touch=False only reads, for connections that never commit."""
+        key = (file_hash, detector, params_key(params))
+        row = self.db.execute(
+            "SELECT boxes, scores FROM detections WHERE file_hash = ? AND detector = ? AND params = ?",
+            key).fetchone()
+        if row is None:
+            return None
+        if touch:
+            self.db.execute(
+                "UPDATE detections SET last_used = ? WHERE file_hash = ? AND detector = ? AND params = ?",
+                (time.time(),) + key)
+        boxes = [tuple(b) for b in json.loads(row[0])]
+        if with_scores:
+            return boxes, json.loads(row[1]) if row[1] else None
+        return boxes
+
+    def put(self, file_hash, detector, params, boxes, scores=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO detections (file_hash, detector, params, boxes, last_used, scores) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (file_hash, detector, params_key(params), json.dumps([list(map(int, b)) for b in boxes]),
+             time.time(), json.dumps([round(float(s), 4) for s in scores]) if scores else None))
+        self.db.commit()
+        self.evict()
+
+    def evict(self):
+        count = self.db.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        extra = count - self.max_entries
+        if extra > 0:
+            self.db.execute(
+                "DELETE FROM detections WHERE rowid IN "
+                "(SELECT rowid FROM detections ORDER BY last_used LIMIT ?)", (extra,))
+            self.db.commit()
+
+    def invalidate(self, detector):
+        """Drop every cached result of one detector. Returns the number of entries removed."""
+        cur = self.db.execute("DELETE FROM detections WHERE detector = ?", (detector,))
+        self.db.commit()
+        return cur.rowcount
+
+    def commit(self):
+        """Write pending file hashes, so other connections (stages, workers) can write."""
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+if __name__ == "__main__":
+    # Usage: python detection_cache.py invalidate <detector>
+    if len(sys.argv) == 3 and sys.argv[1] == "invalidate":
+        cache = DetectionCache()
+        print(f"Removed {cache.invalidate(sys.argv[2])} cached results for '{sys.argv[2]}'")
+        cache.close()
+    else:
+        print("Usage: python detection_cache.py invalidate <detector>")
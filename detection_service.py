@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlparse, parse_qs
+
+import cv2
+import numpy as np
+
+import crop_verifier
+import ml_art_detector
+import scan_pipeline
+
+HOST = "127.0.0.1"
+PORT = 8765
+CLASSIFIER_PATH = crop_verifier.CLASSIFIER_PATH
+
+# Detections running at once, and requests allowed to wait for a slot.
+# Anything beyond that gets 503 instead of piling up.
+WORKERS = os.cpu_count() or 1
+MAX_WAITING = 32
+
+
+class Models:
+    """Everything slow to load, loaded once when the service starts."""
+
+    def __init__(self, layout=True, classifier=True):
+        self.layout = None
+        self.classifier = None
+        # Keras and Detectron2 models are not safe to call from many threads at once
+        self.layout_lock = threading.Lock()
+        self.classifier_lock = threading.Lock()
+        if layout:
+            self.layout = self._load_layout()
+        if classifier:
+            self.classifier = self._load_classifier()
+
+    def _load_layout(self):
+        try:
+            import layoutparser as lp
+            model = lp.Detectron2LayoutModel(
+                config_path='lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config',
+                label_map={0: "Text", 1: "Title", 2: "List", 3: "Table", 4: "Figure"}
+            )
+            print("[OK] LayoutParser PubLayNet model loaded")
+            return model
+        except Exception as e:
+            print(f"[SKIP] LayoutParser not available: {e}")
+            return None
+
+    def _load_classifier(self):
+        if not os.path.exists(CLASSIFIER_PATH):
+            print(f"[SKIP] {CLASSIFIER_PATH} not found")
+            return None
+        try:
+            model = crop_verifier.Verifier(CLASSIFIER_PATH)
+            print(f"[OK] Classifier loaded: {CLASSIFIER_PATH}")
+            return model
+        except Exception as e:
+            print(f"[SKIP] Could not load classifier: {e}")
+            return None
+
+    def available(self):
+        detectors = ["scan_pipeline", "ml_art_detector"]
+        if self.layout is not None:
+            detectors.append("layout")
+        return detectors
+
+    def detect(self, img, detector):
+        """Boxes and labels for one page."""
+        if detector == "scan_pipeline":
+            boxes = scan_pipeline.detect_boxes(img)
+            labels = ["Artwork"] * len(boxes)
+        elif detector == "ml_art_detector":
+            boxes = ml_art_detector.detect_artworks(img)[1]
+            labels = ["Artwork"] * len(boxes)
+        elif detector == "layout" and self.layout is not None:
+            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            with self.layout_lock:
+                layout = self.layout.detect(rgb)
+            boxes, labels = [], []
+            for block in layout:
+                x1, y1, x2, y2 = (int(v) for v in block.coordinates)
+                boxes.append((x1, y1, x2 - x1, y2 - y1))
+                labels.append(block.type)
+        else:
+            raise ValueError(f"unknown detector '{detector}', available: {self.available()}")
+
+        result = {"boxes": [list(map(int, b)) for b in boxes], "labels": labels}
+        if self.classifier is not None and boxes:
+            result["scores"] = self.score(img, boxes)
+        return result
+
+    def score(self, img, boxes):
+        """Classifier score per box (probability it is a Margo Veillon work)."""
+        batch = crop_verifier.prepare_crops(img, boxes)
+        with self.classifier_lock:
+            scores = self.classifier.score(batch)
+        return [round(float(s), 4) for s in scores]
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    """GET /health, POST /detect?detector=NAME with a JSON {"path": ...} body
+    or raw image bytes."""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._send_json(200, {"status": "ok", "detectors": self.server.models.available()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/detect":
+            self._send_json(404, {"error": "not found"})
+            return
+        detector = parse_qs(url.query).get("detector", ["scan_pipeline"])[0]
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if not self.server.slots.acquire(blocking=False):
+            self._send_json(503, {"error": "busy, try again"})
+            return
+        try:
+            future = self.server.pool.submit(self.server.run_request, body,
+                                             self.headers.get("Content-Type", ""), detector)
+            status, payload = future.result()
+        finally:
+            self.server.slots.release()
+        self._send_json(status, payload)
+
+    def log_message(self, format, *args):
+        # Unix sockets have no client address; keep the log short either way
+        print(f"[{time.strftime('%H:%M:%S')}] {format % args}")
+
+
+class ServiceMixin:
+    def setup_service(self, models, workers, max_waiting):
+        self.models = models
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers + max_waiting)
+
+    def run_request(self, body, content_type, detector):
+        start = time.perf_counter()
+        if content_type.startswith("application/json"):
+            try:
+                path = json.loads(body)["path"]
+            except (ValueError, KeyError):
+                return 400, {"error": 'expected JSON body {"path": "..."}'}
+            img = cv2.imread(path)
+            source = path
+        else:
+            img = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+            source = "<bytes>"
+        if img is None:
+            return 400, {"error": f"could not read image {source}"}
+        try:
+            result = self.models.detect(img, detector)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            # One bad page must not take the service down
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        result.update({"source": source, "detector": detector,
+                       "width": img.shape[1], "height": img.shape[0],
+                       "seconds": round(time.perf_counter() - start, 4)})
+        return 200, result
+
+
+class TCPService(ServiceMixin, ThreadingHTTPServer):
+    pass
+
+
+class UnixService(ServiceMixin, ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("unix", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident artwork detection service")
+    parser.add_argument("--port", type=int, default=PORT, help="localhost HTTP port")
+    parser.add_argument("--unix", default=None, help="serve on this Unix socket path instead")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-layout", action="store_true", help="don't load the LayoutParser model")
+    parser.add_argument("--no-classifier", action="store_true", help="don't load the Keras classifier")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("ARTWORK DETECTION SERVICE")
+    print("=" * 50)
+    models = Models(layout=not args.no_layout, classifier=not args.no_classifier)
+
+    # Warm up OpenCV and the detectors so the first real request is fast
+    blank = np.full((256, 256, 3), 255, np.uint8)
+    for name in ["scan_pipeline", "ml_art_detector"]:
+        models.detect(blank, name)
+
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        server = UnixService(args.unix, DetectionHandler)
+        where = args.unix
+    else:
+        server = TCPService((HOST, args.port), DetectionHandler)
+        where = f"http://{HOST}:{args.port}"
+    server.setup_service(models, args.workers, MAX_WAITING)
+
+    print(f"Listening on {where} with {args.workers} workers")
+    print(f"Detectors: {', '.join(models.available())}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+
+
+if __name__ == "__main__":
+    main()
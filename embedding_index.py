@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+INDEX_FOLDER = "artwork_index"
+
+# ResNet50 pooled features (2048-d) are projected down to EMBED_DIM and stored
+# as float16, so each crop costs 512 bytes on disk
+EMBED_DIM = 256
+BATCH_SIZE = 64
+
+# Crops at least this similar (cosine) to an indexed crop count as duplicates
+DUPLICATE_SIMILARITY = 0.95
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+
+def projection_matrix(seed=0):
+    """Fixed random orthonormal 2048 -> EMBED_DIM projection (keeps cosine distances)."""
+    rng = np.random.default_rng(seed)
+    q, _ = np.linalg.qr(rng.standard_normal((2048, EMBED_DIM)))
+    return q.astype(np.float32)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Embedder:
+    """Batched CPU embeddings from the same ResNet50 backbone testing.py trains on."""
+
+    def __init__(self):
+        from tensorflow.keras.applications import ResNet50
+        from tensorflow.keras.applications.resnet50 import preprocess_input
+        self.model = ResNet50(weights='imagenet', include_top=False, pooling='avg',
+                              input_shape=(224, 224, 3))
+        self.preprocess = preprocess_input
+        self.projection = projection_matrix()
+
+    def embed_images(self, images):
+        """BGR images -> (n, EMBED_DIM) unit vectors."""
+        batch = np.stack([cv2.resize(img, (224, 224), interpolation=cv2.INTER_AREA)
+                          for img in images])
+        # preprocess_input wants RGB
+        batch = self.preprocess(batch[..., ::-1].astype(np.float32))
+        features = self.model.predict(batch, verbose=0)
+        return normalize(normalize(features) @ self.projection)
+
+    def embed_files(self, paths, batch_size=BATCH_SIZE):
+        """Yield (paths, vectors) per batch; unreadable files are skipped."""
+        for start in range(0, len(paths), batch_size):
+            chunk = []
+            for path in paths[start:start + batch_size]:
+                img = cv2.imread(path)
+                if img is not None and img.size > 0:
+                    chunk.append((path, img))
+            if chunk:
+                yield [p for p, _ in chunk], self.embed_images([img for _, img in chunk])
+
+
+class VectorIndex:
+    """On-disk inverted-file (IVF) index over unit vectors.
+
+    Vectors live in an append-only float16 file that is memory-mapped for
+    search. k-means centroids split them into lists; a query only scans the
+    nprobe lists nearest to it, so lookups stay in milliseconds at hundreds
+    of thousands of crops."""
+
+    def __init__(self, folder=INDEX_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.meta_path = os.path.join(folder, "meta.json")
+        self.vectors_path = os.path.join(folder, "vectors.f16")
+        self.assign_path = os.path.join(folder, "assign.i32")
+        self.paths_path = os.path.join(folder, "paths.txt")
+        # (size, mtime_ns) of each crop when it was embedded
+        self.stamps_path = os.path.join(folder, "stamps.i64")
+        self.centroids_path = os.path.join(folder, "centroids.npy")
+
+        self.meta = {"count": 0, "dim": EMBED_DIM, "trained_at": 0}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        self.paths = []
+        if os.path.exists(self.paths_path):
+            with open(self.paths_path, encoding="utf-8") as f:
+                self.paths = f.read().splitlines()[:self.meta["count"]]
+        # Indexes written before stamps were kept have none: those crops are
+        # embedded again on the next ingest
+        stamps = np.fromfile(self.stamps_path, np.int64) if os.path.exists(self.stamps_path) else []
+        self.stamps = np.zeros((len(self), 2), np.int64)
+        stamps = np.asarray(stamps, np.int64).reshape(-1, 2)[:len(self)]
+        self.stamps[:len(stamps)] = stamps
+        # A crop written again under the same name is added as a new row; the
+        # last row of each path is the live one and search skips the others
+        self.latest = {path: row for row, path in enumerate(self.paths)}
+        self._live = None
+        self.centroids = np.load(self.centroids_path) if os.path.exists(self.centroids_path) else None
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def vectors(self):
+        if len(self) == 0:
+            return np.zeros((0, self.meta["dim"]), np.float16)
+        return np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(len(self), self.meta["dim"]))
+
+    def assignments(self):
+        if len(self) == 0:
+            return np.zeros(0, np.int32)
+        return np.memmap(self.assign_path, dtype=np.int32, mode="r", shape=(len(self),))
+
+    @staticmethod
+    def stamp(path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def is_current(self, path):
+        """True if path is indexed and unchanged since it was embedded."""
+        row = self.latest.get(path)
+        return row is not None and tuple(self.stamps[row]) == self.stamp(path)
+
+    def live(self):
+        """Boolean mask of the rows that are the latest embedding of their path."""
+        if self._live is None:
+            self._live = np.zeros(len(self), bool)
+            self._live[list(self.latest.values())] = True
+        return self._live
+
+    def _nearest_centroid(self, vectors):
+        if self.centroids is None:
+            return np.zeros(len(vectors), np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def add(self, paths, vectors, stamps):
+        """Append embeddings of crops, with the (size, mtime_ns) of each file.
+        Paths already indexed are superseded by their new row."""
+        vectors = np.asarray(vectors, np.float32)
+        stamps = np.asarray(stamps, np.int64).reshape(-1, 2)
+        written = os.path.getsize(self.stamps_path) if os.path.exists(self.stamps_path) else 0
+        if written != self.stamps.nbytes:
+            # Index from before stamps were kept: write zero stamps for its rows
+            self.stamps.tofile(self.stamps_path)
+        with open(self.stamps_path, "ab") as f:
+            f.write(stamps.tobytes())
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.astype(np.float16).tobytes())
+        with open(self.assign_path, "ab") as f:
+            f.write(self._nearest_centroid(vectors).tobytes())
+        with open(self.paths_path, "a", encoding="utf-8") as f:
+            f.writelines(p + "\n" for p in paths)
+        for path in paths:
+            self.latest[path] = len(self.paths)
+            self.paths.append(path)
+        self.stamps = np.concatenate([self.stamps, stamps])
+        self._live = None
+        self.meta["count"] += len(paths)
+        self._save_meta()
+
+        # Re-cluster when the index has grown a lot since the last training
+        if len(self) >= 1000 and len(self) >= 4 * max(self.meta["trained_at"], 250):
+            self.train()
+
+    def train(self, iterations=10):
+        """k-means with about sqrt(n) lists, then reassign every vector."""
+        data = np.asarray(self.vectors(), np.float32)
+        nlist = max(1, int(np.sqrt(len(data))))
+        rng = np.random.default_rng(0)
+        sample = data[rng.choice(len(data), min(len(data), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize(centroids)
+
+        self.centroids = centroids.astype(np.float32)
+        np.save(self.centroids_path, self.centroids)
+        assign = np.concatenate([self._nearest_centroid(data[i:i + 65536])
+                                 for i in range(0, len(data), 65536)])
+        assign.astype(np.int32).tofile(self.assign_path)
+        self.meta["trained_at"] = len(self)
+        self._save_meta()
+
+    def search(self, queries, k=5, nprobe=8):
+        """For each query vector, the k most similar crops as [(path, similarity)]."""
+        queries = normalize(np.atleast_2d(np.asarray(queries, np.float32)))
+        vectors, assign = self.vectors(), self.assignments()
+        results = []
+        for q in queries:
+            if self.centroids is None:
+                candidates = np.arange(len(self))
+            else:
+                probes = np.argsort(-(self.centroids @ q))[:nprobe]
+                candidates = np.flatnonzero(np.isin(assign, probes))
+            candidates = candidates[self.live()[candidates]]
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            sims = np.asarray(vectors[candidates], np.float32) @ q
+            top = np.argsort(-sims)[:k]
+            results.append([(self.paths[candidates[i]], float(sims[i])) for i in top])
+        return results
+
+    def _save_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+
+
+def list_images(folders):
+    paths = []
+    for folder in folders:
+        if os.path.isdir(folder):
+            paths += sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                            if f.lower().endswith(IMAGE_EXTS))
+        elif os.path.isfile(folder):
+            paths.append(folder)
+    return paths
+
+
+def ingest(folders, index, embedder, threshold=DUPLICATE_SIMILARITY):
+    """Embed new crops, and crops rewritten since they were embedded (same
+    name, new size or mtime), and add them to the index. Returns
+    [(crop, duplicate_of, similarity)]."""
+    new = [p for p in list_images(folders) if not index.is_current(p)]
+    changed = sum(p in index.latest for p in new)
+    print(f"New crops to index: {len(new) - changed}, changed: {changed}")
+    duplicates = []
+    for paths, vectors in embedder.embed_files(new):
+        stamps = [index.stamp(p) for p in paths]
+        hits = index.search(vectors, k=2) if len(index) else [[] for _ in paths]
+        # Duplicates inside the batch itself: compare with earlier crops of the batch
+        sims = vectors @ vectors.T
+        for i, path in enumerate(paths):
+            # A changed crop is not a duplicate of its own old embedding
+            others = [hit for hit in hits[i] if hit[0] != path]
+            best = others[0] if others else (None, -1.0)
+            if i > 0 and sims[i, :i].max() > best[1]:
+                j = int(np.argmax(sims[i, :i]))
+                best = (paths[j], float(sims[i, j]))
+            if best[1] >= threshold:
+                duplicates.append((path, best[0], best[1]))
+        index.add(paths, vectors, stamps)
+    return duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similarity index over artwork crops")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="embed and index new crops")
+    add.add_argument("folders", nargs="*", default=["cropped_artworks", "simple_artworks"])
+    query = sub.add_parser("query", help="find crops similar to an image")
+    query.add_argument("image")
+    query.add_argument("-k", type=int, default=5)
+    sub.add_parser("train", help="re-cluster the index")
+    args = parser.parse_args()
+
+    index = VectorIndex()
+    if args.command == "train":
+        index.train()
+        print(f"Re-clustered {len(index)} crops")
+    elif args.command == "add":
+        duplicates = ingest(args.folders, index, Embedder())
+        print(f"Indexed crops: {len(index)}")
+        for path, original, sim in duplicates:
+            print(f"  DUPLICATE: {path} ~ {original} ({sim:.3f})")
+    elif args.command == "query":
+        img = cv2.imread(args.image)
+        if img is None:
+            print(f"ERROR: Could not read {args.image}")
+            return
+        for path, sim in index.search(Embedder().embed_images([img]), k=args.k)[0]:
+            print(f"  {sim:.3f}  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+
+import build_dataset
+
+# Fixed augmentation variants pushed through the backbone once each:
+# 0 = original, 1 = horizontal flip (the only augmentation testing.py uses)
+VARIANTS = (0, 1)
+PREDICT_BATCH = 64
+
+
+def build_backbone(img_size=224):
+    """The frozen ResNet50 base plus pooling, exactly as in testing.py."""
+    from tensorflow.keras.applications import ResNet50
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras import layers
+
+    base_model = ResNet50(weights='imagenet', include_top=False, input_shape=(img_size, img_size, 3))
+    base_model.trainable = False
+    return base_model, Sequential([base_model, layers.GlobalAveragePooling2D()])
+
+
+def apply_variant(images, variant):
+    if variant == 1:
+        return images[:, :, ::-1]
+    return images
+
+
+def feature_path(shards_dir, subset, variant):
+    return os.path.join(shards_dir, f"features_{subset}_v{variant}.npy")
+
+
+def cached_features(shards_dir, subset, variant, pooled_model):
+    """Pooled 2048-d backbone features for one subset and variant, computed once and
+    reused until the shards are rebuilt."""
+    path = feature_path(shards_dir, subset, variant)
+    split_path = os.path.join(shards_dir, "split.json")
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(split_path):
+        return np.load(path)
+
+    print(f"Extracting {subset} features (variant {variant})...")
+    chunks = []
+    for images, _ in build_dataset.load_arrays(shards_dir, subset):
+        for start in range(0, len(images), PREDICT_BATCH):
+            # Same input as training: rescale 1/255
+            batch = apply_variant(np.asarray(images[start:start + PREDICT_BATCH]), variant)
+            chunks.append(pooled_model.predict(batch.astype(np.float32) / 255.0, verbose=0))
+    features = np.concatenate(chunks) if chunks else np.zeros((0, 2048), np.float32)
+    np.save(path, features.astype(np.float32))
+    return features
+
+
+def labels_for(shards_dir, subset):
+    arrays = build_dataset.load_arrays(shards_dir, subset)
+    return np.concatenate([np.asarray(y) for _, y in arrays]) if arrays else np.zeros(0, np.float32)
+
+
+def fit_cached(shards_dir, epochs=10, batch_size=30, learning_rate=0.001, variants=VARIANTS):
+    """Train the Dense(1) head on cached features, then return (full model, history).
+
+    The returned model is the same Sequential(ResNet50, pooling, Dense) that
+    testing.py builds, with the trained head weights, so it saves and loads as a
+    normal margo_veillon_classifier.keras."""
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras import layers
+    from tensorflow.keras.optimizers import Adam
+
+    base_model, pooled = build_backbone()
+
+    train_y = labels_for(shards_dir, "training")
+    train_x = np.concatenate([cached_features(shards_dir, "training", v, pooled) for v in variants])
+    train_y = np.concatenate([train_y] * len(variants))
+    val_x = cached_features(shards_dir, "validation", 0, pooled)
+    val_y = labels_for(shards_dir, "validation")
+
+    head = Sequential([
+        layers.Input(shape=(train_x.shape[1],)),
+        layers.Dense(1, activation='sigmoid')
+    ])
+    head.compile(optimizer=Adam(learning_rate=learning_rate),
+                 loss='binary_crossentropy',
+                 metrics=['accuracy'])
+    history = head.fit(train_x, train_y, epochs=epochs, batch_size=batch_size, shuffle=True,
+                       validation_data=(val_x, val_y) if len(val_x) else None, verbose=2)
+
+    model = Sequential([
+        base_model,
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(1, activation='sigmoid')
+    ])
+    model.build((None,) + base_model.input_shape[1:])
+    model.layers[-1].set_weights(head.layers[-1].get_weights())
+    model.compile(optimizer=Adam(learning_rate=learning_rate),
+                  loss='binary_crossentropy',
+                  metrics=['accuracy'])
+    return model, history
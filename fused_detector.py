@@ -0,0 +1,197 @@
+import cv2
+import numpy as np
+
+from box_fusion import fuse_boxes
+import instrumentation as metrics
+from pyramid import REFERENCE_SIDE, to_original
+import tiled_page
+
+DETECTOR = "fused_detector"
+
+# The three cues of test_artwork_file.py, computed once per page and combined.
+# Pixel sizes are for a page with a long side of REFERENCE_SIDE; detection
+# runs on a copy resized to detect_side. Colour and frame cues need no fine
+# detail, so that copy is smaller than for the other detectors; crops still
+# come from the full page.
+PARAMS = {
+    "detect_side": 1024,
+    # Per-pixel cues (thresholds of test_artwork_file.py). Non-white is also
+    # relative to the paper, which is often darker than max_gray on scans.
+    "canny_low": 30,
+    "canny_high": 100,
+    "min_saturation": 40,
+    "max_gray": 240,
+    "paper_margin": 20,
+    # A pixel is a candidate when this many cues agree on it (edges count
+    # within edge_reach pixels, so a frame line marks the area beside it too)
+    "pixel_votes": 2,
+    "edge_reach": 1,
+    # Candidates closer than this are joined before contours are taken
+    "close_size": 3,
+    "min_area": 8000,
+    "max_area": 600000,
+    "min_aspect": 0.3,
+    "max_aspect": 3.0,
+    # Region checks, each worth its weight when it holds. Several colours
+    # (paintings) and ink on the paper (the black-and-white prints of the
+    # bundled scans) are the checks UI buttons and app bars fail, so they
+    # count double.
+    "weights": {"edges": 1.0, "saturation": 1.0, "nonwhite": 1.0, "hue": 2.0, "print": 2.0},
+    "min_edge_density": 0.01,
+    "max_edge_density": 0.3,
+    "min_saturated": 0.2,
+    "min_nonwhite": 0.6,
+    # 1 - length of the mean hue vector of the saturated pixels: 0 for one
+    # flat colour (UI buttons), towards 1 for many colours
+    "min_hue_spread": 0.4,
+    # A print: hardly any colour above the paper's, and half-tones rather
+    # than solid black (phone status bars)
+    "max_print_saturated": 0.25,
+    "max_print_nonwhite": 0.85,
+    # Total weight a region needs to be kept: the hue or print check plus
+    # two others
+    "min_score": 4.0,
+    "merge_gap": 0,
+}
+
+# Working memory per pixel (gray, blur, HSV, edges and the vote masks), used
+# to size tiles on pages over the memory budget
+TILE_BYTES_PER_PIXEL = 12
+
+# Hue (0-179, two degrees per step) as a unit vector
+_HUE_COS = np.cos(np.arange(256) * np.pi / 90).astype(np.float32)
+_HUE_SIN = np.sin(np.arange(256) * np.pi / 90).astype(np.float32)
+
+
+def cue_masks(img, params=PARAMS, derived=None):
+    """Shared intermediates of one page: gray and HSV are converted once (or
+    taken from derived, a page_store.StoredLevel of img), and the edge,
+    saturation and non-white masks (0/1) all come from them."""
+    if derived is not None:
+        with metrics.stage("store"):
+            gray = derived.gray()
+            hsv = derived.hsv()
+            edges = derived.canny(params["canny_low"], params["canny_high"])
+    else:
+        with metrics.stage("color"):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        with metrics.stage("canny"):
+            blur = cv2.GaussianBlur(gray, (5, 5), 0)
+            edges = cv2.Canny(blur, params["canny_low"], params["canny_high"])
+    with metrics.stage("masks"):
+        # The paper is sampled in the middle half of the page: photographed
+        # scans have a dark surround and white app panels around the sheet
+        height, width = gray.shape
+        middle = (slice(height // 4, 3 * height // 4, 8), slice(width // 4, 3 * width // 4, 8))
+        paper = float(np.median(gray[middle]))
+        dark = min(params["max_gray"], paper - params["paper_margin"])
+        # Yellowed paper is saturated itself: only colour above it counts
+        vivid = max(params["min_saturation"], float(np.median(hsv[:, :, 1][middle])) + params["paper_margin"])
+        _, saturated = cv2.threshold(hsv[:, :, 1], vivid, 1, cv2.THRESH_BINARY)
+        _, nonwhite = cv2.threshold(gray, dark - 1, 1, cv2.THRESH_BINARY_INV)
+    return {"hue": hsv[:, :, 0], "edges": edges, "saturated": saturated, "nonwhite": nonwhite}
+
+
+def candidate_boxes(masks, params=PARAMS):
+    """Pixels where at least pixel_votes cues agree, closed into regions, as
+    (x, y, w, h) rows after the size and shape filters. One findContours
+    for all three cues."""
+    with metrics.stage("votes"):
+        reach = 2 * params["edge_reach"] + 1
+        near_edge = cv2.dilate(masks["edges"], np.ones((reach, reach), np.uint8)) >> 7
+        votes = cv2.add(cv2.add(near_edge, masks["saturated"]), masks["nonwhite"])
+        _, candidates = cv2.threshold(votes, params["pixel_votes"] - 1, 255, cv2.THRESH_BINARY)
+        size = max(1, int(params["close_size"]))
+        candidates = cv2.morphologyEx(candidates, cv2.MORPH_CLOSE, np.ones((size, size), np.uint8))
+
+    with metrics.stage("find_contours"):
+        contours, _ = cv2.findContours(candidates, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    metrics.count("contours", len(contours))
+    if not contours:
+        return np.empty((0, 4), np.int64)
+
+    rects = np.array([cv2.boundingRect(c) for c in contours], np.int64)
+    areas = rects[:, 2] * rects[:, 3]
+    aspect = rects[:, 2] / rects[:, 3]
+    keep = (areas >= params["min_area"]) & (areas <= params["max_area"]) & \
+        (aspect >= params["min_aspect"]) & (aspect <= params["max_aspect"])
+    metrics.count("area_aspect", int(keep.sum()))
+    return rects[keep]
+
+
+def region_checks(masks, x, y, w, h, params=PARAMS):
+    """Which of the region checks hold for one candidate."""
+    n = w * h
+    edges = masks["edges"][y:y+h, x:x+w]
+    saturated = masks["saturated"][y:y+h, x:x+w]
+    hue = masks["hue"][y:y+h, x:x+w]
+    edge_density = cv2.countNonZero(edges) / n
+    colored = cv2.countNonZero(saturated)
+    nonwhite = cv2.countNonZero(masks["nonwhite"][y:y+h, x:x+w]) / n
+    spread = 0.0
+    if colored:
+        # Circular spread, so reds on both sides of hue 0 count as one colour
+        cos = cv2.mean(cv2.LUT(hue, _HUE_COS), saturated)[0]
+        sin = cv2.mean(cv2.LUT(hue, _HUE_SIN), saturated)[0]
+        spread = 1.0 - float(np.hypot(cos, sin))
+    return {
+        "edges": params["min_edge_density"] <= edge_density <= params["max_edge_density"],
+        "saturation": colored / n >= params["min_saturated"],
+        "nonwhite": nonwhite >= params["min_nonwhite"],
+        "hue": spread >= params["min_hue_spread"],
+        "print": colored / n <= params["max_print_saturated"] and nonwhite <= params["max_print_nonwhite"],
+    }
+
+
+def find_fused_boxes(img, params=PARAMS, derived=None):
+    """All three cues on one page in a single pass, combined by a weighted
+    vote of the region checks. Returns (x, y, w, h) boxes."""
+    masks = cue_masks(img, params, derived)
+    boxes = []
+    with metrics.stage("score"):
+        for x, y, w, h in candidate_boxes(masks, params).tolist():
+            checks = region_checks(masks, x, y, w, h, params)
+            for name, passed in checks.items():
+                metrics.count(name, int(passed))
+            if sum(params["weights"][name] for name, passed in checks.items() if passed) >= params["min_score"]:
+                boxes.append((x, y, w, h))
+    return boxes
+
+
+def scale_params(params, k):
+    """Params for an image k times the reference size."""
+    scaled = dict(params)
+    scaled["min_area"] = params["min_area"] * k * k
+    scaled["max_area"] = params["max_area"] * k * k
+    scaled["edge_reach"] = max(1, round(params["edge_reach"] * k))
+    scaled["close_size"] = max(1, round(params["close_size"] * k))
+    return scaled
+
+
+def detect_boxes(img, params=PARAMS, stored=None):
+    """Search a downscaled copy of the page and return boxes in full-resolution
+    pixels. img may be an array or a tiled_page.MappedPage; stored is its
+    page_store.StoredPage, if any."""
+    height, width = img.shape[:2]
+    level = None
+    with metrics.stage("resize"):
+        if stored is not None:
+            level = stored.level(params["detect_side"])
+            small, scale = level.image(), level.scale
+        else:
+            small, scale = tiled_page.downscale(img, params["detect_side"])
+    k = max(small.shape[:2]) / REFERENCE_SIDE
+    scaled = scale_params(params, k)
+
+    # Tiles overlap by the largest region the filters accept
+    overlap = int(np.sqrt(scaled["max_area"] * max(scaled["max_aspect"], 1 / scaled["min_aspect"]))) + 2
+
+    def detect(tile):
+        # Stored maps cover the whole level, so they are only used when it is not tiled
+        return find_fused_boxes(tile, scaled, level if tile is small else None)
+
+    boxes = tiled_page.detect_tiled(small, detect, TILE_BYTES_PER_PIXEL, overlap)
+    boxes = to_original(boxes, scale, width, height)
+    with metrics.stage("fuse"):
+        return fuse_boxes(boxes, params["merge_gap"] * max(height, width) / REFERENCE_SIDE)
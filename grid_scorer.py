@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+import instrumentation as metrics
+
+# Same thresholds the old per-cell is_likely_artwork() check used
+MIN_HUE_STD = 10
+MIN_SAT_STD = 20
+MIN_EDGE_DENSITY = 0.005
+MAX_EDGE_DENSITY = 0.3
+# Its dark-frame test returned True either way, so it is not part of the score
+
+
+def build_tables(img, derived=None):
+    """Convert the page once (or take its maps from derived, a
+    page_store.StoredLevel of img) and build the summed-area tables used for scoring."""
+    if derived is not None:
+        with metrics.stage("store"):
+            hsv = derived.hsv()
+            edges = derived.canny(50, 150, "gray")
+    else:
+        with metrics.stage("color"):
+            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        with metrics.stage("canny"):
+            edges = cv2.Canny(gray, 50, 150)
+
+    with metrics.stage("integral"):
+        # Sums and sums of squares give mean and std of any box in O(1)
+        hue_sum, hue_sq = cv2.integral2(hsv[:, :, 0], sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        sat_sum, sat_sq = cv2.integral2(hsv[:, :, 1], sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+        return {
+            "height": img.shape[0],
+            "width": img.shape[1],
+            "hue_sum": hue_sum,
+            "hue_sq": hue_sq,
+            "sat_sum": sat_sum,
+            "sat_sq": sat_sq,
+            "edges": cv2.integral((edges > 0).astype(np.uint8), sdepth=cv2.CV_64F),
+        }
+
+
+def box_sum(table, x, y, w, h):
+    """Sum of every box (x, y, w, h) in one lookup; arguments may be arrays."""
+    return table[y + h, x + w] - table[y, x + w] - table[y + h, x] + table[y, x]
+
+
+def box_std(sums, squares, x, y, w, h):
+    n = w * h
+    mean = box_sum(sums, x, y, w, h) / n
+    var = box_sum(squares, x, y, w, h) / n - mean ** 2
+    return np.sqrt(np.maximum(var, 0))
+
+
+def score_grid(tables, cell_size=200, stride=150):
+    """Score every grid cell at once. Returns cell origins and a dict of per-cell features."""
+    height, width = tables["height"], tables["width"]
+    ys, xs = np.meshgrid(np.arange(0, height - cell_size, stride),
+                         np.arange(0, width - cell_size, stride), indexing="ij")
+    xs = xs.ravel()
+    ys = ys.ravel()
+    size = cell_size
+
+    features = {
+        "hue_std": box_std(tables["hue_sum"], tables["hue_sq"], xs, ys, size, size),
+        "sat_std": box_std(tables["sat_sum"], tables["sat_sq"], xs, ys, size, size),
+        "edge_density": box_sum(tables["edges"], xs, ys, size, size) / (size * size),
+    }
+    return xs, ys, features
+
+
+def find_artwork_cells(img, cell_size=200, stride=150, tables=None, derived=None):
+    """Grid search for artwork-like cells. Returns a list of (x, y, w, h)."""
+    if tables is None:
+        tables = build_tables(img, derived)
+    with metrics.stage("score"):
+        xs, ys, f = score_grid(tables, cell_size, stride)
+
+        # UI elements have low color variety
+        colorful = ~((f["hue_std"] < MIN_HUE_STD) & (f["sat_std"] < MIN_SAT_STD))
+        # Too few edges (solid color) or too many (text/UI)
+        edgy = (f["edge_density"] >= MIN_EDGE_DENSITY) & (f["edge_density"] <= MAX_EDGE_DENSITY)
+
+        keep = np.flatnonzero(colorful & edgy)
+
+    # Cells left after each filter step
+    metrics.count("cells", len(xs))
+    metrics.count("color_variety", colorful.sum())
+    metrics.count("edge_density", len(keep))
+    return [(int(xs[i]), int(ys[i]), cell_size, cell_size) for i in keep]
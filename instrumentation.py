@@ -0,0 +1,171 @@
+import json
+import os
+import re
+import threading
+import time
+
+# Set ART_METRICS to a file path to switch recording on. A path ending in
+# .prom is written as a Prometheus textfile (for node_exporter's textfile
+# collector); anything else gets one JSON line per page. When unset, every
+# call below returns immediately.
+METRICS_PATH = os.environ.get("ART_METRICS")
+ENABLED = bool(METRICS_PATH)
+
+_local = threading.local()
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timings = self.record["timings"]
+        timings[self.name] = timings.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def new_page(page, detector):
+    """Empty per-page record, or None when recording is off."""
+    if not ENABLED:
+        return None
+    return {"page": page, "detector": detector, "timings": {}, "counters": {}, "bytes_written": 0}
+
+
+class recording:
+    """Make record the target of stage()/count()/wrote() in this thread."""
+
+    def __init__(self, record):
+        self.record = record
+
+    def __enter__(self):
+        self.previous = getattr(_local, "record", None)
+        _local.record = self.record
+        return self.record
+
+    def __exit__(self, *exc):
+        _local.record = self.previous
+        return False
+
+
+def stage(name):
+    """Context manager timing one stage of the current page."""
+    if not ENABLED:
+        return _NULL_STAGE
+    record = getattr(_local, "record", None)
+    if record is None:
+        return _NULL_STAGE
+    return _Stage(record, name)
+
+
+def count(name, n=1):
+    """Add n to a counter of the current page (e.g. candidates left after a filter)."""
+    if not ENABLED:
+        return
+    record = getattr(_local, "record", None)
+    if record is not None:
+        record["counters"][name] = record["counters"].get(name, 0) + int(n)
+
+
+def wrote(path):
+    """Count the size of a file just written by the current page."""
+    if not ENABLED:
+        return
+    record = getattr(_local, "record", None)
+    if record is not None and os.path.exists(path):
+        record["bytes_written"] += os.path.getsize(path)
+
+
+class MetricsSink:
+    """Collects finished page records and writes them to METRICS_PATH."""
+
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        self.prometheus = bool(path) and path.endswith(".prom")
+        self.file = open(path, "a") if path and not self.prometheus else None
+        self.pages = {}
+        self.seconds = {}
+        self.counters = {}
+        self.bytes = {}
+        if self.prometheus and os.path.exists(path):
+            self._read_prometheus()
+
+    def write(self, record):
+        if record is None or not self.path:
+            return
+        if self.file:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            return
+        # Prometheus textfiles hold running totals per detector, across runs
+        det = record["detector"]
+        self.pages[det] = self.pages.get(det, 0) + 1
+        self.bytes[det] = self.bytes.get(det, 0) + record["bytes_written"]
+        for name, sec in record["timings"].items():
+            self.seconds[(det, name)] = self.seconds.get((det, name), 0.0) + sec
+        for name, n in record["counters"].items():
+            self.counters[(det, name)] = self.counters.get((det, name), 0) + n
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        elif self.prometheus:
+            self._write_prometheus()
+
+    def _read_prometheus(self):
+        # Counters must never go down, or Prometheus sees a reset: every run
+        # adds to the totals the textfile already has
+        for line in open(self.path):
+            m = re.match(r'(\w+)\{(.*)\} (\S+)$', line.strip())
+            if not m:
+                continue
+            name, value = m.group(1), float(m.group(3))
+            labels = dict(re.findall(r'(\w+)="([^"]*)"', m.group(2)))
+            det = labels.get("detector")
+            if name == "artwork_pages_total":
+                self.pages[det] = int(value)
+            elif name == "artwork_stage_seconds_total":
+                self.seconds[(det, labels["stage"])] = value
+            elif name == "artwork_candidates_total":
+                self.counters[(det, labels["step"])] = int(value)
+            elif name == "artwork_bytes_written_total":
+                self.bytes[det] = int(value)
+
+    def _write_prometheus(self):
+        lines = [
+            "# HELP artwork_pages_total Pages processed.",
+            "# TYPE artwork_pages_total counter",
+        ]
+        lines += [f'artwork_pages_total{{detector="{d}"}} {n}' for d, n in sorted(self.pages.items())]
+        lines += ["# HELP artwork_stage_seconds_total Time spent per stage.",
+                  "# TYPE artwork_stage_seconds_total counter"]
+        lines += [f'artwork_stage_seconds_total{{detector="{d}",stage="{s}"}} {v:.6f}'
+                  for (d, s), v in sorted(self.seconds.items())]
+        lines += ["# HELP artwork_candidates_total Candidates counted at each filter step.",
+                  "# TYPE artwork_candidates_total counter"]
+        lines += [f'artwork_candidates_total{{detector="{d}",step="{s}"}} {v}'
+                  for (d, s), v in sorted(self.counters.items())]
+        lines += ["# HELP artwork_bytes_written_total Bytes of crops and overlays written.",
+                  "# TYPE artwork_bytes_written_total counter"]
+        lines += [f'artwork_bytes_written_total{{detector="{d}"}} {n}' for d, n in sorted(self.bytes.items())]
+
+        # Write then rename, so the collector never reads a half-written file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
@@ -0,0 +1,173 @@
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from detection_cache import DetectionCache
+import instrumentation as metrics
+import pdf_pages
+from pyramid import to_original
+import tiled_page
+
+# PubLayNet model of test_layout.py; its "Figure" blocks are artwork proposals
+CONFIG = "lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config"
+LABEL_MAP = {0: "Text", 1: "Title", 2: "List", 3: "Table", 4: "Figure"}
+FIGURE = "Figure"
+
+# Pages are shrunk to this long side before inference (PubLayNet pages are
+# about 800 px tall, so more resolution only costs time)
+LAYOUT_SIDE = 1024
+SCORE_THRESHOLD = 0.5
+
+# Pages per model call, and CPU threads for one model (ART_LAYOUT_THREADS to
+# override). With a process pool, threads are split between the workers.
+BATCH_SIZE = 4
+THREADS = int(os.environ.get("ART_LAYOUT_THREADS", 0)) or os.cpu_count() or 1
+
+# Layouts are cached per page content hash under this detector name
+CACHE_DETECTOR = "layout"
+
+
+_loaded = {}
+# SQLite connections only work in the thread that opened them
+_local = threading.local()
+
+
+def available():
+    """True if layoutparser and its Detectron2 backend are installed (checked once)."""
+    if "available" not in _loaded:
+        try:
+            import layoutparser
+            import detectron2
+            _loaded["available"] = True
+        except ImportError:
+            _loaded["available"] = False
+    return _loaded["available"]
+
+
+def settings():
+    """Everything that changes the layout result; the layout cache key, and
+    part of the cache key of detectors that use it."""
+    return {"layout": CONFIG, "layout_side": LAYOUT_SIDE, "layout_threshold": SCORE_THRESHOLD}
+
+
+class LayoutModel:
+    """The PubLayNet model, loaded once, run on batches of downscaled pages."""
+
+    def __init__(self, config=CONFIG, threads=THREADS):
+        import layoutparser as lp
+        import torch
+        torch.set_num_threads(threads)
+        self.torch = torch
+        self.model = lp.Detectron2LayoutModel(
+            config_path=config, label_map=LABEL_MAP,
+            extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", SCORE_THRESHOLD, "MODEL.DEVICE", "cpu"])
+        self.figure = next(k for k, v in LABEL_MAP.items() if v == FIGURE)
+
+    def _batch_inputs(self, images):
+        # Same preprocessing as detectron2's DefaultPredictor, for several pages
+        predictor = self.model.model
+        inputs = []
+        for img in images:
+            if predictor.input_format == "RGB":
+                img = img[:, :, ::-1]
+            height, width = img.shape[:2]
+            resized = predictor.aug.get_transform(img).apply_image(img)
+            tensor = self.torch.as_tensor(resized.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": tensor, "height": height, "width": width})
+        return predictor.model, inputs
+
+    def figures(self, images):
+        """Figure boxes (x, y, w, h) and scores for each BGR image, in one model call."""
+        model, inputs = self._batch_inputs(images)
+        with self.torch.no_grad():
+            outputs = model(inputs)
+        results = []
+        for out in outputs:
+            inst = out["instances"].to("cpu")
+            keep = inst.pred_classes.numpy() == self.figure
+            corners = inst.pred_boxes.tensor.numpy()[keep]
+            boxes = [(int(x0), int(y0), int(round(x1 - x0)), int(round(y1 - y0))) for x0, y0, x1, y1 in corners]
+            results.append((boxes, inst.scores.numpy()[keep].tolist()))
+        return results
+
+
+def load(threads=THREADS):
+    """One LayoutModel per process."""
+    if "model" not in _loaded:
+        _loaded["model"] = LayoutModel(threads=threads)
+    return _loaded["model"]
+
+
+def _cache():
+    # Opened on first use by each thread (or worker process) running the stage
+    if not hasattr(_local, "cache"):
+        _local.cache = DetectionCache()
+    return _local.cache
+
+
+def detect_pages(pages, threads=THREADS):
+    """Figure proposals for several pages, as dicts with "img" (array or
+    MappedPage) and "hash". Cached layouts are reused; the rest go through
+    the model in batches of BATCH_SIZE at LAYOUT_SIDE. Sets page["boxes"]
+    (full-resolution pixels) and page["scores"]."""
+    cache = _cache()
+    todo = []
+    for page in pages:
+        hit = cache.get(page["hash"], CACHE_DETECTOR, settings(), with_scores=True)
+        if hit is None:
+            todo.append(page)
+        else:
+            page["boxes"], page["scores"] = hit
+    metrics.count("layout_cached", len(pages) - len(todo))
+
+    model = load(threads) if todo else None
+    for start in range(0, len(todo), BATCH_SIZE):
+        batch = todo[start:start + BATCH_SIZE]
+        with metrics.stage("layout_resize"):
+            small = [tiled_page.downscale(page["img"], LAYOUT_SIDE) for page in batch]
+        with metrics.stage("layout"):
+            results = model.figures([np.ascontiguousarray(img) for img, _ in small])
+        for page, (img, scale), (boxes, scores) in zip(batch, small, results):
+            height, width = page["img"].shape[:2]
+            page["boxes"] = to_original(boxes, scale, width, height)
+            page["scores"] = scores
+            cache.put(page["hash"], CACHE_DETECTOR, settings(), page["boxes"], scores)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LayoutParser figure proposals for scanned pages")
+    parser.add_argument("folder", nargs="?", default="scans")
+    parser.add_argument("--threads", type=int, default=THREADS)
+    args = parser.parse_args()
+
+    if not available():
+        print("layoutparser is not installed (pip install layoutparser detectron2);"
+              " the detectors use their heuristic search instead")
+        return
+
+    cache = DetectionCache()
+    names = pdf_pages.list_pages(args.folder)
+    start = time.perf_counter()
+    # Read only one batch of pages at a time
+    for i in range(0, len(names), BATCH_SIZE):
+        pages = []
+        for name, path, index in names[i:i + BATCH_SIZE]:
+            img = pdf_pages.read_page(path, index)
+            if img is None:
+                print(f"  [SKIP] Could not read {name}")
+                continue
+            pages.append({"name": name, "img": img,
+                          "hash": pdf_pages.page_hash(cache.file_hash(path), index)})
+        for page in detect_pages(pages, args.threads):
+            print(f"  {page['name']}: {len(page['boxes'])} figures "
+                  + " ".join(f"{s:.2f}" for s in page["scores"] or []))
+    cache.close()
+    print(f"{len(names)} pages in {time.perf_counter() - start:.1f}s ({args.threads} threads)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import catalogue
+import pdf_pages
+
+# In manifest mode (OUTPUT = "manifest" in a detector) a run writes one small
+# JSON-lines file here instead of crops and annotated pages. They are written
+# later from the manifest, all at once (python manifest.py export) or page by
+# page on request (crop / page_image).
+MANIFEST_FOLDER = "manifests"
+
+
+class ManifestWriter:
+    """Appends one JSON line per page to manifests/<detector>_<run>.jsonl.
+
+    The first line describes the run (detector and its full parameter set);
+    every page line after it has the source file, PDF page, content hash,
+    boxes and verifier scores. Lines are flushed as pages finish, so a run
+    that stops half way still leaves a readable manifest."""
+
+    def __init__(self, detector, params, folder=MANIFEST_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+        self.run = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.path = os.path.join(folder, f"{detector}_{self.run}.jsonl")
+        self.pages = 0
+        self.file = open(self.path, "a", encoding="utf-8")
+        self._write({"run": self.run, "detector": detector, "params": params, "started": time.time()})
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+
+    def write(self, name, source, index, file_hash, boxes, scores=None, size=None, cached=False):
+        """Record one page. size is (width, height), None when the page was never decoded."""
+        self._write({
+            "run": self.run, "name": name, "source": source, "page": index, "hash": file_hash,
+            "size": list(size) if size else None,
+            "boxes": [list(map(int, b)) for b in boxes],
+            "scores": [round(float(s), 4) for s in scores] if scores else None,
+            "cached": cached,
+        })
+        self.pages += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read(path):
+    """(run header, [page records]) of one manifest."""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return records[0], records[1:]
+
+
+def latest(folder=MANIFEST_FOLDER, detector=None):
+    """Path of the newest manifest (of one detector), or None."""
+    names = [f for f in os.listdir(folder) if f.endswith(".jsonl")] if os.path.isdir(folder) else []
+    if detector:
+        names = [f for f in names if f.startswith(detector + "_")]
+    if not names:
+        return None
+    return max((os.path.join(folder, f) for f in names), key=os.path.getmtime)
+
+
+def page_image(record):
+    """The full page of a manifest record, read again from its source."""
+    return pdf_pages.read_page(record["source"], record["page"])
+
+
+def crop(record, i, img=None):
+    """Box i of a page as a BGR array, without writing anything."""
+    if img is None:
+        img = page_image(record)
+    x, y, w, h = record["boxes"][i]
+    return img[y:y+h, x:x+w]
+
+
+def _export_page(job):
+    """Write the outputs of one page with the detector's own write_outputs,
+    so exported files are the same as those of a files-mode run."""
+    detector, record, overlay = job
+    if not record["boxes"]:
+        return record["name"], [], None
+    try:
+        img = page_image(record)
+        if img is None:
+            return record["name"], [], "Could not read file"
+        paths = importlib.import_module(detector).write_outputs(
+            record["name"], img, [tuple(b) for b in record["boxes"]], record["scores"], overlay)
+        return record["name"], paths, None
+    except Exception as e:
+        return record["name"], [], f"{type(e).__name__}: {e}"
+
+
+def export(path, overlays=True, names=None, workers=os.cpu_count() or 1):
+    """Bulk export step: write the crops (and annotated pages) of every page in
+    the manifest that has boxes, or only of the pages in names. Yields
+    (page name, written crop paths, error or None) as pages finish."""
+    header, pages = read(path)
+    if names:
+        pages = [p for p in pages if p["name"] in set(names)]
+    jobs = [(header["detector"], p, overlays) for p in pages if p["boxes"]]
+    # Same output folders as a files-mode run of the detector
+    detector = importlib.import_module(header["detector"])
+    for p in pages[:1]:
+        for out in (detector.crop_path(p["name"], 0), detector.overlay_path(p["name"])):
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+    if workers <= 1 or len(jobs) <= 1:
+        yield from map(_export_page, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=pdf_pages.close_documents) as pool:
+        yield from pool.map(_export_page, jobs, chunksize=max(1, len(jobs) // (workers * 8)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection manifests and lazy output export")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="summarize a manifest")
+    show.add_argument("manifest", nargs="?")
+    exp = sub.add_parser("export", help="write crops and annotated pages from a manifest")
+    exp.add_argument("manifest", nargs="?")
+    exp.add_argument("--pages", nargs="+", help="only these page names")
+    exp.add_argument("--no-overlays", action="store_true", help="write crops only")
+    exp.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    path = args.manifest or latest()
+    if path is None:
+        print(f"No manifest in '{MANIFEST_FOLDER}/'")
+        return
+
+    header, pages = read(path)
+    if args.command == "show":
+        boxes = sum(len(p["boxes"]) for p in pages)
+        print(f"{path}: {header['detector']}, run {header['run']}")
+        print(f"  Pages: {len(pages)}, with artwork: {sum(1 for p in pages if p['boxes'])}, boxes: {boxes}")
+        print(f"  Size: {os.path.getsize(path) / 1024:.1f} KB")
+        return
+
+    # Crop locations go into the catalogue as they are written
+    db = catalogue.Catalogue()
+    start = time.perf_counter()
+    written = 0
+    for name, paths, error in export(path, not args.no_overlays, args.pages, args.workers):
+        if error:
+            print(f"  ERROR {name}: {error}")
+            continue
+        db.set_crop_paths(name, header["detector"], paths)
+        written += len(paths)
+        print(f"  {name}: {len(paths)} crops")
+    db.close()
+    print(f"Exported {written} crops in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
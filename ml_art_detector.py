@@ -1,142 +1,352 @@
 import os
+import time
 import cv2
 import numpy as np
 
-print("=" * 60)
-print("ARTWORK DETECTION - SIMPLE VERSION")
-print("=" * 60)
+import grid_scorer
+from grid_scorer import find_artwork_cells
+from box_fusion import suppress_boxes
+import catalogue
+import crop_verifier
+from detection_cache import DetectionCache
+import instrumentation as metrics
+from manifest import ManifestWriter
+import page_store
+import page_triage
+import pdf_pages
+from pyramid import REFERENCE_SIDE, to_original
+from stream_pipeline import run_pipeline, print_stage_report
+import tiled_page
 
-# Check scans folder
-if not os.path.exists("scans"):
-    print("ERROR: No 'scans' folder")
-    exit()
+# Grid settings, in pixels of a page with a long side of REFERENCE_SIDE.
+# Scoring is vectorized over the whole page, so a finer stride no longer
+# costs minutes per page.
+CELL_SIZE = 200
+STRIDE = 150
+# Neighbouring cells always overlap (stride < cell), so cells are not fused:
+# a cell is only dropped when at least this share of it (or of a larger kept
+# cell from a coarser pyramid level) is covered by a cell already kept
+MIN_OVERLAP = 0.5
 
-files = [f for f in os.listdir("scans") if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-print(f"Found {len(files)} scan files")
+# The grid runs on a copy of the page resized to DETECT_SIDE, so results do
+# not depend on scan DPI. Extra PYRAMID_LEVELS repeat the search at half,
+# quarter... resolution to catch artworks much bigger than one cell.
+DETECT_SIDE = REFERENCE_SIDE
+PYRAMID_LEVELS = 1
 
-# Create output folders
-for folder in ["simple_detections", "simple_artworks"]:
-    if os.path.exists(folder):
-        for f in os.listdir(folder):
-            os.remove(os.path.join(folder, f))
-    else:
-        os.makedirs(folder)
-
-# ARTWORK DETECTION HEURISTICS
-def is_likely_artwork(roi):
-    """Check if a region looks like an artwork (not UI/text)."""
-    if roi.size == 0:
-        return False
-    
-    h, w = roi.shape[:2]
-    
-    # 1. Check aspect ratio (artworks are usually reasonable)
-    aspect = w / h
-    if aspect < 0.3 or aspect > 3:
-        return False
-    
-    # 2. Check color variety (artworks have colors, UI/text is limited)
-    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-    hue_std = np.std(hsv[:,:,0])
-    sat_std = np.std(hsv[:,:,1])
-    
-    # UI elements have low color variety
-    if hue_std < 10 and sat_std < 20:
-        return False
-    
-    # 3. Check edge pattern (artworks have organic edges, UI has sharp edges)
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
-    edge_density = np.sum(edges > 0) / (w * h)
-    
-    # Too few edges (solid color) or too many (text/UI)
-    if edge_density < 0.005 or edge_density > 0.3:
-        return False
-    
-    # 4. Check for frame/border (artworks often have them)
-    # Look for dark border around lighter center
-    border_size = min(w, h) // 10
-    if border_size > 5:
-        # Check top border
-        top_region = roi[:border_size, :]
-        bottom_region = roi[-border_size:, :]
-        left_region = roi[:, :border_size]
-        right_region = roi[:, -border_size:]
-        
-        border_regions = [top_region, bottom_region, left_region, right_region]
-        center_region = roi[border_size:-border_size, border_size:-border_size]
-        
-        if center_region.size > 0:
-            border_brightness = np.mean([np.mean(cv2.cvtColor(r, cv2.COLOR_BGR2GRAY)) 
-                                         for r in border_regions])
-            center_brightness = np.mean(cv2.cvtColor(center_region, cv2.COLOR_BGR2GRAY))
-            
-            # If border is darker than center (like a frame)
-            if border_brightness < center_brightness * 0.8:
-                return True
-    
-    return True
-
-# Process each file
-for file_name in files:
-    print(f"\nProcessing: {file_name}")
-    
-    img = cv2.imread(os.path.join("scans", file_name))
-    if img is None:
-        continue
-    
+# Everything that changes the result is part of the cache key
+DETECTOR = "ml_art_detector"
+PARAMS = {
+    "cell_size": CELL_SIZE,
+    "stride": STRIDE,
+    "merge": "suppress",
+    "min_overlap": MIN_OVERLAP,
+    "detect_side": DETECT_SIDE,
+    "pyramid_levels": PYRAMID_LEVELS,
+    "min_hue_std": grid_scorer.MIN_HUE_STD,
+    "min_sat_std": grid_scorer.MIN_SAT_STD,
+    "min_edge_density": grid_scorer.MIN_EDGE_DENSITY,
+    "max_edge_density": grid_scorer.MAX_EDGE_DENSITY,
+}
+
+# Working memory of the grid scorer per pixel (HSV, gray, edges and five float64
+# summed-area tables), used to size tiles when a level is over the memory budget
+TILE_BYTES_PER_PIXEL = 56
+
+# Skip the grid search on pages whose thumbnail looks text-only (see
+# page_triage.py). Off until a calibrated triage_model.json exists, as in
+# scan_pipeline.py
+TRIAGE = False
+
+# Decode each page once into page_store/ and score the grid on its stored
+# gray, HSV and edge maps (see page_store.py). Off unless ART_STORE is set,
+# as in scan_pipeline.py
+STORE = page_store.ENABLED
+
+# Optional classifier check of every region before it is written (see
+# crop_verifier.py). None = off; a .keras or quantized .tflite path = on.
+VERIFY_MODEL = None
+VERIFY_THRESHOLD = crop_verifier.THRESHOLD
+
+# "files" writes crops and annotated pages; "manifest" only records the boxes
+# in manifests/ and leaves the images to: python manifest.py export
+OUTPUT = "files"
+
+
+def crop_path(file_name, i):
+    return os.path.join("simple_artworks", f"{file_name[:-4]}_art_{i+1}.jpg")
+
+
+def overlay_path(file_name):
+    return os.path.join("simple_detections", f"det_{file_name}")
+
+
+def detect_artworks(img, stored=None):
+    """Grid search plus suppression of duplicate cells. Returns (initial_count, kept boxes)
+    with boxes in full-resolution pixels. stored is the page_store.StoredPage
+    of img, if any, to take the pyramid levels and their maps from."""
     height, width = img.shape[:2]
-    img_detection = img.copy()
-    
+    with metrics.stage("pyramid"):
+        if stored is not None:
+            pyramid = [(level.image(), scale, level)
+                       for level, scale in stored.pyramid(DETECT_SIDE, PYRAMID_LEVELS)]
+        else:
+            pyramid = [(level, scale, None)
+                       for level, scale in tiled_page.build_pyramid(img, DETECT_SIDE, PYRAMID_LEVELS)]
+
+    # Cell size in pixels of the first (largest) pyramid level; coarser
+    # levels keep the same cell, which covers more of the page
+    base = pyramid[0][0]
+    k = max(base.shape[:2]) / REFERENCE_SIDE
+    cell_size = max(20, round(CELL_SIZE * k))
+    stride = max(1, round(STRIDE * k))
+
     # METHOD: Grid search for artwork-like regions
-    cell_size = 200
-    stride = 150
-    
+    # HSV, gray and Canny are computed once per level and every cell is
+    # scored with summed-area table lookups (see grid_scorer.py)
     detections = []
-    
-    for y in range(0, height - cell_size, stride):
-        for x in range(0, width - cell_size, stride):
-            roi = img[y:y+cell_size, x:x+cell_size]
-            
-            if is_likely_artwork(roi):
-                detections.append((x, y, cell_size, cell_size))
-    
-    print(f"  Initial detections: {len(detections)}")
-    
-    # Merge nearby detections
-    merged = []
-    for (x, y, w, h) in detections:
-        found = False
-        for i, (mx, my, mw, mh) in enumerate(merged):
-            # If close to existing detection, merge
-            if (abs(x - mx) < 50 and abs(y - my) < 50):
-                new_x = min(x, mx)
-                new_y = min(y, my)
-                new_w = max(x + w, mx + mw) - new_x
-                new_h = max(y + h, my + mh) - new_y
-                merged[i] = (new_x, new_y, new_w, new_h)
-                found = True
-                break
-        
-        if not found:
-            merged.append((x, y, w, h))
-    
-    print(f"  After merging: {len(merged)} regions")
-    
-    # Draw and save
-    for i, (x, y, w, h) in enumerate(merged):
-        cv2.rectangle(img_detection, (x, y), (x+w, y+h), (0, 255, 0), 3)
-        
-        # Crop and save
+    for level, scale, derived in pyramid:
+        # Levels over the memory budget are scored in tiles on the same grid
+        # (stored maps are only used for a whole level)
+        cells = tiled_page.detect_tiled(
+            level, lambda tile: find_artwork_cells(tile, cell_size, stride,
+                                                   derived=derived if tile is level else None),
+            TILE_BYTES_PER_PIXEL, cell_size + stride, align=stride)
+        detections.extend(to_original(cells, scale, width, height))
+
+    # Drop cells found twice (tile overlaps) or mostly inside a coarser level's cell
+    with metrics.stage("suppress"):
+        merged = suppress_boxes(detections, MIN_OVERLAP)
+
+    return len(detections), merged
+
+
+def decode_page(task):
+    """Stage 1: read the page. Unreadable pages are dropped."""
+    file_name, file_hash, cached, (path, index) = task
+    record = metrics.new_page(file_name, DETECTOR)
+    page = {"file_name": file_name, "hash": file_hash, "source": (path, index), "img": None,
+            "stored": None, "boxes": cached, "size": None, "triaged": False, "log": [], "metrics": record}
+
+    # Text-only pages are decided on a thumbnail and never fully decoded
+    if TRIAGE and cached is None:
+        with metrics.recording(record), metrics.stage("triage"):
+            result = page_triage.load().check_page(path, index)
+        if result is not None and not result[0]:
+            page["boxes"] = []
+            page["triaged"] = True
+            page["log"].append(f"  Triage: text page (score {result[1]:.2f}), skipped")
+            return page
+
+    with metrics.recording(record), metrics.stage("imread"):
+        # Large PPM scans are memory-mapped, PDF pages rendered only now,
+        # pages seen before mapped from the page store
+        if STORE:
+            page["stored"] = page_store.load().page(path, index, file_hash)
+            page["img"] = page["stored"].image() if page["stored"] else None
+        else:
+            page["img"] = pdf_pages.read_page(path, index)
+    if page["img"] is None:
+        print(f"\nProcessing: {file_name}\n  ERROR: Could not read file")
+        return None
+    page["size"] = (page["img"].shape[1], page["img"].shape[0])
+    return page
+
+
+def detect_page(page):
+    """Stage 2: grid search and merge, unless the boxes came from the cache or triage."""
+    if page["triaged"]:
+        page["fresh"] = True
+    elif page["boxes"] is not None:
+        page["log"].append(f"  Cached: {len(page['boxes'])} regions")
+        page["fresh"] = False
+    else:
+        with metrics.recording(page["metrics"]):
+            initial, page["boxes"] = detect_artworks(page["img"], page["stored"])
+        page["log"].append(f"  Initial detections: {initial}")
+        page["log"].append(f"  After suppression: {len(page['boxes'])} regions")
+        page["fresh"] = True
+    return page
+
+
+def verify_pages(pages):
+    """Stage 3: score the fresh regions of several pages in one classifier batch
+    and drop the ones below VERIFY_THRESHOLD. If the batch fails, its pages are
+    scored one by one, and a page that still fails is reported and dropped
+    like an unreadable one, instead of the stage dropping the whole batch."""
+    todo = [p for p in pages if p["fresh"] and p["boxes"]]
+    found = [len(p["boxes"]) for p in todo]
+    failed = set()
+    start = time.perf_counter()
+    try:
+        crop_verifier.verify_pages(todo, crop_verifier.load(VERIFY_MODEL), VERIFY_THRESHOLD)
+    except Exception:
+        for page in todo:
+            try:
+                crop_verifier.verify_pages([page], crop_verifier.load(VERIFY_MODEL), VERIFY_THRESHOLD)
+            except Exception as e:
+                print(f"\nProcessing: {page['file_name']}\n  ERROR: verify: {type(e).__name__}: {e}")
+                failed.add(id(page))
+    elapsed = time.perf_counter() - start
+    for page, n in zip(todo, found):
+        if page["metrics"] is not None:
+            page["metrics"]["timings"]["verify"] = elapsed / len(todo)
+        page["log"].append(f"  Verified: {len(page['boxes'])} of {n} kept")
+    return [p for p in pages if id(p) not in failed]
+
+
+def write_outputs(file_name, img, boxes, scores=None, overlay=True):
+    """Write the crops of one page, then draw its boxes in place and write the
+    annotated page. Shared by write_page and manifest export; returns the crop paths."""
+    # Remove crops left over from an earlier run that found more regions
+    i = len(boxes)
+    while os.path.exists(crop_path(file_name, i)):
+        os.remove(crop_path(file_name, i))
+        i += 1
+
+    # Crop and save
+    crops = []
+    for i, (x, y, w, h) in enumerate(boxes):
         artwork = img[y:y+h, x:x+w]
-        crop_path = os.path.join("simple_artworks", f"{file_name[:-4]}_art_{i+1}.jpg")
-        cv2.imwrite(crop_path, artwork)
-    
-    if merged:
-        det_path = os.path.join("simple_detections", f"det_{file_name}")
-        cv2.imwrite(det_path, img_detection)
-        print(f"  Saved: {det_path}")
-
-print("\n" + "=" * 60)
-print("DONE! Check 'simple_artworks/' folder")
-print("=" * 60)
\ No newline at end of file
+        with metrics.stage("crop_writes"):
+            tiled_page.write_image(crop_path(file_name, i), artwork)
+        metrics.wrote(crop_path(file_name, i))
+        crops.append(crop_path(file_name, i))
+
+    # Draw and save, in place: the crops are already written
+    if overlay and boxes:
+        tiled_page.write_annotated(overlay_path(file_name), img, boxes)
+        metrics.wrote(overlay_path(file_name))
+    return crops
+
+
+def write_page(page):
+    """Stage 4: write crops, then draw boxes and write the annotated page.
+    In manifest mode nothing is written; main records the boxes instead."""
+    file_name = page["file_name"]
+    merged = page["boxes"]
+    det_path = overlay_path(file_name)
+
+    if OUTPUT != "manifest":
+        with metrics.recording(page["metrics"]):
+            page["crops"] = write_outputs(file_name, page["img"], merged)
+            if merged:
+                page["log"].append(f"  Saved: {det_path}")
+            elif os.path.exists(det_path):
+                os.remove(det_path)
+
+    page["img"] = None
+    page["stored"] = None
+    return page
+
+
+def process_pages(pages, manifest=None):
+    """Detect artwork on pages given as (name, path, pdf_page), skipping the
+    ones already done, and record the results (cache, catalogue, and the
+    manifest in manifest mode). Used by main and by watch_folder.py.
+    Returns the artworks found and the number of pages taken from the cache;
+    unreadable pages are reported and dropped."""
+    # Output folders are kept between runs; only new or changed pages are redone
+    if OUTPUT == "files":
+        for folder in ["simple_detections", "simple_artworks"]:
+            os.makedirs(folder, exist_ok=True)
+
+    cache = DetectionCache()
+    # Skipped and verified pages depend on the triage and verifier models too
+    params = dict(PARAMS)
+    if TRIAGE:
+        params.update(page_triage.load().settings())
+    if VERIFY_MODEL:
+        params.update(crop_verifier.cache_settings(VERIFY_MODEL, VERIFY_THRESHOLD))
+    if manifest is None and OUTPUT == "manifest":
+        manifest = ManifestWriter(DETECTOR, params)
+    tasks = []
+    records = []
+    reused = 0
+    total_artworks = 0
+
+    for file_name, path, index in pages:
+        file_hash = pdf_pages.page_hash(cache.file_hash(path), index)
+        cached, scores = cache.get(file_hash, DETECTOR, params, with_scores=True) or (None, None)
+
+        # Skip pages whose results are known and, in files mode, already written
+        written = cached is not None and (not cached or os.path.exists(overlay_path(file_name))) \
+            and all(os.path.exists(crop_path(file_name, i)) for i in range(len(cached)))
+        if written or (cached is not None and manifest):
+            if manifest:
+                manifest.write(file_name, path, index, file_hash, cached, scores, cached=True)
+            crops = [crop_path(file_name, i) for i in range(len(cached))] if written else None
+            records.append(catalogue.page_record(file_name, path, index, file_hash, cached, scores, crops=crops))
+            total_artworks += len(cached)
+            reused += 1
+            continue
+        tasks.append((file_name, file_hash, cached, (path, index)))
+
+    # Process each file: decode, detect and write run in separate threads,
+    # so writing one page overlaps detection of the next
+    stages = [("decode", decode_page), ("detect", detect_page), ("write", write_page)]
+    if VERIFY_MODEL:
+        stages.insert(2, ("verify", verify_pages, crop_verifier.PAGES_PER_BATCH))
+    stats = []
+    sink = metrics.MetricsSink()
+    start = time.perf_counter()
+
+    for page in run_pipeline(tasks, stages, stats):
+        sink.write(page["metrics"])
+        print(f"\nProcessing: {page['file_name']}")
+        for line in page["log"]:
+            print(line)
+        if page["fresh"]:
+            cache.put(page["hash"], DETECTOR, params, page["boxes"], page.get("scores"))
+        if manifest:
+            manifest.write(page["file_name"], *page["source"], page["hash"], page["boxes"],
+                           page.get("scores"), page["size"], not page["fresh"])
+        records.append(catalogue.page_record(page["file_name"], *page["source"], page["hash"], page["boxes"],
+                                             page.get("scores"), page["size"], page.get("crops")))
+        total_artworks += len(page["boxes"])
+
+    cache.close()
+    sink.close()
+    if STORE:
+        page_store.load().prune()
+    db = catalogue.Catalogue()
+    db.upsert_pages(DETECTOR, params, records)
+    db.close()
+    print(f"\nUp to date (cached): {reused} pages")
+    print_stage_report(stats, time.perf_counter() - start)
+    if metrics.ENABLED:
+        print(f"Metrics: {metrics.METRICS_PATH}")
+    return {"artworks": total_artworks, "reused": reused, "manifest": manifest}
+
+
+def main():
+    print("=" * 60)
+    print("ARTWORK DETECTION - SIMPLE VERSION")
+    print("=" * 60)
+
+    # Check scans folder
+    if not os.path.exists("scans"):
+        print("ERROR: No 'scans' folder")
+        exit()
+
+    # Image files, and every page of each PDF
+    pages = pdf_pages.list_pages("scans")
+    print(f"Found {len(pages)} scan pages")
+    if VERIFY_MODEL:
+        print(f"Verifier: {VERIFY_MODEL} (threshold {VERIFY_THRESHOLD})")
+
+    manifest = process_pages(pages)["manifest"]
+    if manifest:
+        manifest.close()
+
+    print("\n" + "=" * 60)
+    if manifest:
+        print(f"DONE! Manifest: {manifest.path} ({os.path.getsize(manifest.path) / 1024:.1f} KB)")
+        print(f"Write crops from it with: python manifest.py export {manifest.path}")
+    else:
+        print("DONE! Check 'simple_artworks/' folder")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import functools
+import itertools
+import sqlite3
+import time
+
+import cv2
+import numpy as np
+
+from detection_cache import DetectionCache
+import page_triage
+import pdf_pages
+import tiled_page
+
+DEDUP_PATH = "page_hashes.sqlite"
+
+# Pages are compared by a 64-bit perceptual hash (DCT of a 32x32 gray copy of
+# the thumbnail). The same scan at another DPI or recompressed is within a
+# bit or two, cropped by 1-2% per side within MAX_DISTANCE; the bundled
+# scans are 16 or more bits apart from each other.
+HASH_SIDE = 32
+HASH_BITS = 8
+MAX_DISTANCE = 8
+
+# Multi-index hashing: the hash is split into CHUNKS parts of up to 22 bits,
+# each with its own sorted table. Two hashes at most MAX_DISTANCE apart have a
+# part at most MAX_DISTANCE // CHUNKS apart, so a lookup only probes those
+# few values of each part and checks the full hash of what it finds.
+CHUNKS = 3
+CHUNK_BITS = 22
+
+# Hashes added since the tables were sorted are checked one by one; past
+# this many the tables are rebuilt
+REBUILD_EVERY = 4096
+
+_PART_MASK = (1 << CHUNK_BITS) - 1
+
+
+def phash(thumb):
+    """64-bit perceptual hash of a BGR (or gray) image, as a Python int."""
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY) if thumb.ndim == 3 else thumb
+    small = cv2.resize(gray, (HASH_SIDE, HASH_SIDE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:HASH_BITS, :HASH_BITS].ravel()
+    # The DC term only says how bright the page is
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def page_phash(path, index=None):
+    """Perceptual hash of one page from its thumbnail, or None if it can't be read."""
+    if index is None:
+        thumb = page_triage.read_thumbnail(path)
+    else:
+        thumb = pdf_pages.thumbnail(path, index, page_triage.THUMB_SIDE)
+    return None if thumb is None else phash(thumb)
+
+
+def image_phash(img):
+    """Perceptual hash of a decoded page, through the same thumbnail as page_phash."""
+    return phash(tiled_page.downscale(img, page_triage.THUMB_SIDE)[0])
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+@functools.lru_cache()
+def _flips(radius):
+    """Every part mask with at most radius bits set."""
+    masks = [0]
+    for n in range(1, radius + 1):
+        masks += [sum(1 << b for b in bits) for bits in itertools.combinations(range(CHUNK_BITS), n)]
+    return np.array(masks, np.uint64)
+
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class DuplicateIndex:
+    """Perceptual hashes of every page seen, with the page hash (detection
+    cache key) and size of each, persisted in SQLite and searched in memory.
+
+    A lookup at 1M pages is one batch of binary searches over the part
+    table, then one vectorized popcount over the candidates it finds."""
+
+    def __init__(self, path=DEDUP_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS page_phashes (
+                page_hash TEXT PRIMARY KEY, phash INTEGER, width INTEGER, height INTEGER
+            )""")
+        rows = self.db.execute("SELECT rowid, page_hash, phash, width, height FROM page_phashes").fetchall()
+        self.keys = [r[1] for r in rows]
+        self.sizes = [(r[3], r[4]) if r[3] else None for r in rows]
+        self.hashes = np.array([r[2] for r in rows], np.int64).view(np.uint64)
+        self.known = set(self.keys)
+        # Rows up to this one are loaded; refresh picks up the ones committed since
+        self.last_row = max((r[0] for r in rows), default=0)
+        self._build()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _build(self):
+        # One sorted table for all parts: (part number << CHUNK_BITS | part value).
+        # Entries past len(self.hashes) are in self.keys but not sorted yet.
+        self.pending = []
+        n = len(self.hashes)
+        parts = np.empty(CHUNKS * n, np.uint32)
+        for c in range(CHUNKS):
+            part = (self.hashes >> np.uint64(c * CHUNK_BITS)) & np.uint64(_PART_MASK)
+            parts[c * n:(c + 1) * n] = part.astype(np.uint32) | np.uint32(c << CHUNK_BITS)
+        order = np.argsort(parts, kind="stable")
+        self.sorted = parts[order]
+        self.order = (order % max(n, 1)).astype(np.int64)
+
+    def add(self, page_hash, value, size=None):
+        """Remember a page (size is (width, height), None if never decoded).
+        Pages already known keep their first entry."""
+        if page_hash in self.known:
+            return
+        self.db.execute("INSERT OR REPLACE INTO page_phashes VALUES (?, ?, ?, ?)",
+                        (page_hash, _signed(value), *(size or (None, None))))
+        self._remember(page_hash, value, size)
+
+    def refresh(self):
+        """Load the pages other connections committed since this index was read,
+        e.g. pages the main process finished while a worker runs."""
+        rows = self.db.execute("SELECT rowid, page_hash, phash, width, height FROM page_phashes "
+                               "WHERE rowid > ? ORDER BY rowid", (self.last_row,)).fetchall()
+        for row, page_hash, value, width, height in rows:
+            self.last_row = row
+            if page_hash not in self.known:
+                self._remember(page_hash, value % (1 << 64), (width, height) if width else None)
+
+    def _remember(self, page_hash, value, size):
+        self.known.add(page_hash)
+        self.keys.append(page_hash)
+        self.sizes.append(tuple(size) if size else None)
+        self.pending.append(value)
+        if len(self.pending) > REBUILD_EVERY:
+            self.hashes = np.concatenate([self.hashes, np.array(self.pending, np.uint64)])
+            self._build()
+
+    def lookup(self, value, max_distance=MAX_DISTANCE):
+        """Known pages within max_distance bits of a hash, nearest first, as
+        (distance, page_hash, size)."""
+        flips = _flips(max_distance // CHUNKS)
+        probes = np.concatenate([
+            (flips ^ np.uint64((value >> (c * CHUNK_BITS)) & _PART_MASK)) | np.uint64(c << CHUNK_BITS)
+            for c in range(CHUNKS)]).astype(np.uint32)
+        lo = np.searchsorted(self.sorted, probes, "left")
+        hi = np.searchsorted(self.sorted, probes, "right")
+        # Every row of every matching range, without a Python loop over ranges
+        lengths = hi - lo
+        starts = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+        candidates = self.order[starts + np.arange(lengths.sum())]
+
+        dist = np.bitwise_count(self.hashes[candidates] ^ np.uint64(value))
+        near = dist <= max_distance
+        # A hash can be found through several of its parts
+        matches = sorted(set(zip(dist[near].tolist(), candidates[near].tolist())))
+        first = len(self.hashes)
+        matches += [(d, first + i) for i, other in enumerate(self.pending)
+                    if (d := distance(value, other)) <= max_distance]
+        return [(d, self.keys[i], self.sizes[i]) for d, i in sorted(matches)]
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def rescale_boxes(boxes, from_size, to_size):
+    """Boxes of a page of from_size (width, height) on its duplicate of to_size."""
+    sx = to_size[0] / from_size[0]
+    sy = to_size[1] / from_size[1]
+    out = []
+    for x, y, w, h in boxes:
+        x0, y0 = min(int(round(x * sx)), to_size[0] - 1), min(int(round(y * sy)), to_size[1] - 1)
+        x1, y1 = min(int(round((x + w) * sx)), to_size[0]), min(int(round((y + h) * sy)), to_size[1])
+        out.append((x0, y0, max(1, x1 - x0), max(1, y1 - y0)))
+    return out
+
+
+def report(folder, index):
+    """Hash every page of a folder into the index and print the near-duplicates."""
+    cache = DetectionCache()
+    groups = 0
+    for name, path, page in pdf_pages.list_pages(folder):
+        value = page_phash(path, page)
+        if value is None:
+            print(f"  [SKIP] Could not read {name}")
+            continue
+        file_hash = pdf_pages.page_hash(cache.file_hash(path), page)
+        matches = [m for m in index.lookup(value) if m[1] != file_hash]
+        if matches:
+            groups += 1
+            print(f"  {name}: {len(matches)} near-duplicates, nearest {matches[0][0]} bits")
+        index.add(file_hash, value)
+    cache.close()
+    print(f"{groups} pages with near-duplicates, {len(index)} pages indexed")
+
+
+def bench(pages, lookups=1000):
+    """Lookup time on an in-memory index of random hashes."""
+    rng = np.random.default_rng(0)
+    index = DuplicateIndex(":memory:")
+    values = rng.integers(0, (1 << 64) - 1, pages, dtype=np.uint64, endpoint=True)
+    index.keys = [str(i) for i in range(pages)]
+    index.sizes = [None] * pages
+    index.hashes = values
+    start = time.perf_counter()
+    index._build()
+    print(f"Built {pages} hashes in {time.perf_counter() - start:.2f}s")
+
+    # Queries a few bits off stored hashes, so every lookup has a match
+    queries = []
+    for value in values[:lookups].tolist():
+        for b in rng.choice(64, MAX_DISTANCE, replace=False).tolist():
+            value ^= 1 << b
+        queries.append(value)
+    start = time.perf_counter()
+    hits = sum(1 for q in queries if index.lookup(q))
+    per = (time.perf_counter() - start) / lookups
+    print(f"{lookups} lookups at distance {MAX_DISTANCE}: {per * 1e6:.0f} us each, {hits} found")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash index of scanned pages")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rep = sub.add_parser("report", help="index a folder and list near-duplicate pages")
+    rep.add_argument("folder", nargs="?", default="scans")
+    ben = sub.add_parser("bench", help="time lookups on random hashes")
+    ben.add_argument("--pages", type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        index = DuplicateIndex()
+        report(args.folder, index)
+        index.close()
+    elif args.command == "bench":
+        bench(args.pages)
+
+
+if __name__ == "__main__":
+    main()
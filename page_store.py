@@ -0,0 +1,340 @@
+import argparse
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from detection_cache import DetectionCache
+import instrumentation as metrics
+import page_triage
+import pdf_pages
+from pyramid import REFERENCE_SIDE
+import tiled_page
+
+STORE_DIR = "page_store"
+
+# Set ART_STORE to keep the maps on disk for later runs. Without it pages are
+# read and their maps computed in memory, once per run, and nothing is written.
+ENABLED = bool(os.environ.get("ART_STORE"))
+
+# Least recently used pages are deleted once the store is bigger than this,
+# in MB (set ART_STORE_MB to change)
+MAX_STORE_MB = int(os.environ.get("ART_STORE_MB", 4096))
+
+# Only levels up to this long side are written to the store: the detectors
+# read the page at REFERENCE_SIDE or smaller. Full-resolution images and
+# maps of bigger pages are kept in memory for the run, never on disk.
+STORED_SIDE = REFERENCE_SIDE
+
+# What `python page_store.py build` computes ahead of the detectors: every
+# map at these long sides (sides over the page size are the full page) and
+# the two edge maps the detectors use. Anything else is computed the first
+# time a script asks for it.
+LEVELS = (REFERENCE_SIDE, page_triage.THUMB_SIDE)
+EDGE_MAPS = (("blur", 30, 100), ("gray", 50, 150))
+
+
+def _pixels(img):
+    # Maps are computed on whole images; a MappedPage is read in full
+    return img[:] if isinstance(img, tiled_page.MappedPage) else img
+
+
+class StoredLevel:
+    """One resolution of a stored page: its BGR image and the maps derived
+    from it. Each is computed on first use; at STORED_SIDE or below it is
+    saved as .npy and from then on memory-mapped, so every process reading it
+    shares the same file pages. Maps are read-only; the image is copy-on-write."""
+
+    def __init__(self, page, name, scale, make_image, side=None):
+        self.page = page
+        self.name = name
+        self.scale = scale
+        self._make_image = make_image
+        # Long side of the level; the full page's is read from its image
+        self.side = side
+
+    @property
+    def stored(self):
+        side = self.side if self.side is not None else max(self.shape[:2])
+        return side <= STORED_SIDE
+
+    def _map(self, name, compute, mode="r"):
+        return self.page._map(f"{self.name}_{name}", compute, mode, self.stored)
+
+    @property
+    def shape(self):
+        if self.name == "full":
+            return self.page.shape
+        return self.image().shape
+
+    def image(self):
+        if self.name == "full":
+            return self.page.full_image()
+        return self._map("bgr", self._make_image, "c")
+
+    def gray(self):
+        return self._map("gray", lambda: cv2.cvtColor(_pixels(self.image()), cv2.COLOR_BGR2GRAY))
+
+    def blur(self):
+        return self._map("blur", lambda: cv2.GaussianBlur(self.gray(), (5, 5), 0))
+
+    def hsv(self):
+        return self._map("hsv", lambda: cv2.cvtColor(_pixels(self.image()), cv2.COLOR_BGR2HSV))
+
+    def canny(self, low, high, source="blur"):
+        """Canny edges of the blurred gray map, or of the plain one with source="gray"."""
+        src = self.blur if source == "blur" else self.gray
+        return self._map(f"canny_{source}_{low:g}_{high:g}", lambda: cv2.Canny(src(), low, high))
+
+
+class StoredPage:
+    """The maps of one page at any resolution, in their own folder of the
+    store (folder None: in memory only)."""
+
+    def __init__(self, folder, load, mapped=None):
+        self.folder = folder
+        self._load = load
+        # A PPM scan is already memory-mapped; it is its own full-resolution image
+        self.mapped = mapped
+        self.maps = {}
+        # A decoded page over STORED_SIDE, kept for this run only
+        self.decoded = None
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            # Last use, for prune
+            os.utime(folder)
+
+    def _map(self, name, compute, mode="r", stored=True):
+        if name in self.maps:
+            return self.maps[name]
+        if not stored or self.folder is None:
+            arr = compute()
+            if arr is not None:
+                self.maps[name] = arr
+            return arr
+        path = os.path.join(self.folder, name + ".npy")
+        if not os.path.exists(path):
+            arr = compute()
+            if arr is None:
+                return None
+            # Written under a temporary name, so a pool worker never maps half a file
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with metrics.stage("store_write"), open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, path)
+            metrics.count("store_computed")
+        self.maps[name] = np.load(path, mmap_mode=mode)
+        return self.maps[name]
+
+    def full_image(self):
+        if self.mapped is not None:
+            return self.mapped
+        if "full_bgr" in self.maps:
+            return self.maps["full_bgr"]
+        if self.folder is not None and os.path.exists(os.path.join(self.folder, "full_bgr.npy")):
+            return self._map("full_bgr", self._load, "c")
+        if self.decoded is None:
+            self.decoded = self._load()
+            if self.decoded is None:
+                return None
+        if self.folder is None or max(self.decoded.shape[:2]) > STORED_SIDE:
+            return self.decoded
+        # A page no bigger than STORED_SIDE is the level the detectors read
+        img = self._map("full_bgr", lambda: self.decoded, "c")
+        self.decoded = None
+        return img
+
+    def image(self):
+        """The full-resolution page (None if it can't be read)."""
+        return self.level().image()
+
+    @property
+    def shape(self):
+        """Shape of the full page (None if it can't be read). Stored with the
+        maps, so a page seen before is not decoded just to size its levels."""
+        if self.mapped is not None:
+            return self.mapped.shape
+
+        def compute():
+            img = self.full_image()
+            return None if img is None else np.array(img.shape, np.int64)
+        shape = self._map("full_shape", compute)
+        return None if shape is None else tuple(int(n) for n in shape)
+
+    def level(self, side=None):
+        """The page resized so its long side is side, as tiled_page.downscale
+        does (never upscaled; None = full resolution)."""
+        full = StoredLevel(self, "full", 1.0, None)
+        if side is None:
+            return full
+        height, width = self.shape[:2]
+        scale = min(1.0, side / max(height, width))
+        if scale == 1.0:
+            return full
+        return StoredLevel(self, str(side), scale, lambda: tiled_page.downscale(full.image(), side)[0], side)
+
+    def pyramid(self, side, levels=1, factor=0.5):
+        """The levels of tiled_page.build_pyramid(image, side, levels, factor),
+        as (StoredLevel, scale)."""
+        base = self.level(side)
+        out = [(base, base.scale)]
+        img = base.image()
+        if isinstance(img, tiled_page.MappedPage) and img.nbytes > tiled_page.budget_bytes():
+            # Full resolution did not fit: coarser levels come from the file too
+            height, width = img.shape[:2]
+            for i in range(1, levels):
+                if min(height, width) * factor ** i < 32:
+                    break
+                level = self.level(round(max(height, width) * factor ** i))
+                out.append((level, level.scale))
+            return out
+        for i in range(1, levels):
+            prev, prev_scale = out[-1]
+            height, width = prev.shape[:2]
+            if min(height, width) * factor < 32:
+                break
+            size = (round(width * factor), round(height * factor))
+            level = StoredLevel(self, f"{base.name}_x{factor:g}_{i}", prev_scale * factor,
+                                lambda prev=prev, size=size: cv2.resize(prev.image(), size,
+                                                                        interpolation=cv2.INTER_AREA),
+                                max(size))
+            out.append((level, level.scale))
+        return out
+
+    def precompute(self, levels=LEVELS, edge_maps=EDGE_MAPS):
+        """Every map at each of levels now, so later runs only map them."""
+        for side in levels:
+            level = self.level(side)
+            level.gray()
+            level.blur()
+            level.hsv()
+            for source, low, high in edge_maps:
+                level.canny(low, high, source)
+
+
+class PageStore:
+    """Decoded pages and their gray, blur, HSV and Canny maps, keyed by page
+    content hash (see pdf_pages.page_hash) under STORE_DIR. The levels the
+    detectors read are computed once; every later run, script or worker
+    process maps them from disk instead of resizing and converting the page
+    again. Pages over STORED_SIDE are still decoded for their crops."""
+
+    def __init__(self, root=STORE_DIR, enabled=None):
+        self.root = root
+        # Off: every page is in memory only (see ENABLED)
+        self.enabled = ENABLED if enabled is None else enabled
+        self.cache = None
+
+    def _folder(self, page_hash):
+        key = page_hash.replace(":", "_").replace("@", "_")
+        return os.path.join(self.root, key[:2], key)
+
+    def page_hash(self, path, index=None):
+        # File hashes are remembered by the detection cache, so this is a stat
+        if self.cache is None:
+            self.cache = DetectionCache()
+        file_hash = self.cache.file_hash(path)
+        # Don't hold the write lock other processes need for their hashes
+        self.cache.commit()
+        return pdf_pages.page_hash(file_hash, index)
+
+    def page(self, path, index=None, page_hash=None):
+        """The StoredPage of one page, or None if it can't be read."""
+        folder = None
+        if self.enabled:
+            if page_hash is None:
+                page_hash = self.page_hash(path, index)
+            folder = self._folder(page_hash)
+        mapped = None
+        if index is None and path.lower().endswith(tiled_page.MAPPED_EXTS):
+            img = tiled_page.open_page(path)
+            if isinstance(img, tiled_page.MappedPage):
+                mapped = img
+        stored = StoredPage(folder, lambda: pdf_pages.read_page(path, index), mapped)
+        # Only a page never stored before is decoded here, and it is kept for image()
+        if stored.shape is None:
+            if folder is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+            return None
+        return stored
+
+    def pages(self):
+        """(folder, bytes, last use) of every stored page."""
+        out = []
+        if not os.path.isdir(self.root):
+            return out
+        for shard in os.scandir(self.root):
+            for entry in os.scandir(shard.path):
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                out.append((entry.path, size, entry.stat().st_mtime))
+        return out
+
+    def prune(self, max_mb=MAX_STORE_MB):
+        """Delete least recently used pages until the store fits max_mb.
+        Returns the number of pages deleted."""
+        pages = sorted(self.pages(), key=lambda p: p[2])
+        total = sum(size for _, size, _ in pages)
+        removed = 0
+        for folder, size, _ in pages:
+            if total <= max_mb << 20:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+_loaded = {}
+
+
+def load(root=STORE_DIR):
+    """One PageStore per process (pool workers open their own)."""
+    if root not in _loaded:
+        _loaded[root] = PageStore(root)
+    return _loaded[root]
+
+
+def build(folder, store):
+    """Decode every page of a folder once and compute its maps at LEVELS."""
+    start = time.perf_counter()
+    for name, path, index in pdf_pages.list_pages(folder):
+        t = time.perf_counter()
+        stored = store.page(path, index)
+        if stored is None:
+            print(f"  [SKIP] Could not read {name}")
+            continue
+        stored.precompute()
+        print(f"  {name}: {time.perf_counter() - t:.2f}s")
+    pages = store.pages()
+    print(f"{len(pages)} pages stored, {sum(p[1] for p in pages) / (1 << 20):.0f} MB, "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped page maps shared by the detectors "
+                                                 "(read by them when ART_STORE is set)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bld = sub.add_parser("build", help="store the maps of every page of a folder")
+    bld.add_argument("folder", nargs="?", default="scans")
+    prn = sub.add_parser("prune", help="delete least recently used pages over the size limit")
+    prn.add_argument("--max-mb", type=int, default=MAX_STORE_MB)
+    args = parser.parse_args()
+
+    store = PageStore(enabled=True)
+    if args.command == "build":
+        build(args.folder, store)
+        store.prune()
+    elif args.command == "prune":
+        print(f"Removed {store.prune(args.max_mb)} pages")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
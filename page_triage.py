@@ -0,0 +1,221 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+import pdf_pages
+import tiled_page
+
+# Triage looks at a thumbnail with this long side, never the full scan
+THUMB_SIDE = 512
+# Square cells of the thumbnail used for the picture-cell feature
+CELL = 8
+MODEL_PATH = "triage_model.json"
+LABELS_PATH = "triage_labels.csv"
+
+# Calibration keeps at least this share of labelled artwork pages
+TARGET_RECALL = 1.0
+
+FEATURES = ["edge_density", "colorful", "largest_region", "large_regions", "picture_cells"]
+
+# Used until a model is calibrated: only the picture-cell share matters, and
+# the cut sits between the text and artwork pages of the bundled scans
+DEFAULT_MODEL = {
+    "features": FEATURES,
+    "mean": [0.0] * len(FEATURES),
+    "scale": [1.0] * len(FEATURES),
+    "weights": [0.0, 0.0, 0.0, 0.0, 40.0],
+    "bias": -40.0 * 0.12,
+    "threshold": 0.5,
+}
+
+
+def read_thumbnail(path):
+    """Decode at reduced size (JPEG decodes 2x smaller directly) and shrink to THUMB_SIDE.
+    Mapped PPM scans are shrunk band by band without decoding them whole."""
+    if path.lower().endswith(tiled_page.MAPPED_EXTS):
+        img = tiled_page.open_page(path)
+    else:
+        img = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_2)
+        if img is not None and max(img.shape[:2]) < THUMB_SIDE:
+            img = cv2.imread(path)
+    if img is None:
+        return None
+    return tiled_page.downscale(img, THUMB_SIDE)[0]
+
+
+def page_features(thumb, derived=None):
+    """Cheap page statistics, all relative to the thumbnail size. derived is
+    an optional page_store.StoredLevel of thumb to take gray, HSV and edges from."""
+    # Same cues as analyze_scans.py: edge density and large distinct regions
+    if derived is not None:
+        gray, hsv, edges = derived.gray(), derived.hsv(), derived.canny(50, 150, "gray")
+    else:
+        gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        hsv = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)
+        edges = cv2.Canny(gray, 50, 150)
+    pixels = gray.size
+
+    _, binary = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    areas = np.array([cv2.contourArea(c) for c in contours] or [0.0]) / pixels
+
+    # Pictures are solid dark masses; text only darkens a small share of a cell
+    dark = (gray < np.median(gray) * 0.5).astype(np.float32)
+    h, w = gray.shape[0] // CELL * CELL, gray.shape[1] // CELL * CELL
+    cells = dark[:h, :w].reshape(h // CELL, CELL, w // CELL, CELL).mean(axis=(1, 3))
+
+    return {
+        "edge_density": cv2.countNonZero(edges) / pixels,
+        "colorful": float(np.mean((hsv[:, :, 1] > 60) & (hsv[:, :, 2] > 40))),
+        "largest_region": float(areas.max()),
+        # 10000 px on the original ~830x1800 scans
+        "large_regions": int(np.sum(areas > 0.0067)),
+        "picture_cells": float(np.mean(cells > 0.35)),
+    }
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class Triage:
+    """Decides from a thumbnail whether a page may contain artwork."""
+
+    def __init__(self, path=MODEL_PATH):
+        self.model = DEFAULT_MODEL
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.model = json.load(f)
+
+    def score(self, features):
+        x = np.array([features[name] for name in self.model["features"]], np.float64)
+        z = (x - self.model["mean"]) / self.model["scale"]
+        return float(_sigmoid(z @ np.array(self.model["weights"]) + self.model["bias"]))
+
+    def check(self, thumb, derived=None):
+        """(has_artwork, score, features) for one thumbnail."""
+        features = page_features(thumb, derived)
+        score = self.score(features)
+        return score >= self.model["threshold"], score, features
+
+    def check_file(self, path):
+        thumb = read_thumbnail(path)
+        if thumb is None:
+            return None
+        return self.check(thumb)
+
+    def check_page(self, path, index=None):
+        """check_file for a scan, or for page index of a PDF rendered at thumbnail size."""
+        if index is None:
+            return self.check_file(path)
+        return self.check(pdf_pages.thumbnail(path, index, THUMB_SIDE))
+
+    def settings(self):
+        """Cache-key entry: skipped pages depend on the triage model."""
+        text = json.dumps(self.model, sort_keys=True)
+        return {"triage": hashlib.sha256(text.encode()).hexdigest()[:16]}
+
+
+_loaded = {}
+
+
+def load(path=MODEL_PATH):
+    """One Triage per model path and process."""
+    if path not in _loaded:
+        _loaded[path] = Triage(path)
+    return _loaded[path]
+
+
+def load_labels(path=LABELS_PATH):
+    """image_filename,has_artwork rows -> {file_name: bool}."""
+    with open(path, newline="", encoding="utf-8") as f:
+        return {row["image_filename"]: row["has_artwork"].strip() in ("1", "yes", "true")
+                for row in csv.DictReader(f)}
+
+
+def calibrate(folder, labels, target_recall=TARGET_RECALL, l2=0.1, steps=2000):
+    """Fit a logistic model on labelled pages, then lower its threshold until
+    target_recall of the artwork pages pass. Returns the model and a report."""
+    if not 0 < target_recall <= 1:
+        raise ValueError(f"target_recall must be in (0, 1], got {target_recall}")
+    rows, truth = [], []
+    for name, has_art in sorted(labels.items()):
+        thumb = read_thumbnail(os.path.join(folder, name))
+        if thumb is None:
+            print(f"  [SKIP] Could not read {name}")
+            continue
+        f = page_features(thumb)
+        rows.append([f[n] for n in FEATURES])
+        truth.append(has_art)
+    x = np.array(rows, np.float64)
+    y = np.array(truth, np.float64)
+    if len(x) == 0 or y.min() == y.max():
+        raise ValueError("calibration needs labelled pages of both kinds")
+
+    mean = x.mean(axis=0)
+    scale = np.where(x.std(axis=0) > 0, x.std(axis=0), 1.0)
+    z = (x - mean) / scale
+    weights = np.zeros(len(FEATURES))
+    bias = 0.0
+    for _ in range(steps):
+        p = _sigmoid(z @ weights + bias)
+        weights -= 0.1 * (z.T @ (p - y) / len(y) + l2 * weights)
+        bias -= 0.1 * np.mean(p - y)
+
+    scores = _sigmoid(z @ weights + bias)
+    art_scores = np.sort(scores[y == 1])
+    keep = min(max(int(np.ceil(target_recall * len(art_scores))), 1), len(art_scores))
+    # Highest threshold that still passes `keep` artwork pages, with a small margin
+    threshold = float(art_scores[len(art_scores) - keep]) * 0.9
+
+    passed = scores >= threshold
+    report = {
+        "pages": len(y),
+        "recall": float(passed[y == 1].mean()),
+        "text_skipped": float((~passed[y == 0]).mean()) if (y == 0).any() else 0.0,
+        "pages_skipped": float((~passed).mean()),
+    }
+    model = {"features": FEATURES, "mean": mean.tolist(), "scale": scale.tolist(),
+             "weights": weights.tolist(), "bias": float(bias), "threshold": threshold}
+    return model, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thumbnail triage of scanned pages")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="triage every page of a folder")
+    report.add_argument("folder", nargs="?", default="scans")
+    cal = sub.add_parser("calibrate", help="fit the triage model on labelled pages")
+    cal.add_argument("labels", nargs="?", default=LABELS_PATH)
+    cal.add_argument("--folder", default="scans")
+    cal.add_argument("--recall", type=float, default=TARGET_RECALL)
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        model, result = calibrate(args.folder, load_labels(args.labels), args.recall)
+        with open(MODEL_PATH, "w") as f:
+            json.dump(model, f, indent=1)
+        print(f"Calibrated on {result['pages']} pages: artwork recall {result['recall']:.2f}, "
+              f"text pages skipped {result['text_skipped']:.2f}")
+        print(f"Saved {MODEL_PATH}")
+    elif args.command == "report":
+        triage = Triage()
+        pages = pdf_pages.list_pages(args.folder)
+        skipped = 0
+        for name, path, index in pages:
+            result = triage.check_page(path, index)
+            if result is None:
+                continue
+            has_art, score, _ = result
+            skipped += not has_art
+            print(f"  {'ARTWORK' if has_art else 'text   '}  {score:.3f}  {name}")
+        print(f"Would skip {skipped} of {len(pages)} pages")
+
+
+if __name__ == "__main__":
+    main()
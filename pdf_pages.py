@@ -0,0 +1,111 @@
+import os
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import tiled_page
+
+# PDF pages are rasterized at this resolution, one page at a time, when a
+# detector gets to them. Nothing is written to disk besides the usual outputs.
+PDF_DPI = 150
+PDF_EXTS = ('.pdf',)
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg') + tiled_page.MAPPED_EXTS
+
+# Documents kept open per process; opening only reads the cross-reference
+# table, never the whole file. Process pools pass close_documents as their
+# initializer: a forked worker must not share the parent's file offsets.
+OPEN_DOCUMENTS = 4
+
+_docs = OrderedDict()
+
+
+def _open(path):
+    # PyMuPDF is only needed when there are PDFs to read
+    import pymupdf
+    if path in _docs:
+        _docs.move_to_end(path)
+        return _docs[path]
+    doc = pymupdf.open(path)
+    _docs[path] = doc
+    if len(_docs) > OPEN_DOCUMENTS:
+        _docs.popitem(last=False)[1].close()
+    return doc
+
+
+def close_documents():
+    """Close the documents this process holds open."""
+    while _docs:
+        _docs.popitem()[1].close()
+
+
+def page_count(path):
+    # Listing a folder opens every PDF once; none of them is kept open
+    import pymupdf
+    if path in _docs:
+        return _docs[path].page_count
+    with pymupdf.open(path) as doc:
+        return doc.page_count
+
+
+def page_name(pdf_name, index):
+    """Output name of one PDF page, e.g. catalogue.pdf page 3 -> catalogue_p0003.png."""
+    return f"{os.path.splitext(pdf_name)[0]}_p{index + 1:04d}.png"
+
+
+def file_pages(path):
+    """Pages of one file as (name, path, page_index): one for an image, one per
+    page of a PDF (see page_name), none for other files."""
+    f = os.path.basename(path)
+    if f.lower().endswith(IMAGE_EXTS):
+        return [(f, path, None)]
+    if f.lower().endswith(PDF_EXTS):
+        try:
+            count = page_count(path)
+        except ImportError:
+            print(f"  [SKIP] {f}: install PyMuPDF (pip install pymupdf) to read PDFs")
+            return []
+        except Exception as e:
+            print(f"  [SKIP] {f}: {e}")
+            return []
+        return [(page_name(f, i), path, i) for i in range(count)]
+    return []
+
+
+def list_pages(folder):
+    """Every page in folder as (name, path, page_index). Images are one page with
+    index None; each page of a PDF gets its own name (see page_name)."""
+    pages = []
+    for f in sorted(os.listdir(folder)):
+        pages += file_pages(os.path.join(folder, f))
+    return pages
+
+
+def render_page(path, index, dpi=PDF_DPI):
+    """One PDF page as a BGR image."""
+    import pymupdf
+    page = _open(path).load_page(index)
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(dpi / 72, dpi / 72), colorspace=pymupdf.csRGB, alpha=False)
+    rows = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.stride)
+    rgb = rows[:, :pix.width * 3].reshape(pix.height, pix.width, 3)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+def read_page(path, index, dpi=PDF_DPI):
+    """The page image: a rendered PDF page, or the scan itself (see tiled_page.open_page)."""
+    if index is None:
+        return tiled_page.open_page(path)
+    return render_page(path, index, dpi)
+
+
+def thumbnail(path, index, long_side):
+    """A PDF page rendered straight at thumbnail size, for triage."""
+    rect = _open(path).load_page(index).rect
+    return render_page(path, index, 72 * long_side / max(rect.width, rect.height))
+
+
+def page_hash(file_hash, index, dpi=PDF_DPI):
+    """Cache key of one page: the file hash, plus page number and DPI for PDFs."""
+    if index is None:
+        return file_hash
+    return f"{file_hash}:p{index}@{dpi}"
@@ -0,0 +1,44 @@
+import cv2
+
+# Detector parameters (areas, cell sizes, margins) are tuned in pixels of a
+# page whose long side is REFERENCE_SIDE - the size of the bundled scans.
+REFERENCE_SIDE = 1792
+
+
+def downscale(img, long_side):
+    """Resize so the longer side is long_side (never upscales). Returns (image, scale)."""
+    height, width = img.shape[:2]
+    scale = min(1.0, long_side / max(height, width))
+    if scale == 1.0:
+        return img, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # INTER_AREA averages source pixels, which keeps edges clean when shrinking
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+
+def build_pyramid(img, long_side, levels=1, factor=0.5):
+    """Images for a coarse-to-coarser search, starting at long_side.
+    Returns a list of (image, scale) with scale relative to img."""
+    base, scale = downscale(img, long_side)
+    pyramid = [(base, scale)]
+    for _ in range(levels - 1):
+        prev, prev_scale = pyramid[-1]
+        if min(prev.shape[:2]) * factor < 32:
+            break
+        size = (round(prev.shape[1] * factor), round(prev.shape[0] * factor))
+        pyramid.append((cv2.resize(prev, size, interpolation=cv2.INTER_AREA), prev_scale * factor))
+    return pyramid
+
+
+def to_original(boxes, scale, width, height):
+    """Map (x, y, w, h) boxes found at `scale` back to full-resolution pixels."""
+    if scale == 1.0:
+        return list(boxes)
+    out = []
+    for (x, y, w, h) in boxes:
+        x0 = max(0, int(x / scale))
+        y0 = max(0, int(y / scale))
+        x1 = min(width, int(round((x + w) / scale)))
+        y1 = min(height, int(round((y + h) / scale)))
+        out.append((x0, y0, x1 - x0, y1 - y0))
+    return out
@@ -1,138 +1,780 @@
+import functools
 import os
+import threading
+import time
 import cv2
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from box_fusion import fuse_boxes
+import catalogue
+import crop_verifier
+from detection_cache import DetectionCache
+from grid_scorer import box_sum
+import instrumentation as metrics
+import layout_stage
+from manifest import ManifestWriter
+import page_dedup
+import page_store
+import page_triage
+import pdf_pages
+from pyramid import REFERENCE_SIDE, to_original
+from stream_pipeline import StageStats, run_pipeline, print_stage_report
+import tiled_page
+
+SCANS_FOLDER = "scans"
+DETECTOR = "scan_pipeline"
+
+# Detection parameters. The full set is part of the cache key, so changing
+# any of them re-runs detection on every page. Pixel sizes (areas, margin)
+# are for a page with a long side of REFERENCE_SIDE; detection itself runs
+# on a copy resized to detect_side, whatever the scan DPI.
+PARAMS = {
+    "detect_side": REFERENCE_SIDE,
+    "canny_low": 30,
+    "canny_high": 100,
+    "min_area": 8000,
+    "max_area": 200000,
+    "min_aspect": 0.4,
+    "max_aspect": 2.5,
+    "margin": 20,
+    "min_hue_std": 15,
+    "roi_canny_low": 50,
+    "roi_canny_high": 150,
+    "min_edge_density": 0.01,
+    "max_edge_density": 0.3,
+    # Boxes that overlap or whose edges are closer than this are fused
+    "merge_gap": 0,
+}
+
+# Number of worker processes for batch mode. Each one runs the streaming
+# pipeline (see run_batch) on its share of the pages; 1 runs a single
+# pipeline in this process.
+WORKERS = os.cpu_count() or 1
+
+# Working memory of the region filters per pixel (page copy, gray, blur,
+# edges, filled regions and their labels, hue, and three integral images),
+# used to size tiles when a page is searched at a resolution over the memory
+# budget (see tiled_page.py)
+TILE_BYTES_PER_PIXEL = 40
+
+# Check a thumbnail of each new page first and skip the detectors on
+# text-only pages (see page_triage.py). Off until a triage_model.json has been
+# calibrated on labelled pages: the built-in cut is only fitted to the bundled
+# scans. Check its recall with benchmark.py before switching it on.
+TRIAGE = False
+
+# Reuse the boxes of an earlier page when a new page is a near-duplicate of
+# it (the same scan at another DPI, or cropped slightly), see page_dedup.py
+DEDUP = True
+
+# Decode each page once into page_store/ and take its gray, blur, HSV and
+# edge maps from there, here and in every later run or script that reads the
+# same page (see page_store.py). Off unless ART_STORE is set: a stored page
+# takes several times the disk space of its scan.
+STORE = page_store.ENABLED
+
+# Optional second stage: score every box with the trained classifier and drop
+# the ones below VERIFY_THRESHOLD before writing. Set to crop_verifier.CLASSIFIER_PATH
+# or to a quantized export such as crop_verifier.QUANTIZED_PATH.
+VERIFY_MODEL = None
+VERIFY_THRESHOLD = crop_verifier.THRESHOLD
+
+# Propose regions with the LayoutParser model (its "Figure" blocks, see
+# layout_stage.py) instead of the contour filters. When layoutparser is not
+# installed the contour filters are used as before.
+LAYOUT = False
+
+# "files" writes crops and annotated pages as pages finish. "manifest" only
+# writes a JSON-lines manifest of the boxes (see manifest.py); crops are then
+# exported from it when needed with: python manifest.py export
+OUTPUT = "files"
+
+
+def find_artwork_boxes(img, params=PARAMS, derived=None):
+    """Run the edge/region filters on one page and return (x, y, w, h) boxes.
+    derived is an optional page_store.StoredLevel of img to take maps from."""
+    gray, regions = candidate_regions(img, params, derived)
+
+    # Step 3: Filter all candidates at once
+    with metrics.stage("filter"):
+        artwork_boxes, passed = filter_regions(img, gray, regions, params, derived)
+
+    # Candidates left after each filter step, to see which one rejects the most
+    metrics.count("regions", len(regions))
+    for step, n in passed.items():
+        metrics.count(step, n)
+
+    return artwork_boxes
+
+
+def candidate_regions(img, params=PARAMS, derived=None):
+    """The gray page and its unfiltered candidate regions (see edge_regions)."""
+    if derived is not None:
+        # Maps computed once per page by page_store.py
+        with metrics.stage("store"):
+            gray = derived.gray()
+            edges = derived.canny(params["canny_low"], params["canny_high"])
+        with metrics.stage("components"):
+            return gray, edge_regions(edges)
 
-print("=" * 50)
-print("IMPROVED ARTWORK DETECTION PIPELINE")
-print("=" * 50)
-
-# Check scans folder
-if not os.path.exists("scans"):
-    print("ERROR: No 'scans' folder")
-    exit()
-
-# List files
-files = [f for f in os.listdir("scans") if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-print(f"Found {len(files)} scan files")
-
-# Clean output folders
-for folder in ["detected_pages", "cropped_artworks"]:
-    if os.path.exists(folder):
-        # Remove old files
-        for f in os.listdir(folder):
-            os.remove(os.path.join(folder, f))
-    else:
-        os.makedirs(folder)
-
-# Process each file
-total_artworks = 0
-
-for file_name in files:
-    print(f"\nProcessing: {file_name}")
-    
-    # Load image
-    img = cv2.imread(os.path.join("scans", file_name))
-    if img is None:
-        print("  ERROR: Could not read file")
-        continue
-    
-    height, width = img.shape[:2]
-    print(f"  Size: {width}x{height}")
-    
     # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
+    with metrics.stage("color"):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
     # METHOD 1: Look for areas with paintings (usually have frames/borders)
     # Paintings typically have: dark borders, good contrast, rectangular shape
-    
+
     # Step 1: Detect edges
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blur, 30, 100)
-    
-    # Step 2: Find contours
-    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # Step 3: Filter contours
-    artwork_boxes = []
-    
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        
-        # Filter by size (artworks aren't tiny or huge)
-        if area < 8000 or area > 200000:
-            continue
-        
-        # Get bounding box
-        x, y, w, h = cv2.boundingRect(cnt)
-        
-        # Filter by aspect ratio (artworks are usually reasonable proportions)
-        aspect = w / h
-        if aspect < 0.4 or aspect > 2.5:
+    with metrics.stage("blur"):
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    with metrics.stage("canny"):
+        edges = cv2.Canny(blur, params["canny_low"], params["canny_high"])
+
+    # Step 2: Find candidate regions
+    with metrics.stage("components"):
+        return gray, edge_regions(edges)
+
+
+def edge_regions(edges):
+    """Outer edge outlines with everything they enclose, as rows of
+    (x, y, w, h, area): the regions findContours(RETR_EXTERNAL) would trace,
+    from one flood fill and one connected-components pass. area is what
+    cv2.contourArea gives for the outline, which the size limits are set for."""
+    height, width = edges.shape
+    # Background reachable from outside the page; what is left is edges and
+    # the holes they close, so nested outlines join the one around them
+    outside = np.zeros((height + 2, width + 2), np.uint8)
+    outside[1:-1, 1:-1] = edges
+    cv2.floodFill(outside, None, (0, 0), 128)
+    filled = cv2.compare(outside[1:-1, 1:-1], 128, cv2.CMP_NE)
+    try:
+        # 16-bit labels are about twice as fast, and enough for most pages
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(filled, connectivity=8, ltype=cv2.CV_16U)
+    except cv2.error:
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(filled, connectivity=8, ltype=cv2.CV_32S)
+    # The outline runs through the centres of the boundary pixels, so it
+    # encloses half of each less than the pixel count (Pick's theorem)
+    inner = cv2.erode(filled, cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3)),
+                      borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    boundary = np.bincount(labels[cv2.compare(filled, inner, cv2.CMP_GT) > 0], minlength=count)
+    # Row 0 is the background
+    regions = stats[1:].astype(np.int64)
+    regions[:, 4] -= boundary[1:] // 2 + 1
+    return regions
+
+
+def region_features(img, gray, regions, params=PARAMS, derived=None):
+    """Hue spread and edge density of every region, from integral images over
+    the area the regions span, so there is no conversion per region (nor any
+    conversion at all with the stored maps of derived)."""
+    x, y, w, h = regions[:, 0], regions[:, 1], regions[:, 2], regions[:, 3]
+    n = w * h
+    if not len(regions):
+        return {"hue_std": np.empty(0), "edge_density": np.empty(0)}
+
+    x0, y0 = int(x.min()), int(y.min())
+    x1, y1 = int((x + w).max()), int((y + h).max())
+    img, gray = img[y0:y1, x0:x1], gray[y0:y1, x0:x1]
+    x, y = x - x0, y - y0
+
+    # Standard deviation of the hue, from sums of hue and hue squared
+    if derived is not None:
+        hue = np.ascontiguousarray(derived.hsv()[y0:y1, x0:x1, 0])
+    else:
+        hue = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[:, :, 0]
+    hue_sum, hue_sq = cv2.integral2(hue, sdepth=cv2.CV_32S, sqdepth=cv2.CV_64F)
+    mean = box_sum(hue_sum, x, y, w, h) / n
+    hue_std = np.sqrt(np.maximum(box_sum(hue_sq, x, y, w, h) / n - mean * mean, 0))
+
+    # The finer edge map is taken once for all regions
+    if derived is not None:
+        roi_edges = derived.canny(params["roi_canny_low"], params["roi_canny_high"], "gray")[y0:y1, x0:x1]
+    else:
+        roi_edges = cv2.Canny(gray, params["roi_canny_low"], params["roi_canny_high"])
+    edge_count = cv2.integral(cv2.threshold(roi_edges, 0, 1, cv2.THRESH_BINARY)[1])
+    return {"hue_std": hue_std, "edge_density": box_sum(edge_count, x, y, w, h) / n}
+
+
+def filter_regions(img, gray, regions, params, derived=None):
+    """Apply the size, shape, position and content filters to every region at
+    once. Returns the boxes and how many candidates passed each step."""
+    height, width = img.shape[:2]
+    x, y, w, h, area = regions.T
+    passed = {}
+
+    # Filter by size (artworks aren't tiny or huge)
+    keep = (area >= params["min_area"]) & (area <= params["max_area"])
+    passed["area"] = int(keep.sum())
+
+    # Filter by aspect ratio (artworks are usually reasonable proportions)
+    aspect = w / np.maximum(h, 1)
+    keep &= (aspect >= params["min_aspect"]) & (aspect <= params["max_aspect"])
+    passed["aspect"] = int(keep.sum())
+
+    # Filter by position (artworks usually not at very edges)
+    margin = params["margin"]
+    keep &= (x >= margin) & (y >= margin) & (x + w <= width - margin) & (y + h <= height - margin)
+    passed["margin"] = int(keep.sum())
+
+    passed["hue_variance"] = passed["edge_density"] = 0
+    if not keep.any():
+        return [], passed
+
+    # Content of the regions left
+    regions = regions[keep]
+    features = region_features(img, gray, regions, params, derived)
+
+    # 1. Check color variance (artworks have more colors than UI buttons)
+    # 2. Low color variance = likely UI button (Google Translate buttons are usually solid colors)
+    keep = features["hue_std"] >= params["min_hue_std"]
+    passed["hue_variance"] = int(keep.sum())
+
+    # 3. Check if region has frame-like edges (artworks often have borders)
+    # Artworks have moderate edge density, UI buttons have very high or very low
+    edge_density = features["edge_density"]
+    keep &= (edge_density >= params["min_edge_density"]) & (edge_density <= params["max_edge_density"])
+    passed["edge_density"] = int(keep.sum())
+
+    # Passed all filters - likely artwork
+    return [tuple(b) for b in regions[keep, :4].tolist()], passed
+
+
+def scale_params(params, k):
+    """Params for an image k times the reference size (areas scale with k squared)."""
+    scaled = dict(params)
+    scaled["min_area"] = params["min_area"] * k * k
+    scaled["max_area"] = params["max_area"] * k * k
+    scaled["margin"] = params["margin"] * k
+    return scaled
+
+
+def detect_boxes(img, params=PARAMS, stored=None):
+    """Search a downscaled copy of the page and return boxes in full-resolution pixels.
+    img may be an array or a tiled_page.MappedPage. With stored (the
+    page_store.StoredPage of img), the copy and its maps come from the store."""
+    height, width = img.shape[:2]
+    level = None
+    with metrics.stage("resize"):
+        if stored is not None:
+            level = stored.level(params["detect_side"])
+            small, scale = level.image(), level.scale
+        else:
+            small, scale = tiled_page.downscale(img, params["detect_side"])
+    k = max(small.shape[:2]) / REFERENCE_SIDE
+    scaled = scale_params(params, k)
+
+    # Tiles overlap by the largest box the filters accept plus both margins
+    longest = np.sqrt(scaled["max_area"] * max(scaled["max_aspect"], 1 / scaled["min_aspect"]))
+    overlap = int(longest + 2 * scaled["margin"]) + 2
+
+    def detect(tile):
+        # Stored maps cover the whole level, so they are only used when it is not tiled
+        return find_artwork_boxes(tile, scaled, level if tile is small else None)
+
+    boxes = tiled_page.detect_tiled(small, detect, TILE_BYTES_PER_PIXEL, overlap)
+    boxes = to_original(boxes, scale, width, height)
+
+    # Contour regions that overlap (or are split by tile seams) are one object: fuse them
+    with metrics.stage("fuse"):
+        return fuse_boxes(boxes, params["merge_gap"] * max(height, width) / REFERENCE_SIDE)
+
+
+def crop_path(file_name, i):
+    return os.path.join("cropped_artworks", f"{file_name[:-4]}_artwork_{i+1}.jpg")
+
+
+def outputs_exist(file_name, boxes):
+    """True if every output a page with these boxes should have is already on disk."""
+    if boxes and not os.path.exists(overlay_path(file_name)):
+        return False
+    return all(os.path.exists(crop_path(file_name, i)) for i in range(len(boxes)))
+
+
+def remove_stale_crops(file_name, start):
+    """Delete crops left over from an earlier run that found more boxes on this page."""
+    i = start
+    while os.path.exists(crop_path(file_name, i)):
+        os.remove(crop_path(file_name, i))
+        i += 1
+
+
+def use_layout():
+    return LAYOUT and layout_stage.available()
+
+
+# Per-thread connections for find_duplicate, in workers and pipeline stages
+_lookup = threading.local()
+
+
+def find_duplicate(value, file_hash):
+    """A processed near-duplicate of a page with perceptual hash value, as
+    (page hash, boxes, scores, size), or None. Pages finished earlier in the
+    same run count too: process_pages commits each one as it comes back."""
+    if not hasattr(_lookup, "dedup"):
+        _lookup.dedup = page_dedup.DuplicateIndex()
+        _lookup.cache = DetectionCache()
+        _lookup.params = cache_params()
+    _lookup.dedup.refresh()
+    for _, other, size in _lookup.dedup.lookup(value):
+        if other == file_hash:
             continue
-        
-        # Filter by position (artworks usually not at very edges)
-        margin = 20
-        if x < margin or y < margin or (x + w) > (width - margin) or (y + h) > (height - margin):
+        # Read only: this connection never commits
+        hit = _lookup.cache.get(other, DETECTOR, _lookup.params, with_scores=True, touch=False)
+        # Boxes can only be moved onto this page if the original size is known
+        if hit is not None and (size or not hit[0]):
+            return other, hit[0], hit[1], size
+    return None
+
+
+def decode_page(task):
+    """Stage 1: read the page. task is (file_name, cached_boxes_or_None, (path, pdf_page),
+    page_hash), with pdf_page None for image files. With DEDUP, a new page that
+    is a near-duplicate of a processed one takes its boxes (see find_duplicate)."""
+    file_name, boxes, (path, index), file_hash = task
+    page = {"file_name": file_name, "hash": file_hash, "img": None, "boxes": boxes,
+            "cached": boxes is not None, "triaged": False, "size": None, "log": [], "crops": [], "stored": None,
+            "duplicate": False, "phash": None, "error": None}
+
+    # Text-only pages never get fully decoded or reach the detectors
+    if TRIAGE and not page["cached"]:
+        with metrics.stage("triage"):
+            result = page_triage.load().check_page(path, index)
+        if result is not None and not result[0]:
+            page["boxes"] = []
+            page["triaged"] = True
+            page["log"].append(f"  Triage: text page (score {result[1]:.2f}), skipped")
+            return page
+
+    # Load image (large PPM scans are memory-mapped, PDF pages rendered now,
+    # pages seen before mapped from the page store)
+    with metrics.stage("imread"):
+        if STORE:
+            page["stored"] = page_store.load().page(path, index, file_hash)
+            page["img"] = page["stored"].image() if page["stored"] else None
+        else:
+            page["img"] = pdf_pages.read_page(path, index)
+    if page["img"] is None:
+        page["error"] = "Could not read file"
+        return page
+
+    height, width = page["img"].shape[:2]
+    page["size"] = (width, height)
+    page["log"].append(f"  Size: {width}x{height}")
+
+    # Near-duplicates take the original's results instead of being searched
+    if DEDUP and not page["cached"]:
+        with metrics.stage("dedup"):
+            page["phash"] = page_dedup.image_phash(page["img"])
+            duplicate = find_duplicate(page["phash"], file_hash)
+        if duplicate:
+            other, boxes, page["scores"], size = duplicate
+            page["boxes"] = page_dedup.rescale_boxes(boxes, size, page["size"]) if boxes else []
+            page["cached"] = page["duplicate"] = True
+            page["log"].append(f"  Duplicate of page {other[:12]}: {len(boxes)} artwork regions")
+    return page
+
+
+def detect_page(page):
+    """Stage 2: find artwork boxes, unless they came from the cache or triage.
+    With the layout model, detect_batch takes its place (see pipeline_stages)."""
+    if page["cached"]:
+        if not page["duplicate"]:
+            page["log"].append(f"  Cached: {len(page['boxes'])} artwork regions")
+    elif not page["triaged"]:
+        # Search at reduced resolution; crops still come from the full page
+        page["boxes"] = detect_boxes(page["img"], stored=page["stored"])
+        page["log"].append(f"  Found {len(page['boxes'])} potential artwork regions")
+    return page
+
+
+def _run_batch(name, func, todo):
+    """Run func on the pages of one batched stage. A failure marks every page
+    of the batch; the batch time is shared between its pages."""
+    start = time.perf_counter()
+    try:
+        func(todo)
+    except Exception as e:
+        for page in todo:
+            page["error"] = f"{type(e).__name__}: {e}"
+            page["img"] = None
+    elapsed = time.perf_counter() - start
+    for page in todo:
+        page["timings"][name] = elapsed / len(todo)
+        if page["metrics"] is not None:
+            page["metrics"]["timings"][name] = elapsed / len(todo)
+
+
+def detect_batch(pages, threads=layout_stage.THREADS):
+    """Batched detect stage for the streaming pipeline when the layout model is
+    in use: several pages go through the model in one call."""
+    for page in pages:
+        if not page["error"] and page["cached"] and not page["duplicate"]:
+            page["log"].append(f"  Cached: {len(page['boxes'])} artwork regions")
+    todo = [p for p in pages if not p["error"] and not p["cached"] and not p["triaged"]]
+    _run_batch("detect", lambda batch: layout_stage.detect_pages(batch, threads), todo)
+    for page in todo:
+        if not page["error"]:
+            page["log"].append(f"  Layout: {len(page['boxes'])} figure regions")
+    return pages
+
+
+def verify_page(page):
+    """Stage 3: drop boxes the classifier rejects (only when VERIFY_MODEL is set)."""
+    if VERIFY_MODEL and not page["cached"] and page["boxes"]:
+        found = len(page["boxes"])
+        with metrics.stage("verify"):
+            crop_verifier.verify_pages([page], crop_verifier.load(VERIFY_MODEL), VERIFY_THRESHOLD)
+        page["log"].append(f"  Verified: {len(page['boxes'])} of {found} kept")
+    return page
+
+
+def verify_batch(pages):
+    """Batched verify stage for the streaming pipeline: the crops of several
+    pages go through the classifier together."""
+    todo = [p for p in pages if not p["error"] and not p["cached"] and p["boxes"]]
+    found = [len(p["boxes"]) for p in todo]
+    _run_batch("verify", lambda batch: crop_verifier.verify_pages(
+        batch, crop_verifier.load(VERIFY_MODEL), VERIFY_THRESHOLD), todo)
+    for page, n in zip(todo, found):
+        if not page["error"]:
+            page["log"].append(f"  Verified: {len(page['boxes'])} of {n} kept")
+    return pages
+
+
+def overlay_path(file_name):
+    return os.path.join("detected_pages", f"detected_{file_name}")
+
+
+def write_outputs(file_name, img, boxes, scores=None, overlay=True):
+    """Write the crops of one page, then the page with its boxes drawn (img is
+    drawn on in place). Used by the write stage and by manifest export.
+    Returns the crop paths."""
+    scores = scores or [None] * len(boxes)
+    remove_stale_crops(file_name, len(boxes))
+    crops = []
+    # Crop and save artworks first: the page is annotated in place afterwards
+    for i, (x, y, w, h) in enumerate(boxes):
+        artwork = img[y:y+h, x:x+w]
+        path = crop_path(file_name, i)
+        with metrics.stage("crop_writes"):
+            tiled_page.write_image(path, artwork)
+        metrics.wrote(path)
+        crops.append(path)
+
+    # Draw and save detection result
+    if overlay:
+        labels = ["Artwork" if score is None else f"Artwork {score:.2f}" for score in scores]
+        tiled_page.write_annotated(overlay_path(file_name), img, boxes, labels)
+        metrics.wrote(overlay_path(file_name))
+    return crops
+
+
+def write_page(page):
+    """Stage 4: write the crops, then the annotated page. In manifest mode
+    nothing is written here; main records the boxes in the run manifest."""
+    file_name = page["file_name"]
+    artwork_boxes = page["boxes"]
+    log = page["log"]
+
+    if OUTPUT == "manifest":
+        return page
+
+    det_path = overlay_path(file_name)
+    if artwork_boxes:
+        page["crops"] = write_outputs(file_name, page["img"], artwork_boxes, page.get("scores"))
+        log.append(f"  Saved detection: {det_path}")
+        for path in page["crops"]:
+            log.append(f"  Cropped artwork: {path}")
+    else:
+        remove_stale_crops(file_name, 0)
+        if os.path.exists(det_path):
+            os.remove(det_path)
+        log.append(f"  No artworks detected")
+
+    return page
+
+
+STAGES = [("decode", decode_page), ("detect", detect_page), ("verify", verify_page),
+          ("write", write_page)]
+
+
+def guarded(name, func):
+    """Wrap a stage so a failing page is marked with its error instead of raising,
+    and later stages pass it through untouched. Stage time goes into page['timings'],
+    and finer timings and counters into page['metrics'] when instrumentation is on."""
+    def run(page):
+        if isinstance(page, dict) and page["error"]:
+            return page
+        if isinstance(page, dict):
+            record = page["metrics"]
+        else:
+            record = metrics.new_page(page[0], DETECTOR)
+        start = time.perf_counter()
+        try:
+            with metrics.recording(record):
+                page = func(page)
+        except Exception as e:
+            if not isinstance(page, dict):
+                file_name = page[0]
+                page = {"file_name": file_name, "boxes": [], "log": [], "crops": []}
+            page["error"] = f"{type(e).__name__}: {e}"
+        page["metrics"] = record
+        page.setdefault("timings", {})[name] = time.perf_counter() - start
+        if name == STAGES[-1][0] or page["error"]:
+            # Done with the pixels; don't carry the full page any further
+            page["img"] = None
+            page["stored"] = None
+        return page
+    return run
+
+
+def pipeline_stages(workers=1):
+    """STAGES for run_pipeline, with batched layout detection and verification
+    when those are on. workers is the number of pipelines running side by
+    side, which share the CPU threads between their layout models."""
+    stages = [(name, guarded(name, func)) for name, func in STAGES]
+    if use_layout():
+        # One layout model call for several pages
+        detect = functools.partial(detect_batch, threads=max(1, layout_stage.THREADS // workers))
+        stages[1] = ("detect", detect, layout_stage.BATCH_SIZE)
+    if VERIFY_MODEL:
+        # One classifier call for the crops of several pages
+        stages[2] = ("verify", verify_batch, crop_verifier.PAGES_PER_BATCH)
+    return stages
+
+
+def process_chunk(tasks, workers):
+    """Run several pages through the streaming pipeline in one pool worker."""
+    return list(run_pipeline(tasks, pipeline_stages(workers)))
+
+
+def lost_page(task):
+    """Result of a page whose worker process died on it (killed by the OS, e.g.
+    out of memory on a huge scan), so no stage could catch the error."""
+    return {"file_name": task[0], "boxes": [], "log": [], "crops": [], "timings": {},
+            "metrics": metrics.new_page(task[0], DETECTOR), "error": "Worker process died on this page"}
+
+
+def pool_pages(tasks, workers, chunksize, alone=False):
+    """Run tasks on a process pool in chunks and yield the pages in input order.
+    A worker that dies breaks the whole pool: the pages it took down are run
+    again one per task on a new pool, and then alone (one worker, in order),
+    where the first page lost is the one that killed it and is marked failed."""
+    chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+    results = []
+    lost = []
+    with ProcessPoolExecutor(max_workers=1 if alone else workers, initializer=pdf_pages.close_documents) as pool:
+        futures = [pool.submit(process_chunk, chunk, workers) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                pages = future.result()
+            except BrokenProcessPool:
+                pages = None
+                lost += chunk
+            # Stream until the first lost chunk; past it, keep the order
+            if lost:
+                results.append((chunk, pages))
+            else:
+                yield from pages
+    if not lost:
+        return
+
+    failed = {}
+    if alone:
+        failed[lost[0][0]] = lost_page(lost[0])
+        retry = pool_pages(lost[1:], workers, 1)
+    else:
+        retry = pool_pages(lost, workers, 1, alone=chunksize == 1)
+    for chunk, pages in results:
+        if pages is not None:
+            yield from pages
             continue
-        
-        # Check the region content
-        roi = img[y:y+h, x:x+w]
-        
-        # 1. Check color variance (artworks have more colors than UI buttons)
-        roi_hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-        color_variance = np.std(roi_hsv[:,:,0])  # Hue variance
-        
-        # 2. Check if it looks like UI element (Google Translate buttons are usually solid colors)
-        if color_variance < 15:  # Low color variance = likely UI button
+        for task in chunk:
+            yield failed.pop(task[0]) if task[0] in failed else next(retry)
+
+
+def run_batch(tasks, workers=WORKERS, stats=None):
+    """Process decode_page tasks and yield page results in input order.
+    Decode, detect, verify and write run as a streaming pipeline, so writing
+    one page overlaps detection of the next and verification scores several
+    pages per batch. With more than one worker, the pages are split into
+    chunks over a process pool and each worker streams its chunks through its
+    own pipeline, with its own copy of the verifier and its own PDF handles.
+    Pages only come back a chunk at a time then, and a worker process dying
+    only fails its own page (see pool_pages). Per-stage StageStats are
+    appended to stats."""
+    if stats is None:
+        stats = []
+
+    if workers <= 1:
+        yield from run_pipeline(tasks, pipeline_stages(), stats)
+        return
+
+    stats.extend(StageStats(name) for name, _ in STAGES)
+    # chunksize keeps task overhead low on batches of thousands of pages
+    chunksize = max(1, len(tasks) // (workers * 8))
+    for page in pool_pages(tasks, workers, chunksize):
+        for st in stats:
+            if st.name in page.get("timings", {}):
+                st.add(page["timings"][st.name])
+        yield page
+
+
+def cache_params():
+    """Detection parameters (or layout model settings) plus the triage and
+    verifier settings that are on."""
+    params = layout_stage.settings() if use_layout() else dict(PARAMS)
+    if TRIAGE:
+        params.update(page_triage.load().settings())
+    if VERIFY_MODEL:
+        params.update(crop_verifier.cache_settings(VERIFY_MODEL, VERIFY_THRESHOLD))
+    return params
+
+
+def process_pages(pages, manifest=None):
+    """Detect artwork on pages given as (name, path, pdf_page), skipping the
+    ones already done, and record the results (cache, catalogue, and the
+    manifest in manifest mode). Used by main and by watch_folder.py for the
+    pages of new files. Returns the artworks found, failed page names and
+    the number of pages taken from the cache."""
+    # Output folders are kept between runs; only new or changed pages are redone
+    if OUTPUT == "files":
+        for folder in ["detected_pages", "cropped_artworks"]:
+            os.makedirs(folder, exist_ok=True)
+
+    # Look up every page in the detection cache first
+    cache = DetectionCache()
+    dedup = page_dedup.DuplicateIndex() if DEDUP else None
+    params = cache_params()
+    if manifest is None and OUTPUT == "manifest":
+        manifest = ManifestWriter(DETECTOR, params)
+    tasks = []
+    sources = {}
+    # Page results for the catalogue, upserted in one go at the end
+    records = []
+    total_artworks = 0
+    reused = 0
+    duplicates = 0
+
+    for file_name, path, index in pages:
+        file_hash = pdf_pages.page_hash(cache.file_hash(path), index)
+        sources[file_name] = (path, index, file_hash)
+        boxes, scores = cache.get(file_hash, DETECTOR, params, with_scores=True) or (None, None)
+        # A manifest only needs the boxes; files mode also needs the outputs on disk
+        if boxes is not None and (manifest or outputs_exist(file_name, boxes)):
+            if manifest:
+                manifest.write(file_name, path, index, file_hash, boxes, scores, cached=True)
+            crops = [crop_path(file_name, i) for i in range(len(boxes))] \
+                if outputs_exist(file_name, boxes) else None
+            records.append(catalogue.page_record(file_name, path, index, file_hash, boxes, scores, crops=crops))
+            total_artworks += len(boxes)
+            reused += 1
             continue
-        
-        # 3. Check if region has frame-like edges (artworks often have borders)
-        roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        roi_edges = cv2.Canny(roi_gray, 50, 150)
-        edge_density = np.sum(roi_edges > 0) / (w * h)
-        
-        # Artworks have moderate edge density, UI buttons have very high or very low
-        if edge_density < 0.01 or edge_density > 0.3:
+        tasks.append((file_name, boxes, (path, index), file_hash))
+
+    cache.commit()
+    print(f"Up to date (cached): {reused} pages, to process: {len(tasks)} pages")
+
+    # Process each file
+    failed = []
+    stats = []
+    sink = metrics.MetricsSink()
+    start = time.perf_counter()
+
+    for result in run_batch(tasks, stats=stats):
+        sink.write(result["metrics"])
+        print(f"\nProcessing: {result['file_name']}")
+        for line in result["log"]:
+            print(line)
+        if result["error"]:
+            print(f"  ERROR: {result['error']}")
+            failed.append(result["file_name"])
             continue
-        
-        # Passed all filters - likely artwork
-        artwork_boxes.append((x, y, w, h))
-    
-    print(f"  Found {len(artwork_boxes)} potential artwork regions")
-    
-    # Draw and save results
-    if artwork_boxes:
-        img_with_boxes = img.copy()
-        for (x, y, w, h) in artwork_boxes:
-            cv2.rectangle(img_with_boxes, (x, y), (x+w, y+h), (0, 255, 0), 3)
-            # Label
-            cv2.putText(img_with_boxes, f"Artwork", (x, y-10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        # Save detection result
-        det_path = os.path.join("detected_pages", f"detected_{file_name}")
-        cv2.imwrite(det_path, img_with_boxes)
-        print(f"  Saved detection: {det_path}")
-        
-        # Crop and save artworks
-        for i, (x, y, w, h) in enumerate(artwork_boxes):
-            artwork = img[y:y+h, x:x+w]
-            crop_path = os.path.join("cropped_artworks", f"{file_name[:-4]}_artwork_{i+1}.jpg")
-            cv2.imwrite(crop_path, artwork)
-            print(f"  Cropped artwork: {crop_path}")
-            total_artworks += 1
-    else:
-        print(f"  No artworks detected")
-
-print("\n" + "=" * 50)
-print("SUMMARY:")
-print(f"Total artworks extracted: {total_artworks}")
-print(f"Detection results: 'detected_pages/' folder")
-print(f"Cropped artworks: 'cropped_artworks/' folder")
-print("=" * 50)
-
-# Show what we extracted
-if total_artworks > 0:
-    print("\nExtracted artwork files:")
-    for f in os.listdir("cropped_artworks"):
-        print(f"  - {f}")
\ No newline at end of file
+        path, index, file_hash = sources[result["file_name"]]
+        if not result["cached"] or result["duplicate"]:
+            cache.put(file_hash, DETECTOR, params, result["boxes"], result.get("scores"))
+        if dedup is not None and result["phash"] is not None:
+            # Committed right away, so pages still to come can reuse this one
+            dedup.add(file_hash, result["phash"], result["size"])
+            dedup.commit()
+            duplicates += result["duplicate"]
+        if manifest:
+            manifest.write(result["file_name"], path, index, file_hash, result["boxes"],
+                           result.get("scores"), result["size"], result["cached"])
+            total_artworks += len(result["boxes"])
+        else:
+            total_artworks += len(result["crops"])
+        records.append(catalogue.page_record(result["file_name"], path, index, file_hash, result["boxes"],
+                                             result.get("scores"), result["size"], result["crops"]))
+
+    cache.close()
+    if dedup is not None:
+        print(f"\nNear-duplicates of processed pages: {duplicates} ({len(dedup)} pages indexed)")
+        dedup.close()
+    if STORE:
+        page_store.load().prune()
+    db = catalogue.Catalogue()
+    db.upsert_pages(DETECTOR, params, records)
+    db.close()
+    sink.close()
+    print_stage_report(stats, time.perf_counter() - start)
+    if metrics.ENABLED:
+        print(f"Metrics: {metrics.METRICS_PATH}")
+    return {"artworks": total_artworks, "failed": failed, "reused": reused, "manifest": manifest}
+
+
+def main():
+    print("=" * 50)
+    print("IMPROVED ARTWORK DETECTION PIPELINE")
+    print("=" * 50)
+
+    # Check scans folder
+    if not os.path.exists(SCANS_FOLDER):
+        print("ERROR: No 'scans' folder")
+        exit()
+
+    # List pages: image files, and every page of each PDF
+    pages = pdf_pages.list_pages(SCANS_FOLDER)
+    print(f"Found {len(pages)} scan pages")
+    print(f"Workers: {WORKERS}")
+    if VERIFY_MODEL:
+        print(f"Verifier: {VERIFY_MODEL} (threshold {VERIFY_THRESHOLD})")
+    if use_layout():
+        print(f"Proposals: LayoutParser figures ({layout_stage.THREADS} threads)")
+    elif LAYOUT:
+        print("Proposals: contour filters (layoutparser is not installed)")
+
+    result = process_pages(pages)
+    total_artworks, failed, manifest = result["artworks"], result["failed"], result["manifest"]
+    if manifest:
+        manifest.close()
+
+    print("\n" + "=" * 50)
+    print("SUMMARY:")
+    if manifest:
+        print(f"Total artworks found: {total_artworks}")
+        if failed:
+            print(f"Failed pages: {len(failed)}")
+        print(f"Manifest: {manifest.path} ({os.path.getsize(manifest.path) / 1024:.1f} KB)")
+        print(f"Write crops from it with: python manifest.py export {manifest.path}")
+        print("=" * 50)
+        return
+
+    print(f"Total artworks extracted: {total_artworks}")
+    if failed:
+        print(f"Failed pages: {len(failed)}")
+    print(f"Detection results: 'detected_pages/' folder")
+    print(f"Cropped artworks: 'cropped_artworks/' folder")
+    print("=" * 50)
+
+    # Show what we extracted
+    if total_artworks > 0:
+        print("\nExtracted artwork files:")
+        for f in os.listdir("cropped_artworks"):
+            print(f"  - {f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,81 +2,115 @@ import os
 import cv2
 import numpy as np
 
-print("=" * 50)
-print("ART COLLECTION - SIMPLE PIPELINE")
-print("=" * 50)
-
-# Check scans folder
-scans_folder = "scans"
-if not os.path.exists(scans_folder):
-    print("[ERROR] 'scans' folder not found!")
-    exit()
-
-files = os.listdir(scans_folder)
-if not files:
-    print("[ERROR] No files in 'scans' folder!")
-    exit()
-
-print(f"Found {len(files)} file(s) in 'scans' folder:")
-
-# Create output folders
-for folder in ["pages", "extracted_artworks", "detection_results"]:
-    os.makedirs(folder, exist_ok=True)
-
-# Process first file only (for testing)
-test_file = files[0]
-print(f"\nTesting with: {test_file}")
-
-file_path = os.path.join(scans_folder, test_file)
-
-# Check if it's an image
-if test_file.lower().endswith(('.jpg', '.jpeg', '.png')):
-    img = cv2.imread(file_path)
-    if img is not None:
-        print(f"Image loaded: {img.shape[1]}x{img.shape[0]} pixels")
-        
+import page_store
+import pdf_pages
+import tiled_page
+
+
+def find_regions(img, derived=None):
+    """Simple detection: bounding boxes of high-contrast contours of a reasonable size.
+    derived is an optional page_store.StoredLevel of img with the edge map."""
+    if derived is not None:
+        edges = derived.canny(30, 100)
+    else:
         # Simple detection: find dark/contrasty regions
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
+
         # Method: find areas with high contrast
         blur = cv2.GaussianBlur(gray, (5, 5), 0)
         edges = cv2.Canny(blur, 30, 100)
-        
-        # Find contours
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        regions = []
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if 3000 < area < 100000:  # Reasonable artwork size
-                x, y, w, h = cv2.boundingRect(cnt)
-                regions.append((x, y, w, h))
-        
-        print(f"Found {len(regions)} potential artwork regions")
-        
-        # Draw and save
-        img_detected = img.copy()
-        for (x, y, w, h) in regions:
-            cv2.rectangle(img_detected, (x, y), (x+w, y+h), (0, 255, 0), 2)
-        
-        # Save results
-        det_path = f"detection_results/detection_{test_file}"
-        cv2.imwrite(det_path, img_detected)
-        print(f"Detection saved: {det_path}")
-        
-        # Extract artworks
-        for i, (x, y, w, h) in enumerate(regions):
-            artwork = img[y:y+h, x:x+w]
-            art_path = f"extracted_artworks/artwork_{i+1}.jpg"
-            cv2.imwrite(art_path, artwork)
-        
-        print(f"Extracted {len(regions)} artworks to 'extracted_artworks/'")
-        
-    else:
+
+    # Find contours
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    regions = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if 3000 < area < 100000:  # Reasonable artwork size
+            x, y, w, h = cv2.boundingRect(cnt)
+            regions.append((x, y, w, h))
+    return regions
+
+
+def artwork_path(file_name, i):
+    return f"extracted_artworks/{os.path.splitext(file_name)[0]}_artwork_{i+1}.jpg"
+
+
+def detection_path(file_name):
+    return f"detection_results/detection_{file_name}"
+
+
+def process_page(file_name, path, index=None):
+    """Detect, draw and crop one page. Outputs are named after the page and
+    replaced atomically; crops of an earlier run on the same page that found
+    more regions are removed. Returns the number of regions, None if unreadable."""
+    # With ART_STORE set, later runs map the page and its edge map from page_store/
+    stored = page_store.load().page(path, index)
+    if stored is None:
         print("[ERROR] Could not read image file!")
-else:
-    print(f"[SKIP] {test_file} is not a supported image format")
-    print("Supported: .jpg, .jpeg, .png")
+        return None
+    # The simple pipeline reads mapped PPM scans in full
+    img = stored.image()[:]
+    print(f"Image loaded: {img.shape[1]}x{img.shape[0]} pixels")
+
+    regions = find_regions(img, stored.level())
+    print(f"Found {len(regions)} potential artwork regions")
+
+    # Extract artworks
+    for i, (x, y, w, h) in enumerate(regions):
+        tiled_page.write_image(artwork_path(file_name, i), img[y:y+h, x:x+w])
+    i = len(regions)
+    while os.path.exists(artwork_path(file_name, i)):
+        os.remove(artwork_path(file_name, i))
+        i += 1
+
+    # Draw and save
+    img_detected = img.copy()
+    for (x, y, w, h) in regions:
+        cv2.rectangle(img_detected, (x, y), (x+w, y+h), (0, 255, 0), 2)
+    tiled_page.write_image(detection_path(file_name), img_detected)
+    print(f"Detection saved: {detection_path(file_name)}")
+    return len(regions)
+
+
+def process_pages(pages):
+    """Run process_page on pages given as (name, path, pdf_page). Used by main
+    and by watch_folder.py. Returns the number of regions found."""
+    for folder in ["extracted_artworks", "detection_results"]:
+        os.makedirs(folder, exist_ok=True)
+    total = 0
+    for file_name, path, index in pages:
+        print(f"\nProcessing: {file_name}")
+        total += process_page(file_name, path, index) or 0
+    page_store.load().prune()
+    return {"artworks": total}
+
+
+def main():
+    print("=" * 50)
+    print("ART COLLECTION - SIMPLE PIPELINE")
+    print("=" * 50)
+
+    # Check scans folder
+    scans_folder = "scans"
+    if not os.path.exists(scans_folder):
+        print("[ERROR] 'scans' folder not found!")
+        exit()
+
+    # Image files, and every page of each PDF
+    pages = pdf_pages.list_pages(scans_folder)
+    if not pages:
+        print("[ERROR] No image or PDF files in 'scans' folder!")
+        exit()
+
+    print(f"Found {len(pages)} page(s) in 'scans' folder")
+
+    total = process_pages(pages)["artworks"]
+    print(f"\nExtracted {total} artworks to 'extracted_artworks/'")
+
+    print("\n" + "=" * 50)
+    print("DONE! Check the output folders.")
+
 
-print("\n" + "=" * 50)
-print("DONE! Check the output folders.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
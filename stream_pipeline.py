@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+
+# Pages waiting between two stages. Small and fixed, so memory stays flat
+# no matter how many pages are in the batch.
+QUEUE_SIZE = 2
+
+_DONE = object()
+
+
+class StageStats:
+    """Items and busy time of one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.errors = 0
+
+    def add(self, seconds, items=1):
+        self.items += items
+        self.busy += seconds
+
+    def throughput(self):
+        return self.items / self.busy if self.busy > 0 else 0.0
+
+
+def _run_stage(func, stats, inbox, outbox):
+    while True:
+        item = inbox.get()
+        if item is _DONE:
+            outbox.put(_DONE)
+            return
+        start = time.perf_counter()
+        try:
+            out = func(item)
+        except Exception as e:
+            stats.errors += 1
+            print(f"  ERROR in {stats.name}: {type(e).__name__}: {e}")
+            out = None
+        stats.add(time.perf_counter() - start)
+        # A stage returns None to drop an item (e.g. unreadable page)
+        if out is not None:
+            outbox.put(out)
+
+
+def _run_batch_stage(func, batch_size, stats, inbox, outbox):
+    done = False
+    while not done:
+        # Wait until batch_size items are in hand or the input ends
+        batch = []
+        while len(batch) < batch_size:
+            item = inbox.get()
+            if item is _DONE:
+                done = True
+                break
+            batch.append(item)
+        if batch:
+            start = time.perf_counter()
+            try:
+                out = func(batch)
+            except Exception as e:
+                stats.errors += 1
+                print(f"  ERROR in {stats.name}: {type(e).__name__}: {e}")
+                out = []
+            stats.add(time.perf_counter() - start, len(batch))
+            for item in out:
+                if item is not None:
+                    outbox.put(item)
+    outbox.put(_DONE)
+
+
+def run_pipeline(items, stages, stats=None, queue_size=QUEUE_SIZE):
+    """Push items through stages, each running in its own thread and connected
+    by bounded queues. stages is a list of (name, func), or (name, func, batch_size)
+    for a stage that takes a list of up to batch_size items and returns a list.
+    Yields the output of the last stage in input order. Pass a list as stats to
+    receive StageStats."""
+    if stats is None:
+        stats = []
+    stats.extend(StageStats(stage[0]) for stage in stages)
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = []
+    for stage, st, inbox, outbox in zip(stages, stats, queues, queues[1:]):
+        if len(stage) == 3:
+            args = (stage[1], stage[2], st, inbox, outbox)
+            t = threading.Thread(target=_run_batch_stage, args=args, daemon=True)
+        else:
+            t = threading.Thread(target=_run_stage, args=(stage[1], st, inbox, outbox), daemon=True)
+        t.start()
+        threads.append(t)
+
+    # Feed the first queue from a thread too, so the consumer can run meanwhile
+    def feed():
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(_DONE)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    while True:
+        out = queues[-1].get()
+        if out is _DONE:
+            break
+        yield out
+
+    for t in threads:
+        t.join()
+
+
+def print_stage_report(stats, wall_time):
+    """Print per-stage throughput; the stage with the most busy time is the bottleneck."""
+    print("\nStage throughput:")
+    slowest = max(stats, key=lambda s: s.busy) if stats else None
+    for s in stats:
+        mark = "  <- bottleneck" if s is slowest and s.busy > 0 else ""
+        print(f"  {s.name:<8} {s.items:5} items  {s.busy:7.2f}s busy  "
+              f"{s.throughput():7.2f} items/s{mark}")
+    if wall_time > 0 and stats:
+        print(f"  overall  {stats[-1].items / wall_time:.2f} pages/s ({wall_time:.2f}s wall)")
@@ -0,0 +1,96 @@
+import random
+import cv2
+import numpy as np
+
+WORDS = ("exhibition gallery cairo paris oil canvas gouache portrait studies village "
+         "nile watercolour collection museum prize biography travels").split()
+
+
+def _free_spot(rng, taken, width, height, w, h, tries=50):
+    """Random (x, y) where a w x h box fits without touching any taken box."""
+    for _ in range(tries):
+        x = rng.randint(0, max(0, width - w))
+        y = rng.randint(0, max(0, height - h))
+        if all(x + w + 10 < tx or tx + tw + 10 < x or y + h + 10 < ty or ty + th + 10 < y
+               for (tx, ty, tw, th) in taken):
+            return x, y
+    return None
+
+
+def draw_text_block(page, rng, x, y, w, h, scale):
+    # Draw into a view of the block so lines are clipped at its edge
+    block = page[y:y + h, x:x + w]
+    line_h = max(8, int(26 * scale))
+    for ly in range(line_h, h, line_h):
+        words = " ".join(rng.choice(WORDS) for _ in range(12))
+        cv2.putText(block, words, (0, ly), cv2.FONT_HERSHEY_SIMPLEX, 0.6 * scale,
+                    (30, 30, 30), max(1, int(scale)), cv2.LINE_AA)
+
+
+def draw_painting(page, rng, x, y, w, h, scale):
+    """Colorful, organic content inside a dark frame."""
+    frame = max(4, int(min(w, h) * 0.06))
+    page[y:y + h, x:x + w] = (rng.randint(20, 60), rng.randint(20, 50), rng.randint(10, 40))
+
+    inner = np.empty((h - 2 * frame, w - 2 * frame, 3), np.uint8)
+    inner[:] = [rng.randint(60, 220) for _ in range(3)]
+    for _ in range(rng.randint(15, 40)):
+        cx = rng.randint(0, inner.shape[1] - 1)
+        cy = rng.randint(0, inner.shape[0] - 1)
+        axes = (rng.randint(5, max(6, inner.shape[1] // 3)), rng.randint(5, max(6, inner.shape[0] // 3)))
+        color = [rng.randint(0, 255) for _ in range(3)]
+        cv2.ellipse(inner, (cx, cy), axes, rng.randint(0, 180), 0, 360, color, -1)
+    inner = cv2.GaussianBlur(inner, (0, 0), max(1.0, 2 * scale))
+    page[y + frame:y + h - frame, x + frame:x + w - frame] = inner
+
+
+def draw_button(page, rng, x, y, w, h, scale):
+    """UI-like solid button: one saturated color and a short white label."""
+    color = rng.choice([(219, 142, 66), (53, 67, 234), (83, 168, 52), (5, 188, 251)])
+    cv2.rectangle(page, (x, y), (x + w, y + h), color, -1)
+    cv2.putText(page, rng.choice(WORDS).upper(), (x + w // 8, y + h * 2 // 3),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7 * scale, (255, 255, 255), max(1, int(2 * scale)), cv2.LINE_AA)
+
+
+def make_page(long_side, seed=0, paintings=None):
+    """Synthetic catalogue page. Returns (image, ground-truth painting boxes).
+
+    The page mixes text blocks, framed paintings and solid UI buttons; only the
+    paintings are ground truth."""
+    rng = random.Random(seed)
+    width, height = int(long_side * 0.7), long_side
+    scale = long_side / 1792
+    page = np.full((height, width, 3), (rng.randint(235, 250),) * 3, np.uint8)
+    taken = []
+    truth = []
+
+    if paintings is None:
+        paintings = rng.randint(0, 3)
+
+    for _ in range(paintings):
+        w = int(rng.uniform(0.15, 0.45) * width)
+        h = int(w * rng.uniform(0.6, 1.4))
+        spot = _free_spot(rng, taken, width - int(60 * scale), height - int(60 * scale), w, h)
+        if spot:
+            x, y = spot[0] + int(30 * scale), spot[1] + int(30 * scale)
+            draw_painting(page, rng, x, y, w, h, scale)
+            taken.append((x, y, w, h))
+            truth.append((x, y, w, h))
+
+    for _ in range(rng.randint(0, 3)):
+        w, h = int(rng.uniform(0.1, 0.2) * width), int(rng.uniform(0.03, 0.06) * height)
+        spot = _free_spot(rng, taken, width, height, w, h)
+        if spot:
+            draw_button(page, rng, spot[0], spot[1], w, h, scale)
+            taken.append((spot[0], spot[1], w, h))
+
+    for _ in range(rng.randint(2, 6)):
+        w, h = int(rng.uniform(0.4, 0.9) * width), int(rng.uniform(0.05, 0.2) * height)
+        spot = _free_spot(rng, taken, width, height, w, h)
+        if spot:
+            draw_text_block(page, rng, spot[0], spot[1], w, h, scale)
+            taken.append((spot[0], spot[1], w, h))
+
+    # Scanner noise (uint8, so a 10k page does not need gigabytes of floats)
+    noise = np.random.default_rng(seed).integers(0, 8, page.shape, dtype=np.uint8)
+    return cv2.subtract(page, noise), truth
@@ -2,65 +2,113 @@ import cv2
 import numpy as np
 import os
 
-print("Testing file that should contain artwork...")
-file_path = "scans/Margo_Veillon_Painting_Tenderness_1973.PNG"
-
-if os.path.exists(file_path):
-    img = cv2.imread(file_path)
-    print(f"Image size: {img.shape[1]}x{img.shape[0]}")
-    
-    # Show a small preview (first 500x500 pixels)
-    preview = img[:500, :500]
-    cv2.imwrite("preview_top_left.jpg", preview)
-    print("Preview saved: preview_top_left.jpg")
-    print("Check this file - what do you see? Artwork or text?")
-    
-    # Check image composition
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Look for framed artwork (dark border around lighter center)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    # Use multiple methods
-    print("\nTrying different detection methods:")
-    
-    # Method 1: Look for rectangular regions
-    edges = cv2.Canny(blur, 30, 100)
+import fused_detector
+import page_store
+
+
+def method_edges(blur, derived=None):
+    """Method 1: Look for rectangular regions."""
+    edges = derived.canny(30, 100) if derived is not None else cv2.Canny(blur, 30, 100)
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    print(f"Method 1 (edges): Found {len(contours)} contours")
-    
-    # Method 2: Look for color regions
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    return contours
+
+
+def method_saturation(img, derived=None):
+    """Method 2: Look for color regions."""
+    hsv = derived.hsv() if derived is not None else cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     saturation = hsv[:, :, 1]
     _, sat_thresh = cv2.threshold(saturation, 40, 255, cv2.THRESH_BINARY)
     sat_contours, _ = cv2.findContours(sat_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    print(f"Method 2 (color): Found {len(sat_contours)} saturated regions")
-    
-    # Method 3: Simple - look for non-white regions
+    return sat_contours
+
+
+def method_nonwhite(gray):
+    """Method 3: Simple - look for non-white regions."""
     _, binary = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
     binary_contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    print(f"Method 3 (non-white): Found {len(binary_contours)} dark regions")
-    
-    # Filter and show largest region
-    if binary_contours:
-        largest = max(binary_contours, key=cv2.contourArea)
-        area = cv2.contourArea(largest)
-        if area > 10000:  # Significant size
-            x, y, w, h = cv2.boundingRect(largest)
-            print(f"\nLargest non-white region:")
-            print(f"  Position: ({x}, {y})")
-            print(f"  Size: {w}x{h} pixels")
-            print(f"  Area: {area:.0f} px²")
-            
-            # Crop it
-            artwork = img[y:y+h, x:x+w]
-            cv2.imwrite("potential_artwork.jpg", artwork)
-            print(f"\nExtracted: potential_artwork.jpg")
-        else:
-            print("\nNo large artwork regions found - may be text-only")
-    
-else:
-    print(f"File not found: {file_path}")
\ No newline at end of file
+    return binary_contours
+
+
+def largest_region(contours, min_area=10000):
+    """Bounding box and area of the largest contour, or None if it is not significant."""
+    if not contours:
+        return None
+    largest = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(largest)
+    if area <= min_area:  # Significant size
+        return None
+    return cv2.boundingRect(largest), area
+
+
+def main():
+    print("Testing file that should contain artwork...")
+    file_path = "scans/Margo_Veillon_Painting_Tenderness_1973.PNG"
+
+    if os.path.exists(file_path):
+        # With ART_STORE set, later runs map the page and its maps from page_store/
+        store = page_store.PageStore()
+        stored = store.page(file_path)
+        if stored is None:
+            print(f"Could not read {file_path}")
+            store.close()
+            return
+        full = stored.level()
+        img = stored.image()
+        print(f"Image size: {img.shape[1]}x{img.shape[0]}")
+
+        # Show a small preview (first 500x500 pixels)
+        preview = img[:500, :500]
+        cv2.imwrite("preview_top_left.jpg", preview)
+        print("Preview saved: preview_top_left.jpg")
+        print("Check this file - what do you see? Artwork or text?")
+
+        # Check image composition
+        gray = full.gray()
+
+        # Look for framed artwork (dark border around lighter center)
+        blur = full.blur()
+
+        # Use multiple methods
+        print("\nTrying different detection methods:")
+
+        contours = method_edges(blur, full)
+        print(f"Method 1 (edges): Found {len(contours)} contours")
+
+        sat_contours = method_saturation(img, full)
+        print(f"Method 2 (color): Found {len(sat_contours)} saturated regions")
+
+        binary_contours = method_nonwhite(gray)
+        print(f"Method 3 (non-white): Found {len(binary_contours)} dark regions")
+
+        # The three cues in one pass, combined by a weighted vote (fused_detector.py).
+        # On the labelled scans (box_labels.csv) it finds prints on three of the
+        # four artwork pages, but nothing on this one yet.
+        fused = fused_detector.detect_boxes(img, stored=stored)
+        print(f"Fused cues: Found {len(fused)} candidate regions")
+        for (x, y, w, h) in fused:
+            print(f"  ({x}, {y}) {w}x{h}")
+
+        # Filter and show largest region
+        if binary_contours:
+            found = largest_region(binary_contours)
+            if found:
+                (x, y, w, h), area = found
+                print(f"\nLargest non-white region:")
+                print(f"  Position: ({x}, {y})")
+                print(f"  Size: {w}x{h} pixels")
+                print(f"  Area: {area:.0f} px²")
+
+                # Crop it
+                artwork = img[y:y+h, x:x+w]
+                cv2.imwrite("potential_artwork.jpg", artwork)
+                print(f"\nExtracted: potential_artwork.jpg")
+            else:
+                print("\nNo large artwork regions found - may be text-only")
+        store.close()
+
+    else:
+        print(f"File not found: {file_path}")
+
+
+if __name__ == "__main__":
+    main()
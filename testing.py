@@ -3,83 +3,98 @@ import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras import layers
 from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import ResNet50
 import matplotlib.pyplot as plt
 import os
 
+import build_dataset
+import crop_verifier
+import feature_cache
+
 # 1. SET YOUR DATASET PATH HERE (THIS IS THE ONLY LINE YOU MUST CHANGE)
 data_dir = "G:\My Drive\Library_Internship_Artworks_Project\Margo_Veillon_Dataset"  
+shards_dir = "dataset_shards"  # Pre-resized copy of data_dir, built on the first run
 
 # 2. Setup parameters
 batch_size = 30
 img_height = 224
 img_width = 224
+# "cached": run the frozen ResNet50 once per image (and per flip), cache the
+#           pooled features next to the shards and train only the Dense head
+# "full":   push every image through the backbone on every epoch
+training_mode = "cached"
 
 # 3. Load and prepare the data
+# Images are decoded and resized once into pre-resized shards (see
+# build_dataset.py); every epoch after that reads uint8 arrays through a
+# parallel, cached, prefetching tf.data pipeline instead of decoding JPEGs.
+if not os.path.exists(os.path.join(shards_dir, "split.json")):
+    print("Building pre-resized dataset shards (first run only)...")
+    build_dataset.build(data_dir, shards_dir, validation_split=0.2)
 print("Loading images...")
-train_datagen = ImageDataGenerator(
-    rescale=1./255,        # Normalize pixel values
-    validation_split=0.2,  # Hold back 20% of data for validation
-    horizontal_flip=True   # Simple data augmentation
-)
-
-train_ds = train_datagen.flow_from_directory(
-    data_dir,
-    target_size=(img_height, img_width),
-    batch_size=batch_size,
-    class_mode='binary',
-    subset='training'
-)
-
-val_ds = train_datagen.flow_from_directory(
-    data_dir,
-    target_size=(img_height, img_width),
-    batch_size=batch_size,
-    class_mode='binary',
-    subset='validation'
-)
-
-# 4. Build the model using Transfer Learning
-base_model = ResNet50(weights='imagenet', include_top=False, input_shape=(img_height, img_width, 3))
-base_model.trainable = False  # Freeze the pre-trained base
-
-model = Sequential([
-    base_model,
-    layers.GlobalAveragePooling2D(),
-    layers.Dense(1, activation='sigmoid') # Single output node for binary classification
-])
-
-model.compile(optimizer=Adam(learning_rate=0.001),
-              loss='binary_crossentropy',
-              metrics=['accuracy'])
-
-# 5. Train the model
-print("\nStarting training...")
-history = model.fit(
-    train_ds,
-    epochs=10,
-    validation_data=val_ds
-)
+print(f"Class indices: {build_dataset.load_split(shards_dir)['class_indices']}")
+
+if training_mode == "cached":
+    # 4-5. Build and train: the head trains on cached features (seconds per run),
+    # then is copied into the same ResNet50 + pooling + Dense model as below
+    print("\nStarting training on cached features...")
+    model, history = feature_cache.fit_cached(shards_dir, epochs=10, batch_size=batch_size)
+else:
+    train_ds = build_dataset.make_dataset(
+        shards_dir, 'training',
+        batch_size=batch_size,
+        augment=True,          # Simple data augmentation (horizontal flip)
+        shuffle=True
+    )
+
+    val_ds = build_dataset.make_dataset(
+        shards_dir, 'validation',
+        batch_size=batch_size
+    )
+
+    # 4. Build the model using Transfer Learning
+    base_model = ResNet50(weights='imagenet', include_top=False, input_shape=(img_height, img_width, 3))
+    base_model.trainable = False  # Freeze the pre-trained base
+
+    model = Sequential([
+        base_model,
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(1, activation='sigmoid') # Single output node for binary classification
+    ])
+
+    model.compile(optimizer=Adam(learning_rate=0.001),
+                  loss='binary_crossentropy',
+                  metrics=['accuracy'])
+
+    # 5. Train the model
+    print("\nStarting training...")
+    history = model.fit(
+        train_ds,
+        epochs=10,
+        validation_data=val_ds
+    )
 
 # 6. Plot the results
 acc = history.history['accuracy']
-val_acc = history.history['val_accuracy']
 loss = history.history['loss']
-val_loss = history.history['val_loss']
+# No validation curves when the validation split is empty (cached mode trains without one)
+val_acc = history.history.get('val_accuracy')
+val_loss = history.history.get('val_loss')
 
 epochs_range = range(len(acc))
 
 plt.figure(figsize=(12, 4))
 plt.subplot(1, 2, 1)
 plt.plot(epochs_range, acc, label='Training Accuracy')
-plt.plot(epochs_range, val_acc, label='Validation Accuracy')
+if val_acc:
+    plt.plot(epochs_range, val_acc, label='Validation Accuracy')
 plt.legend(loc='lower right')
 plt.title('Training and Validation Accuracy')
 
 plt.subplot(1, 2, 2)
 plt.plot(epochs_range, loss, label='Training Loss')
-plt.plot(epochs_range, val_loss, label='Validation Loss')
+if val_loss:
+    plt.plot(epochs_range, val_loss, label='Validation Loss')
 plt.legend(loc='upper right')
 plt.title('Training and Validation Loss')
 
@@ -87,4 +102,7 @@ plt.show()
 
 # 7. Save the trained model for later use
 model.save('margo_veillon_classifier.keras')
+# Which output is Margo Veillon, for crop_verifier.py
+crop_verifier.save_class_indices('margo_veillon_classifier.keras',
+                                 build_dataset.load_split(shards_dir)['class_indices'])
 print("Model saved as 'margo_veillon_classifier.keras'")
\ No newline at end of file
@@ -9,6 +9,8 @@ import matplotlib.pyplot as plt
 import os
 import sys
 
+import crop_verifier
+
 # 1. SET YOUR DATASET PATH HERE
 data_dir = "G:\My Drive\Library_Internship_Artworks_Project\Margo_Veillon_Dataset"  # <--- CHANGE THIS TO YOUR PATH
 print(f"Data directory: {data_dir}")
@@ -78,6 +80,7 @@ try:
     
     # 5. Save if successful
     model.save('margo_veillon_classifier.keras')
+    crop_verifier.save_class_indices('margo_veillon_classifier.keras', train_ds.class_indices)
     print("Model saved successfully!")
 
 except Exception as e:
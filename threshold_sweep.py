@@ -0,0 +1,290 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmark import IOU_MATCH, synthetic_set
+from detection_cache import content_hash, params_key
+import pdf_pages
+from pyramid import REFERENCE_SIDE
+import scan_pipeline
+import tiled_page
+
+SWEEP_CACHE = "sweep_cache"
+LABELS_PATH = "box_labels.csv"
+
+# Values tried for each scan_pipeline parameter; missing ones keep their
+# PARAMS value. Parameters that change the page work (the edge maps) are
+# "page" parameters: candidates and their features are extracted once per
+# page for each combination of them. Every other combination only filters
+# those features again.
+PAGE_PARAMS = ["detect_side", "canny_low", "canny_high", "roi_canny_low", "roi_canny_high"]
+GRID = {
+    "canny_low": [20, 30, 50],
+    "canny_high": [100, 150],
+    "min_area": [4000, 8000, 12000],
+    "max_area": [200000, 400000],
+    "min_aspect": [0.3, 0.4],
+    "max_aspect": [2.5, 3.0],
+    "margin": [0, 20],
+    "min_hue_std": [5, 10, 15, 20],
+    "min_edge_density": [0.005, 0.01, 0.02],
+    "max_edge_density": [0.3, 0.5],
+}
+
+# Filter settings evaluated per call: a (settings x candidates) mask per check
+SETTINGS_PER_CHUNK = 256
+WORKERS = os.cpu_count() or 1
+
+
+def load_labels(path=LABELS_PATH, folder="scans"):
+    """Labelled pages as [(name, path, index, truth boxes)]. Rows are
+    page,x,y,w,h in full-page pixels; a row with no box marks a page without
+    artwork. Pages of the folder without rows are left out."""
+    truth = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            boxes = truth.setdefault(row["page"], [])
+            if row.get("x"):
+                boxes.append(tuple(int(row[k]) for k in ("x", "y", "w", "h")))
+    return [(name, path, index, truth[name])
+            for name, path, index in pdf_pages.list_pages(folder) if name in truth]
+
+
+def expand(grid):
+    """All combinations of a grid as (page settings, [filter settings])."""
+    base = dict(scan_pipeline.PARAMS)
+    axes = {k: list(v) for k, v in grid.items()}
+    page_axes = [k for k in PAGE_PARAMS if k in axes]
+    filter_axes = [k for k in axes if k not in PAGE_PARAMS]
+    filters = [dict(zip(filter_axes, values))
+               for values in itertools.product(*(axes[k] for k in filter_axes))]
+    for values in itertools.product(*(axes[k] for k in page_axes)):
+        page = {k: base[k] for k in PAGE_PARAMS}
+        page.update(zip(page_axes, values))
+        yield page, [dict(base, **page, **f) for f in filters]
+
+
+def page_features(img, page_params):
+    """Every candidate of one page under one page setting, before any filter:
+    boxes in full-page pixels, and area, aspect, distance to the page edge
+    (in reference units, like the thresholds), hue std and edge density."""
+    small, scale = tiled_page.downscale(img, page_params["detect_side"])
+    k = max(small.shape[:2]) / REFERENCE_SIDE
+    gray, regions = scan_pipeline.candidate_regions(small, page_params)
+    features = scan_pipeline.region_features(small, gray, regions, page_params)
+    x, y, w, h, area = regions.T
+    small_h, small_w = small.shape[:2]
+    edge = np.minimum.reduce([x, y, small_w - (x + w), small_h - (y + h)])
+    return {
+        "boxes": np.round(regions[:, :4] / scale).astype(np.int64),
+        "area": area / (k * k),
+        "aspect": w / np.maximum(h, 1),
+        "edge": edge / k,
+        "hue_std": features["hue_std"],
+        "edge_density": features["edge_density"],
+    }
+
+
+def _cache_path(file_hash, page_params):
+    key = hashlib.sha256((file_hash + params_key(page_params)).encode()).hexdigest()[:32]
+    return os.path.join(SWEEP_CACHE, f"{key}.npz")
+
+
+def _extract(job):
+    """Features of one page for each page setting, read from the sweep cache
+    or computed (the page is decoded at most once). Returns
+    [(features, seconds)]; seconds is the extraction time, also when cached."""
+    path, index, file_hash, settings = job
+    results, img = [], None
+    for page_params in settings:
+        cached = _cache_path(file_hash, page_params)
+        if os.path.exists(cached):
+            with np.load(cached) as data:
+                features = {k: data[k] for k in data.files if k != "seconds"}
+                results.append((features, float(data["seconds"])))
+            continue
+        if img is None:
+            img = pdf_pages.read_page(path, index)
+        start = time.perf_counter()
+        features = page_features(img, page_params)
+        seconds = time.perf_counter() - start
+        np.savez(cached, seconds=seconds, **features)
+        results.append((features, seconds))
+    return results
+
+
+def box_iou(a, b):
+    """IoU of every box of a against every box of b, as an (len(a), len(b)) array."""
+    a = np.asarray(a, np.float64).reshape(-1, 4)
+    b = np.asarray(b, np.float64).reshape(-1, 4)
+    iw = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2]) \
+        - np.maximum(a[:, None, 0], b[None, :, 0])
+    ih = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3]) \
+        - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return inter / np.maximum(union, 1)
+
+
+def candidate_table(pages, truth):
+    """Candidates of all pages in one set of arrays, with the labelled box
+    (global index) each one matches at IOU_MATCH, or -1."""
+    columns = {k: [] for k in ("area", "aspect", "edge", "hue_std", "edge_density")}
+    matches, offset = [], 0
+    for features, boxes in zip(pages, truth):
+        for k in columns:
+            columns[k].append(features[k])
+        match = np.full(len(features["boxes"]), -1, np.int64)
+        if boxes and len(match):
+            iou = box_iou(features["boxes"], boxes)
+            best = iou.argmax(1)
+            hit = iou[np.arange(len(match)), best] >= IOU_MATCH
+            match[hit] = best[hit] + offset
+        matches.append(match)
+        offset += len(boxes)
+    table = {k: np.concatenate(v) if v else np.empty(0) for k, v in columns.items()}
+    table["match"] = np.concatenate(matches) if matches else np.empty(0, np.int64)
+    table["labelled"] = offset
+    return table
+
+
+def evaluate(table, settings):
+    """(kept boxes, true positives) of each filter setting, all settings
+    checked against all candidates at once. A labelled box counts once
+    however many candidates match it, like benchmark.match_boxes."""
+    def column(name):
+        return np.array([s[name] for s in settings], np.float64)[:, None]
+
+    keep = (table["area"] >= column("min_area")) & (table["area"] <= column("max_area"))
+    keep &= (table["aspect"] >= column("min_aspect")) & (table["aspect"] <= column("max_aspect"))
+    keep &= table["edge"] >= column("margin")
+    keep &= table["hue_std"] >= column("min_hue_std")
+    keep &= (table["edge_density"] >= column("min_edge_density")) & \
+        (table["edge_density"] <= column("max_edge_density"))
+
+    # Only candidates that match a labelled box can be true positives
+    matched = np.flatnonzero(table["match"] >= 0)
+    hits = np.zeros((len(settings), table["labelled"]), bool)
+    for row, kept in enumerate(keep[:, matched]):
+        hits[row, table["match"][matched[kept]]] = True
+    return keep.sum(1), hits.sum(1)
+
+
+_tables = {}
+
+
+def _init_worker(tables):
+    _tables.update(tables)
+
+
+def _evaluate_chunk(job):
+    key, settings = job
+    start = time.perf_counter()
+    kept, tp = evaluate(_tables[key], settings)
+    return key, settings, kept, tp, time.perf_counter() - start
+
+
+def sweep(pages, grid, workers=WORKERS):
+    """Evaluate every setting of the grid on labelled pages, given as
+    [(name, path, index, truth boxes)]. Returns one result dict per setting."""
+    os.makedirs(SWEEP_CACHE, exist_ok=True)
+    combos = list(expand(grid))
+    page_settings = [page for page, _ in combos]
+
+    # Phase 1: candidates and features, once per page and page setting
+    start = time.perf_counter()
+    jobs = [(path, index, content_hash(path) + f":{index}", page_settings)
+            for _, path, index, _ in pages]
+    with ProcessPoolExecutor(max_workers=workers, initializer=pdf_pages.close_documents) as pool:
+        extracted = list(pool.map(_extract, jobs))
+    print(f"Features: {len(pages)} pages x {len(page_settings)} page settings "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    # Phase 2: every filter setting, in chunks spread over the workers
+    start = time.perf_counter()
+    tables, seconds, chunks = {}, {}, []
+    for key, (page, filters) in enumerate(combos):
+        tables[key] = candidate_table([e[key][0] for e in extracted], [p[3] for p in pages])
+        seconds[key] = float(np.mean([e[key][1] for e in extracted])) if extracted else 0.0
+        chunks += [(key, filters[i:i + SETTINGS_PER_CHUNK])
+                    for i in range(0, len(filters), SETTINGS_PER_CHUNK)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tables,)) as pool:
+        for key, settings, kept, tp, elapsed in pool.map(_evaluate_chunk, chunks):
+            labelled = tables[key]["labelled"]
+            for params, n, hits in zip(settings, kept.tolist(), tp.tolist()):
+                precision = hits / n if n else 0.0
+                recall = hits / labelled if labelled else 0.0
+                f1 = 2 * precision * recall / (precision + recall) if hits else 0.0
+                results.append({"params": params, "precision": precision, "recall": recall,
+                                "f1": f1, "boxes": n, "page_sec": seconds[key],
+                                "eval_sec": elapsed / len(settings)})
+    print(f"Evaluated {len(results)} settings in {time.perf_counter() - start:.1f}s")
+    return results
+
+
+def print_results(results, top):
+    varied = [k for k in sorted(results[0]["params"]) if len({json.dumps(r["params"][k]) for r in results}) > 1] \
+        if results else []
+    default = {k: scan_pipeline.PARAMS[k] for k in varied}
+    print(f"\n  {'f1':>5} {'prec':>5} {'recall':>6} {'boxes':>6} {'s/page':>7}  settings")
+    best = sorted(results, key=lambda r: (-r["f1"], r["page_sec"]))[:top]
+    current = [r for r in results if {k: r["params"][k] for k in varied} == default]
+    for r in best + [r for r in current if r not in best]:
+        mark = " (PARAMS)" if r in current else ""
+        values = " ".join(f"{k}={r['params'][k]}" for k in varied)
+        print(f"  {r['f1']:5.2f} {r['precision']:5.2f} {r['recall']:6.2f} {r['boxes']:6d} "
+              f"{r['page_sec']:7.3f}  {values}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Threshold sweep for the scan_pipeline filters")
+    parser.add_argument("--labels", help=f"labelled boxes (e.g. {LABELS_PATH}); default: synthetic pages")
+    parser.add_argument("--folder", default="scans", help="pages the labels refer to")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000],
+                        help="long side of the synthetic pages, in pixels")
+    parser.add_argument("--pages", type=int, default=5, help="synthetic pages per size")
+    parser.add_argument("--grid", help="JSON file of {parameter: [values]} to use instead of GRID")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--out", help="write every setting and its scores to this CSV file")
+    args = parser.parse_args()
+
+    grid = GRID
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    settings = sum(len(filters) for _, filters in expand(grid))
+    print(f"Grid: {settings} settings")
+
+    with tempfile.TemporaryDirectory() as folder:
+        if args.labels:
+            pages = load_labels(args.labels, args.folder)
+        else:
+            pages = [(os.path.basename(path), path, None, truth)
+                     for path, truth in synthetic_set(folder, args.sizes, args.pages)]
+        print(f"Labelled pages: {len(pages)}, boxes: {sum(len(p[3]) for p in pages)}")
+        results = sweep(pages, grid, args.workers)
+    print_results(results, args.top)
+
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            writer = csv.writer(f)
+            keys = sorted(results[0]["params"]) if results else []
+            writer.writerow(keys + ["precision", "recall", "f1", "boxes", "page_sec", "eval_sec"])
+            for r in results:
+                writer.writerow([r["params"][k] for k in keys] +
+                                [r[k] for k in ("precision", "recall", "f1", "boxes", "page_sec", "eval_sec")])
+        print(f"\nSaved: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import mmap
+import os
+
+import cv2
+import numpy as np
+
+import instrumentation as metrics
+from pyramid import build_pyramid as build_full_pyramid, downscale as downscale_full
+
+# Working memory allowed per page, in MB. Bands and tiles are sized to fit it,
+# so peak RSS stays the same whatever the page size (set ART_MEMORY_MB to change).
+MEMORY_BUDGET_MB = int(os.environ.get("ART_MEMORY_MB", 256))
+
+# Binary PPM scans are memory-mapped and read band by band instead of being
+# decoded whole. OpenCV can only decode PNG/JPEG in one piece, so convert very
+# large scans once with cv2.imwrite("page.ppm", img) to get bounded memory.
+MAPPED_EXTS = ('.ppm',)
+
+
+def budget_bytes():
+    return MEMORY_BUDGET_MB << 20
+
+
+def _ppm_header(mm):
+    """(width, height, maxval, data offset) of a binary P6 file."""
+    tokens = []
+    pos = 0
+    while len(tokens) < 4:
+        # Skip whitespace and comments between header fields
+        while mm[pos:pos + 1].isspace():
+            pos += 1
+        if mm[pos:pos + 1] == b"#":
+            pos = mm.find(b"\n", pos) + 1
+            continue
+        start = pos
+        while not mm[pos:pos + 1].isspace():
+            pos += 1
+        tokens.append(mm[start:pos])
+    if tokens[0] != b"P6":
+        raise ValueError("not a binary PPM")
+    # Exactly one whitespace byte separates the header from the pixels
+    return int(tokens[1]), int(tokens[2]), int(tokens[3]), pos + 1
+
+
+class MappedPage:
+    """A PPM page on disk that behaves like a read-only BGR array for slicing.
+
+    page[y0:y1, x0:x1] returns a BGR copy of that region, and the file pages
+    it touched are dropped from memory right away."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        width, height, maxval, offset = _ppm_header(self.mm)
+        if maxval != 255:
+            raise ValueError("only 8-bit PPM can be mapped")
+        self.shape = (height, width, 3)
+        self.offset = offset
+        self.rgb = np.ndarray(self.shape, np.uint8, buffer=self.mm, offset=offset)
+
+    @property
+    def nbytes(self):
+        return self.rgb.nbytes
+
+    def __getitem__(self, key):
+        region = np.ascontiguousarray(self.rgb[key][..., ::-1])
+        rows = key[0] if isinstance(key, tuple) else key
+        start, stop, _ = rows.indices(self.shape[0]) if isinstance(rows, slice) else (rows, rows + 1, 1)
+        self.release(start, stop)
+        return region
+
+    def release(self, y0, y1):
+        """Drop rows y0..y1 of the mapping from the resident set."""
+        row = self.shape[1] * 3
+        start = (self.offset + y0 * row) // mmap.PAGESIZE * mmap.PAGESIZE
+        stop = min(len(self.mm), self.offset + y1 * row)
+        if stop > start:
+            self.mm.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+
+def open_page(path):
+    """The page as a MappedPage when it can be mapped, else a decoded BGR array
+    (None if unreadable, like cv2.imread)."""
+    if path.lower().endswith(MAPPED_EXTS):
+        try:
+            return MappedPage(path)
+        except (ValueError, OSError):
+            pass
+    return cv2.imread(path)
+
+
+def band_rows(width, bytes_per_pixel):
+    """Rows per band so that one band of working memory fits the budget."""
+    return max(1, budget_bytes() // max(1, width * bytes_per_pixel))
+
+
+def downscale(img, long_side):
+    """pyramid.downscale for arrays or MappedPages. A MappedPage is resized band
+    by band; it is returned as is when no resizing is needed and it would not fit
+    the budget (callers then work on it in tiles)."""
+    if not isinstance(img, MappedPage):
+        return downscale_full(img, long_side)
+
+    height, width = img.shape[:2]
+    scale = min(1.0, long_side / max(height, width))
+    if scale == 1.0:
+        if img.nbytes <= budget_bytes():
+            return img[:, :], 1.0
+        return img, 1.0
+
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    out = np.empty((size[1], size[0], 3), np.uint8)
+    # Band copy plus its resized part
+    rows = band_rows(width, 3 * 2)
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        oy0, oy1 = round(y0 * scale), min(size[1], round(y1 * scale))
+        if oy1 > oy0:
+            out[oy0:oy1] = cv2.resize(img[y0:y1, :], (size[0], oy1 - oy0), interpolation=cv2.INTER_AREA)
+    return out, scale
+
+
+def build_pyramid(img, long_side, levels=1, factor=0.5):
+    """pyramid.build_pyramid for arrays or MappedPages."""
+    if not isinstance(img, MappedPage):
+        return build_full_pyramid(img, long_side, levels, factor)
+    base, scale = downscale(img, long_side)
+    if not isinstance(base, MappedPage):
+        return [(level, scale * s) for level, s in build_full_pyramid(base, max(base.shape[:2]), levels, factor)]
+    # Full resolution did not fit: every coarser level comes from the file too
+    pyramid = [(base, scale)]
+    for i in range(1, levels):
+        side = round(max(img.shape[:2]) * factor ** i)
+        if min(img.shape[:2]) * factor ** i < 32:
+            break
+        pyramid.append(downscale(img, side))
+    return pyramid
+
+
+def detect_tiled(img, detect, bytes_per_pixel, overlap, align=1):
+    """Run detect(tile) -> [(x, y, w, h)] over overlapping tiles so its working
+    memory (bytes_per_pixel per tile pixel) fits the budget. Returns page boxes.
+
+    overlap must be at least the largest object the detector can return: every
+    object then lies whole inside some tile, and boxes touching an inner tile
+    edge (objects cut by the seam) are dropped. Duplicates from the overlaps
+    are left to the caller's box fusion. Tile origins are multiples of align,
+    so grid detectors keep the same grid as on the whole page."""
+    height, width = img.shape[:2]
+    if height * width * bytes_per_pixel <= budget_bytes():
+        return detect(img[:, :] if isinstance(img, MappedPage) else img)
+
+    side = max(int(np.sqrt(budget_bytes() / bytes_per_pixel)), 2 * overlap + align)
+    step = max(align, (side - overlap) // align * align)
+    boxes = []
+    tiles = 0
+    for ty in range(0, max(1, height - overlap), step):
+        for tx in range(0, max(1, width - overlap), step):
+            tile = np.ascontiguousarray(img[ty:ty + side, tx:tx + side])
+            th, tw = tile.shape[:2]
+            tiles += 1
+            for (x, y, w, h) in detect(tile):
+                # Cut by a seam: the whole object is found in a neighbouring tile
+                if (x <= 0 < tx) or (y <= 0 < ty) or \
+                        (x + w >= tw and tx + tw < width) or (y + h >= th and ty + th < height):
+                    continue
+                boxes.append((x + tx, y + ty, w, h))
+    metrics.count("tiles", tiles)
+    return boxes
+
+
+def draw_boxes(img, boxes, labels=None, dy=0):
+    """Draw boxes (shifted up by dy) in place."""
+    for i, (x, y, w, h) in enumerate(boxes):
+        cv2.rectangle(img, (x, y - dy), (x+w, y+h - dy), (0, 255, 0), 3)
+        if labels:
+            cv2.putText(img, labels[i], (x, y-10 - dy),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+
+def write_image(path, img):
+    """cv2.imwrite under a temporary name, then rename, so anything reading the
+    output folders never sees a half-written file. Returns False on failure."""
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.tmp{ext}"
+    if not cv2.imwrite(tmp, img):
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+def write_annotated(path, img, boxes, labels=None):
+    """Write the page with its boxes drawn, without a second full copy of it.
+
+    A decoded page is drawn on in place, so call this after the crops are
+    written. A MappedPage is streamed to a PPM band by band."""
+    if not isinstance(img, MappedPage):
+        with metrics.stage("annotate"):
+            draw_boxes(img, boxes, labels)
+        with metrics.stage("page_write"):
+            write_image(path, img)
+        return
+
+    height, width = img.shape[:2]
+    rows = band_rows(width, 3 * 2)
+    tmp = path + ".tmp"
+    with metrics.stage("page_write"), open(tmp, "wb") as f:
+        f.write(f"P6\n{width} {height}\n255\n".encode())
+        for y0 in range(0, height, rows):
+            band = img[y0:min(height, y0 + rows), :]
+            draw_boxes(band, boxes, labels, y0)
+            f.write(np.ascontiguousarray(band[..., ::-1]).tobytes())
+    os.replace(tmp, path)
@@ -0,0 +1,215 @@
+import argparse
+import ctypes
+import ctypes.util
+import importlib
+import os
+import select
+import signal
+import struct
+import time
+
+import pdf_pages
+
+WATCH_FOLDER = "scans"
+DETECTORS = ("scan_pipeline", "ml_art_detector", "simple_pipeline")
+
+# A file is processed once its size and modification time have not changed
+# for this long, so pages still being written by a scanner are left alone
+SETTLE_SECONDS = 1.0
+# Folder listing interval where inotify is not available
+POLL_SECONDS = 1.0
+
+# inotify events that mean a file was written or moved into the folder
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatch:
+    """Names of files written in a folder, from Linux inotify (through libc,
+    no extra package). Nothing runs between events."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.folder = folder
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"cannot watch {folder}")
+
+    def wait(self, timeout=None):
+        """Names with events, after at most timeout seconds (None: until one arrives)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+        while ready:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost: look at every file once
+                    names.update(os.listdir(self.folder))
+                elif name:
+                    names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatch:
+    """Fallback for systems without inotify: compares the size and modification
+    time of every file in the folder every POLL_SECONDS (only a listing; pages
+    are not read again)."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.seen = self._listing()
+
+    def _listing(self):
+        listing = {}
+        for entry in os.scandir(self.folder):
+            if entry.is_file():
+                st = entry.stat()
+                listing[entry.name] = (st.st_size, st.st_mtime_ns)
+        return listing
+
+    def wait(self, timeout=None):
+        time.sleep(POLL_SECONDS if timeout is None else min(timeout, POLL_SECONDS))
+        listing = self._listing()
+        names = {name for name, st in listing.items() if self.seen.get(name) != st}
+        self.seen = listing
+        return names
+
+    def close(self):
+        pass
+
+
+def open_watch(folder):
+    """InotifyWatch where the system has it, PollWatch otherwise."""
+    try:
+        return InotifyWatch(folder)
+    except (OSError, AttributeError) as e:
+        print(f"inotify not available ({e}); polling every {POLL_SECONDS}s")
+        return PollWatch(folder)
+
+
+def is_page_file(name):
+    """Scans and PDFs, but not hidden or temporary files scanners write first."""
+    return not name.startswith((".", "~")) and name.lower().endswith(pdf_pages.IMAGE_EXTS + pdf_pages.PDF_EXTS)
+
+
+class Settler:
+    """Files with events, held back until they stop changing for SETTLE_SECONDS."""
+
+    def __init__(self, folder, settle=SETTLE_SECONDS):
+        self.folder = folder
+        self.settle = settle
+        # name -> (size, mtime_ns, time of the last change seen)
+        self.pending = {}
+
+    def touch(self, names):
+        now = time.monotonic()
+        for name in names:
+            if is_page_file(name):
+                self.pending[name] = (None, None, now)
+
+    def timeout(self):
+        """Seconds until the next pending file could be ready, None if there are none."""
+        if not self.pending:
+            return None
+        due = min(since for _, _, since in self.pending.values()) + self.settle
+        return max(0.05, due - time.monotonic())
+
+    def ready(self):
+        """Pending files that have not changed for the settle time. Files that
+        disappeared (renamed or deleted before they settled) are forgotten."""
+        now = time.monotonic()
+        done = []
+        for name, (size, mtime, since) in list(self.pending.items()):
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                self.pending[name] = (st.st_size, st.st_mtime_ns, now)
+            elif now - since >= self.settle:
+                done.append(name)
+                del self.pending[name]
+        return sorted(done)
+
+
+def watch(folder, detector, catch_up=True, settle=SETTLE_SECONDS):
+    """Run the detector on every file that lands in folder, as soon as it is
+    complete. Outputs are only added or replaced page by page, never wiped.
+    With catch_up, files added while the watcher was stopped are done first
+    (pages already in the detection cache are only stat'ed)."""
+    module = importlib.import_module(detector)
+    watcher = open_watch(folder)
+    settler = Settler(folder, settle)
+    # One manifest for the whole session in manifest mode
+    manifest = None
+
+    def process(pages):
+        nonlocal manifest
+        start = time.perf_counter()
+        result = module.process_pages(pages, manifest) if manifest else module.process_pages(pages)
+        manifest = result.get("manifest") or manifest
+        print(f"[{time.strftime('%H:%M:%S')}] {len(pages)} pages, {result['artworks']} artworks "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    print(f"Watching '{folder}/' with {detector} ({type(watcher).__name__}), Ctrl+C to stop")
+    try:
+        if catch_up:
+            process(pdf_pages.list_pages(folder))
+        while True:
+            settler.touch(watcher.wait(settler.timeout()))
+            pages = []
+            for name in settler.ready():
+                pages += pdf_pages.file_pages(os.path.join(folder, name))
+            if pages:
+                process(pages)
+    except KeyboardInterrupt:
+        print("\nStopped")
+    finally:
+        watcher.close()
+        if manifest:
+            manifest.close()
+
+
+def _stop(signum, frame):
+    # A service manager stops the daemon with SIGTERM; shut down like Ctrl+C
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process scans as they land in a folder")
+    parser.add_argument("folder", nargs="?", default=WATCH_FOLDER)
+    parser.add_argument("--detector", choices=DETECTORS, default="scan_pipeline")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help="seconds a file must stay unchanged before it is processed")
+    parser.add_argument("--new-only", action="store_true",
+                        help="skip the catch-up pass over files already in the folder")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print(f"ERROR: No '{args.folder}' folder")
+        return
+    signal.signal(signal.SIGTERM, _stop)
+    watch(args.folder, args.detector, not args.new_only, args.settle)
+
+
+if __name__ == "__main__":
+    main()